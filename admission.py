@@ -0,0 +1,182 @@
+"""Admission control for Gemini-backed endpoints.
+
+Token buckets enforce requests-per-minute and tokens-per-minute budgets per
+user and globally. Endpoints are either "interactive" (chat, dictionary, ...)
+or "batch" (essay, summarize). Batch requests may only use the global budget
+down to a reserve, so when we get close to the quota they queue briefly and
+are then shed while interactive traffic keeps flowing.
+
+Bucket state lives in a store. MemoryBucketStore (default) is per worker
+process; SqliteBucketStore shares buckets between all workers on a host, and
+anything with the same take()/refund() methods can be plugged in.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+# --- Bucket Stores ---
+class MemoryBucketStore:
+    """In-process buckets, pruned least-recently-used beyond max_keys."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict() # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, capacity, floor=0.0):
+        """Deducts `cost` if the bucket stays >= floor afterwards.
+
+        Returns (allowed, retry_after_seconds).
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [capacity, now]
+                self._buckets[key] = bucket
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            allowed, retry_after = _apply(bucket, cost, rate, floor)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return allowed, retry_after
+
+    def refund(self, key, amount, capacity):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None: bucket[0] = min(capacity, bucket[0] + amount)
+
+
+class SqliteBucketStore:
+    """Buckets in a SQLite file shared by every worker process on the host."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def take(self, key, cost, rate, capacity, floor=0.0):
+        now = time.time() # Wall clock: monotonic clocks aren't comparable across processes
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                bucket = [capacity, now] if row is None else [min(capacity, row[0] + max(0.0, now - row[1]) * rate), now]
+                allowed, retry_after = _apply(bucket, cost, rate, floor)
+                conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, bucket[0], now))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return allowed, retry_after
+
+    def refund(self, key, amount, capacity):
+        with self._lock:
+            self._conn.execute("UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?", (capacity, amount, key))
+
+
+def _apply(bucket, cost, rate, floor):
+    if bucket[0] - cost >= floor:
+        bucket[0] -= cost
+        return True, 0.0
+    return False, (cost + floor - bucket[0]) / rate if rate > 0 else 60.0
+
+
+# --- Admission Controller ---
+class Rejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class AdmissionController:
+    """Checks per-user and global RPM/TPM buckets before a request runs."""
+
+    def __init__(self, store, user_rpm=20, user_tpm=20000, global_rpm=600, global_tpm=1000000,
+                 batch_reserve=0.2, batch_queue_timeout=5.0, poll_interval=0.25):
+        self.store = store
+        self.user_rpm = user_rpm
+        self.user_tpm = user_tpm
+        self.global_rpm = global_rpm
+        self.global_tpm = global_tpm
+        self.batch_reserve = batch_reserve
+        self.batch_queue_timeout = batch_queue_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self.admitted = {INTERACTIVE: 0, BATCH: 0}
+        self.rejected = {}
+        self.queued = 0
+
+    def _limits(self, user_id, priority):
+        """(key, capacity, floor) for each bucket a request must pass (global ones only without a user_id)."""
+        reserve = self.batch_reserve if priority == BATCH else 0.0
+        user = [(f"user:{user_id}:rpm", self.user_rpm, 0.0), (f"user:{user_id}:tpm", self.user_tpm, 0.0)] if user_id is not None else []
+        return user + [
+            ("global:rpm", self.global_rpm, self.global_rpm * reserve),
+            ("global:tpm", self.global_tpm, self.global_tpm * reserve),
+        ]
+
+    def _try_admit(self, user_id, priority, est_tokens):
+        taken = []
+        for key, capacity, floor in self._limits(user_id, priority):
+            cost = 1 if key.endswith(":rpm") else min(est_tokens, capacity) # Oversized requests still fit eventually
+            allowed, retry_after = self.store.take(key, cost, capacity / 60.0, capacity, floor)
+            if not allowed:
+                for taken_key, taken_cost, taken_capacity in taken: # Keep the buckets consistent
+                    self.store.refund(taken_key, taken_cost, taken_capacity)
+                return key, retry_after
+            taken.append((key, cost, capacity))
+        return None, 0.0
+
+    def admit(self, user_id, priority, est_tokens):
+        """Admits the request or raises Rejected (with a Retry-After hint); user_id None skips the per-user buckets.
+
+        Batch requests that only fail a global bucket wait up to
+        batch_queue_timeout for capacity before being shed.
+        """
+        deadline = time.monotonic() + (self.batch_queue_timeout if priority == BATCH else 0)
+        queued = False
+        while True:
+            failed_key, retry_after = self._try_admit(user_id, priority, est_tokens)
+            if failed_key is None:
+                with self._lock: self.admitted[priority] += 1
+                return
+            can_wait = failed_key.startswith("global:") and time.monotonic() + min(retry_after, self.poll_interval) < deadline
+            if not can_wait:
+                reason = f"{failed_key.split(':')[0]}_{failed_key.rsplit(':', 1)[1]}" # e.g. user_rpm, global_tpm
+                with self._lock: self.rejected[reason] = self.rejected.get(reason, 0) + 1
+                raise Rejected(reason, retry_after)
+            if not queued:
+                queued = True
+                with self._lock: self.queued += 1
+            time.sleep(min(retry_after, self.poll_interval))
+
+    def stats(self):
+        return {"admitted": dict(self.admitted), "rejected": dict(self.rejected), "queued": self.queued}
+
+
+def controller_from_env(environ):
+    """Builds the controller configured by ADMISSION_* env vars (None if disabled)."""
+    if environ.get("ADMISSION_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    store_path = environ.get("ADMISSION_STORE_DB")
+    store = SqliteBucketStore(store_path) if store_path else MemoryBucketStore()
+    return AdmissionController(store,
+                               user_rpm=float(environ.get("ADMISSION_USER_RPM", 20)),
+                               user_tpm=float(environ.get("ADMISSION_USER_TPM", 20000)),
+                               global_rpm=float(environ.get("ADMISSION_GLOBAL_RPM", 600)),
+                               global_tpm=float(environ.get("ADMISSION_GLOBAL_TPM", 1000000)),
+                               batch_reserve=float(environ.get("ADMISSION_BATCH_RESERVE", 0.2)),
+                               batch_queue_timeout=float(environ.get("ADMISSION_BATCH_QUEUE_TIMEOUT", 5)))
@@ -1,135 +1,1282 @@
 import os
-import google.generativeai as genai
+import json
+import time
+_import_started = time.perf_counter() # For the startup.imported log line and /readyz
+import select
+import socket
+import secrets
+import hmac
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import google.api_core.exceptions # Binds the `google` name used in the except clauses below (the SDK itself loads lazily, see gemini_models)
 import requests
 # Add send_from_directory
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, send_from_directory
+from flask import Flask, g, render_template, request, jsonify, Response, redirect, url_for, send_from_directory, send_file, stream_with_context, has_request_context, has_app_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
+from response_cache import cache_from_env, make_cache_key
+from semantic_cache import semantic_cache_from_env, singular as semantic_singular
+from lexicon import lexicon_from_env
+from asset_delivery import compress as compress_response, manifest_from_env as asset_manifest_from_env
+import structured_output
+from audio_store import AudioStore, store_from_env as audio_store_from_env
+from singleflight import SingleFlight
+from speech_segments import pipelined, split_sentences
+from prompt_budget import chunk_text, estimate_tokens, fit_history, format_turns, sdk_token_counter, truncate_text
+from sessions import append_turns, new_session_id, new_session_state, store_from_env as session_store_from_env
+from admission import BATCH, INTERACTIVE, Rejected, controller_from_env as admission_from_env
+from elevenlabs_client import CircuitOpenError, client_from_env as elevenlabs_client_from_env
+from content_library import library_from_env
+from jobs import TERMINAL, QueueFull, deliver_webhook, queue_from_env, webhook_allowed
+from image_prep import ImageRejected, NearDuplicateCache, hash_key, prepare_image, read_upload
+from log_setup import EventLogger, configure_logging, sample_rate_from_env
+from metrics import SIZE_BUCKETS, registry_from_env
+from model_router import TIMEOUT_ERRORS, Cancelled, router_from_env
+from gemini_models import models_from_env
+from firebase_auth import AuthError, verifier_from_env as firebase_verifier_from_env
 
 # --- Initialization ---
 # Load environment variables from .env file for local development
 load_dotenv()
 
 app = Flask(__name__) # Standard Flask app initialization
+# Behind reverse proxies (load balancer, CDN), TRUSTED_PROXY_HOPS is how many of them append to X-Forwarded-For;
+# request.remote_addr is then the address the outermost trusted proxy saw. Entries a client adds itself are ignored.
+# 0 means clients connect directly. Unset, client addresses aren't trusted for per-user rate limits (see _admission_user).
+TRUSTED_PROXY_HOPS = int(os.environ["TRUSTED_PROXY_HOPS"]) if os.environ.get("TRUSTED_PROXY_HOPS") else None
+if TRUSTED_PROXY_HOPS: app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+# --- Observability (structured logging + Prometheus metrics) ---
+# LOG_LEVEL / LOG_FORMAT (json|text) / LOG_SAMPLE_RATE control logging; METRICS_DIR
+# (set by gunicorn.conf.py) lets /metrics aggregate every worker's numbers.
+configure_logging(os.environ)
+
+def _route_label():
+    """Route pattern for metric labels (bounded cardinality, unlike raw paths)."""
+    if not has_request_context(): return "-"
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+def _log_context():
+    if not has_request_context(): return {}
+    return {"request_id": g.get('request_id'), "route": _route_label()}
+
+log = EventLogger("adai", sample_rate=sample_rate_from_env(os.environ), context=_log_context)
+metrics = registry_from_env(os.environ)
+
+HTTP_REQUESTS = metrics.counter("adai_http_requests_total", "HTTP requests by route, method and status.", ("route", "method", "status"))
+HTTP_IN_FLIGHT = metrics.gauge("adai_http_requests_in_flight", "Requests currently being handled (summed over live workers).")
+HTTP_LATENCY = metrics.histogram("adai_http_request_duration_seconds", "Request latency until the response (including streamed bodies) is closed.", ("route", "method"))
+UPSTREAM_LATENCY = metrics.histogram("adai_upstream_request_duration_seconds", "Upstream API call latency by outcome (ok or exception class).", ("service", "operation", "outcome"))
+PROMPT_CHARS = metrics.histogram("adai_prompt_chars", "Size of prompts sent to Gemini, in characters.", ("route",), buckets=SIZE_BUCKETS)
+RESPONSE_CHARS = metrics.histogram("adai_response_chars", "Size of Gemini responses, in characters.", ("route",), buckets=SIZE_BUCKETS)
+PROMPT_TOKENS = metrics.histogram("adai_prompt_tokens", "Prompt tokens after budgeting.", ("route",), buckets=SIZE_BUCKETS)
+CACHE_LOOKUPS = metrics.counter("adai_cache_lookups_total", "Cache lookups by cache, route and result (hit/miss).", ("cache", "route", "result"))
+STRUCTURED_OUTPUT = metrics.counter("adai_structured_output_total", "Structured (JSON) replies by route and parse outcome (ok, repaired, partial, failed).", ("route", "outcome"))
+ERRORS = metrics.counter("adai_errors_total", "Upstream and processing errors by route and error class.", ("route", "error_class"))
+COMPONENT_EVENTS = metrics.counter("adai_component_events_total", "Cumulative counters kept by internal components (caches, breaker, coalescing, admission).", ("component", "event"))
+COMPONENT_STATE = metrics.gauge("adai_component_state", "Point-in-time values reported by internal components.", ("component", "name"))
+
+def record_error(error_class):
+    ERRORS.inc(route=_route_label(), error_class=error_class)
+
+@contextlib.contextmanager
+def timed_upstream(service, operation):
+    """Records the latency and outcome of one upstream call."""
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except GeneratorExit: # Streaming caller went away mid-response
+        outcome = "cancelled"
+        raise
+    except Exception as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service=service, operation=operation, outcome=outcome)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+    g.request_id = request.headers.get('X-Request-ID', '')[:64] or secrets.token_hex(8)
+    g.deadline = time.monotonic() + REQUEST_DEADLINE
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.get('request_started')
+    if started is None: return response
+    route, method, status, request_id = _route_label(), request.method, response.status_code, g.request_id
+    response.headers['X-Request-ID'] = request_id
+    def record(): # On close, so streamed bodies are timed to their last byte
+        duration = time.perf_counter() - started
+        HTTP_IN_FLIGHT.dec()
+        HTTP_LATENCY.observe(duration, route=route, method=method)
+        HTTP_REQUESTS.inc(route=route, method=method, status=status)
+        log.info("request", sample=True, request_id=request_id, route=route, method=method, status=status, duration_ms=round(duration * 1000, 1))
+        metrics.ensure_flusher()
+    response.call_on_close(record)
+    return response
 
 # --- Configuration & API Keys (Loaded from Environment Variables) ---
 try:
     GEMINI_API_KEY = os.environ.get("GOOGLE_API_KEY")
     ELEVENLABS_API_KEY = os.environ.get("ELEVENLABS_API_KEY")
     ELEVENLABS_VOICE_ID = os.environ.get("ELEVENLABS_VOICE_ID", "XrExE9yKIg1WjnnlVkGX") # Use default if not set
+    GEMINI_MODEL_NAME = os.environ.get("GEMINI_MODEL_NAME", "gemini-1.5-flash")
 
     if not GEMINI_API_KEY:
-        print("CRITICAL ERROR: GOOGLE_API_KEY environment variable not set.")
-        text_model = None # Ensure model is None if key is missing
-    else:
-        try:
-            genai.configure(api_key=GEMINI_API_KEY)
-            text_model = genai.GenerativeModel('gemini-1.5-flash') # Or your preferred model
-            print("Gemini AI Model configured.")
-        except Exception as gemini_config_error:
-            print(f"ERROR configuring Gemini AI: {gemini_config_error}")
-            text_model = None
+        log.error("gemini.not_configured", reason="GOOGLE_API_KEY environment variable not set")
+    # The SDK is imported and configured on first use (or by warm_clients()), not here.
+    # GEMINI_TRANSPORT=rest keeps it on plain HTTP (requests), which gevent can make
+    # cooperative; the default gRPC transport blocks the whole worker.
+    gemini_models = models_from_env(os.environ, GEMINI_API_KEY, GEMINI_MODEL_NAME)
+    if gemini_models is not None: log.info("gemini.configured", model=GEMINI_MODEL_NAME, transport=gemini_models.transport or "default", lazy=True)
 
     if not ELEVENLABS_API_KEY:
-         print("WARNING: ELEVENLABS_API_KEY environment variable not set. TTS via ElevenLabs will fail.")
+         log.warning("elevenlabs.not_configured", reason="ELEVENLABS_API_KEY environment variable not set; TTS via ElevenLabs will fail")
 
-    ELEVENLABS_API_URL = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+    ELEVENLABS_API_BASE = os.environ.get("ELEVENLABS_API_BASE", "https://api.elevenlabs.io") # Overridden by bench/ to hit a local fake
+    ELEVENLABS_API_URL = f"{ELEVENLABS_API_BASE.rstrip('/')}/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+    ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+    ELEVENLABS_VOICE_SETTINGS = {"stability": 0.55, "similarity_boost": 0.75, "style": 0.3, "use_speaker_boost": True}
 
 except Exception as startup_error:
-     print(f"CRITICAL STARTUP ERROR during configuration: {startup_error}")
+     log.error("startup.config_failed", error=str(startup_error))
      GEMINI_API_KEY = None
      ELEVENLABS_API_KEY = None
      ELEVENLABS_API_URL = None
-     text_model = None
-
-
-# --- Firebase Admin SDK Initialization (Placeholder for Backend Auth - Requires setup) ---
-# import firebase_admin
-# from firebase_admin import credentials, auth
-# try:
-#     cred_path = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-#     cred_json_str = os.environ.get("FIREBASE_SERVICE_ACCOUNT_JSON")
-#     if cred_path:
-#          cred = credentials.Certificate(cred_path); firebase_admin.initialize_app(cred)
-#     elif cred_json_str:
-#          import json; cred_dict = json.loads(cred_json_str); cred = credentials.Certificate(cred_dict); firebase_admin.initialize_app(cred)
-#     else: print("WARNING: No Firebase Admin credentials found.")
-# except Exception as admin_init_error: print(f"ERROR initializing Firebase Admin SDK: {admin_init_error}")
+     ELEVENLABS_VOICE_ID = None
+     ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+     ELEVENLABS_VOICE_SETTINGS = {"stability": 0.55, "similarity_boost": 0.75, "style": 0.3, "use_speaker_boost": True}
+     GEMINI_MODEL_NAME = "gemini-1.5-flash"
+     gemini_models = None
+
+
+# --- Model Routing (per-task model, fallback, hedging) ---
+# Tiers resolve to GEMINI_LIGHT_MODEL / GEMINI_STRONG_MODEL (both default to
+# GEMINI_MODEL_NAME); tasks not listed use GEMINI_MODEL_NAME.
+TASK_MODEL_TIERS = {
+    "dictionary": "light", "dictionary_batch": "light", "chat": "light", "scenario_chat": "light",
+    "grammar_aid": "light", "paraphrase": "light", "summarize_part": "light", "history_digest": "light",
+    "essay": "strong", "summarize": "strong",
+}
+
+def get_text_model():
+    """The default Gemini model, built on first use (None if Gemini isn't configured)."""
+    return gemini_models.get() if gemini_models is not None else None
+
+def _gemini_model(name):
+    """Model object for a routed model name."""
+    return gemini_models.get(name) if gemini_models is not None else None
+
+def warm_clients():
+    """Starts warming this worker's Gemini client in the background (gunicorn post_worker_init)."""
+    if gemini_models is not None and os.environ.get("GEMINI_WARM_ON_START", "true").lower() in ("true", "1", "t"):
+        gemini_models.warm_async()
+
+model_router = router_from_env(os.environ, _gemini_model, GEMINI_MODEL_NAME, TASK_MODEL_TIERS)
+
+# --- Upstream Timeouts & Request Deadlines ---
+# GEMINI_TIMEOUT (seconds) is the per-attempt timeout handed to the SDK; tasks
+# listed here get their own, overridable with GEMINI_TIMEOUT_<TASK>. Every
+# request also gets REQUEST_DEADLINE for all its Gemini calls together
+# (fallbacks, repair calls, map-reduce rounds); background jobs get JOBS_DEADLINE.
+GEMINI_DEFAULT_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", 30))
+GEMINI_TIMEOUTS = {
+    "essay": 90,
+    "summarize": 90,
+    "summarize_part": 60,
+    "dictionary_batch": 60,
+    "identify_objects": 45,
+}
+for _task in set(GEMINI_TIMEOUTS) | set(TASK_MODEL_TIERS):
+    _override = os.environ.get(f"GEMINI_TIMEOUT_{_task.upper()}")
+    if _override is not None:
+        try: GEMINI_TIMEOUTS[_task] = float(_override)
+        except ValueError: log.warning("config.invalid_value", variable=f"GEMINI_TIMEOUT_{_task.upper()}", value=_override)
+REQUEST_DEADLINE = float(os.environ.get("REQUEST_DEADLINE", 120))
+JOBS_DEADLINE = float(os.environ.get("JOBS_DEADLINE", 600))
+
+def gemini_timeout(task):
+    return GEMINI_TIMEOUTS.get(task, GEMINI_DEFAULT_TIMEOUT)
+
+def request_deadline():
+    """time.monotonic() deadline of the current request or job (None outside one)."""
+    return g.get('deadline') if has_app_context() else None
+
+def remaining_time():
+    deadline = request_deadline()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+def with_deadline(fn, deadline=None, seconds=None):
+    """Wraps fn to run in its own app context with g.deadline set (pool threads, job workers).
+
+    The deadline is either the given one (a request's, passed on to its pool
+    threads) or `seconds` from when fn starts running.
+    """
+    def run(*args, **kwargs):
+        with app.app_context():
+            g.deadline = deadline if seconds is None else time.monotonic() + seconds
+            return fn(*args, **kwargs)
+    return run
+
+def disconnect_check():
+    """Callable telling whether the client has gone away, or None if that can't be detected.
+
+    Needs the client socket, which gunicorn exposes as `gunicorn.socket`; a
+    closed connection reads as EOF. Pipelined request bytes don't count.
+    """
+    sock = request.environ.get("gunicorn.socket") if has_request_context() else None
+    if sock is None: return None
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+        except (OSError, ValueError): # Socket already closed
+            return True
+    return disconnected
+
+def gemini_call(task, fn, cancelled=None):
+    """Routed call bounded by the task's timeout and the request deadline; returns (model_name, response).
+
+    fn(model, request_options) makes the SDK call.
+    """
+    return model_router.call(task, lambda model, timeout: fn(model, {"timeout": timeout}),
+                             timeout=gemini_timeout(task), deadline=request_deadline(), cancelled=cancelled)
+
+def gemini_stream(task, fn):
+    """Streaming counterpart of gemini_call; returns (model_name, chunk iterator)."""
+    return model_router.open_stream(task, lambda model, timeout: fn(model, {"timeout": timeout}),
+                                    timeout=gemini_timeout(task), deadline=request_deadline())
+
+# --- Response Cache (Gemini) ---
+# Only endpoints listed here are cached; TTLs (seconds) can be overridden with
+# CACHE_TTL_<ENDPOINT> env vars, and 0 disables caching for that endpoint.
+# Keys include the task's configured first model (model_router.preferred), so
+# re-routing a task doesn't serve the old model's answers. Answers a fallback
+# model gave are kept for CACHE_TTL_FALLBACK seconds at most (0: not cached).
+CACHE_TTLS = {
+    "dictionary": 7 * 24 * 3600,
+    "grammar_aid": 7 * 24 * 3600,
+    "generate_text": 6 * 3600,
+    "essay": 24 * 3600,
+    "history_digest": 3600,
+    "summarize_part": 24 * 3600,
+    "paraphrase": 24 * 3600,
+}
+for _endpoint in CACHE_TTLS:
+    _override = os.environ.get(f"CACHE_TTL_{_endpoint.upper()}")
+    if _override is not None:
+        try: CACHE_TTLS[_endpoint] = int(_override)
+        except ValueError: log.warning("config.invalid_value", variable=f"CACHE_TTL_{_endpoint.upper()}", value=_override)
+FALLBACK_CACHE_TTL = int(os.environ.get("CACHE_TTL_FALLBACK", 300))
+
+def answer_ttl(ttl, task, model_name):
+    """TTL for caching an answer `model_name` gave for `task`: short unless it's the task's preferred model."""
+    return ttl if model_name == model_router.preferred(task) else min(ttl, FALLBACK_CACHE_TTL)
+
+# --- Semantic Cache (near-duplicate dictionary / grammar / paraphrase queries) ---
+# Similarity a near hit needs, per namespace (SEMANTIC_CACHE_THRESHOLD_<NAMESPACE> overrides). 1 matches
+# normalized queries only. Dictionary words aren't lemmatized either: suffix rules merge distinct headwords
+# (news/new, goods/good, united/unit), so only case and punctuation are folded ("Run!" finds "run").
+# Grammar topics fold plurals only: articles, auxiliaries and -ed/-ing forms are often the topic itself
+# ("a vs an", "was vs were", "bored vs boring"), so they are neither dropped nor merged.
+# Paraphrases must match word for word (one changed word can change the meaning), up to case and punctuation.
+SEMANTIC_CACHE_THRESHOLDS = {"dictionary": 1.0, "grammar_aid": 0.85, "paraphrase": 1.0}
+GRAMMAR_TOPIC_FILLERS = ("tense", "tenses", "grammar", "english", "rule", "rules", "explain", "explanation", "please")
+PARAPHRASE_STYLES = ["simpler", "formal", "informal", "creative", "complex"]
+_semantic_namespaces = {"dictionary": ((), None), "grammar_aid": (GRAMMAR_TOPIC_FILLERS, semantic_singular),
+                        **{f"paraphrase:{style}": ((), None) for style in PARAPHRASE_STYLES}}
+try:
+    semantic_cache = semantic_cache_from_env(os.environ)
+    if semantic_cache is not None:
+        for _namespace, (_fillers, _lemmatize) in _semantic_namespaces.items():
+            _base = _namespace.partition(":")[0]
+            _threshold = float(os.environ.get(f"SEMANTIC_CACHE_THRESHOLD_{_base.upper()}", SEMANTIC_CACHE_THRESHOLDS[_base]))
+            semantic_cache.configure(_namespace, _threshold, _fillers, lemmatize=_lemmatize)
+        log.info("semantic_cache.loaded", entries=semantic_cache.load())
+except Exception as semantic_cache_error:
+    log.error("semantic_cache.init_failed", error=str(semantic_cache_error))
+    semantic_cache = None
+
+def semantic_lookup(namespace, query):
+    """Cached answer to `query` or a near-identical earlier one (None on a miss)."""
+    if semantic_cache is None: return None
+    value = semantic_cache.get(namespace, query)
+    CACHE_LOOKUPS.inc(cache="semantic", route=_route_label(), result="miss" if value is None else "hit")
+    return value
+
+def semantic_store(namespace, query, value):
+    if semantic_cache is not None: semantic_cache.set(namespace, query, value, CACHE_TTLS.get(namespace.partition(":")[0], 0))
+
+# --- ElevenLabs HTTP Client (pooled, one per worker) ---
+elevenlabs_client = elevenlabs_client_from_env(ELEVENLABS_API_KEY, os.environ) if ELEVENLABS_API_KEY else None
+
+# --- TTS Audio Cache (content-addressed blobs on local disk) ---
+TTS_CACHE_MAX_AGE = int(os.environ.get("TTS_CACHE_MAX_AGE", 7 * 24 * 3600)) # Browser cache lifetime for clips
+TTS_STREAM_CHUNK_SIZE = 16 * 1024
+try:
+    audio_store = audio_store_from_env(os.environ)
+except Exception as audio_store_error:
+    log.error("tts_cache.init_failed", error=str(audio_store_error))
+    audio_store = None
+
+# --- Long-Passage TTS (sentence segments synthesized ahead of playback) ---
+TTS_SEGMENTED_MIN_CHARS = int(os.environ.get("TTS_SEGMENTED_MIN_CHARS", 300)) # Longer texts are segmented unless the client opts out
+TTS_SEGMENT_MAX_CHARS = int(os.environ.get("TTS_SEGMENT_MAX_CHARS", 250))
+TTS_SEGMENT_CONCURRENCY = int(os.environ.get("TTS_SEGMENT_CONCURRENCY", 3)) # Segments synthesizing at once per passage
+
+# --- In-Flight Request Coalescing ---
+# SINGLEFLIGHT_LOCK_DIR (optional) extends coalescing across gunicorn workers via lock files.
+SINGLEFLIGHT_LOCK_DIR = os.environ.get("SINGLEFLIGHT_LOCK_DIR")
+TTS_FLIGHT_WAIT = 90 # Seconds a duplicate TTS request waits for the leader's clip
+gemini_flights = SingleFlight("gemini", lock_dir=SINGLEFLIGHT_LOCK_DIR, lock_timeout=60)
+tts_flights = SingleFlight("tts", lock_dir=SINGLEFLIGHT_LOCK_DIR, lock_timeout=TTS_FLIGHT_WAIT)
 
+try:
+    response_cache = cache_from_env()
+except Exception as cache_init_error:
+    log.error("response_cache.init_failed", error=str(cache_init_error))
+    response_cache = None
+
+
+# --- Image Preprocessing (identify-objects) ---
+IMAGE_MAX_UPLOAD_BYTES = int(os.environ.get("IMAGE_MAX_UPLOAD_BYTES", 15 * 1024 * 1024)) # Rejected with 413 above this
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", 1024)) # Longest side sent to Gemini
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 80))
+IMAGE_CACHE_TTL = int(os.environ.get("CACHE_TTL_IMAGE", 24 * 3600))
+image_cache = NearDuplicateCache(ttl=IMAGE_CACHE_TTL, max_distance=int(os.environ.get("IMAGE_DEDUPE_DISTANCE", 6))) if IMAGE_CACHE_TTL > 0 else None
+
+
+# --- Firebase Auth (ID-token verification) ---
+# FIREBASE_AUTH_ENABLED=true + FIREBASE_PROJECT_ID turn on real verification:
+# signatures are checked locally against Google's cached signing certificates
+# and decoded tokens are cached until they expire (see firebase_auth.py).
+# While disabled, every request gets a placeholder identity as before.
+firebase_auth_broken = False
+try:
+    firebase_verifier = firebase_verifier_from_env(os.environ)
+except Exception as firebase_init_error:
+    log.error("firebase_auth.init_failed", error=str(firebase_init_error))
+    firebase_verifier, firebase_auth_broken = None, True # Fail closed: auth was asked for
 
-# --- Helper Function: Verify Firebase ID Token (Placeholder) ---
 def verify_firebase_token(request):
-    """Placeholder function to verify Firebase ID token."""
-    # --- UNCOMMENT AND COMPLETE THIS LATER with firebase_admin setup ---
-    # if not firebase_admin._apps: return None # Check if SDK initialized
-    # id_token = request.headers.get('Authorization', '').split('Bearer ')[-1]
-    # if not id_token: return None
-    # try:
-    #     decoded_token = auth.verify_id_token(id_token)
-    #     return decoded_token
-    # except Exception as e: print(f"Auth Error: {e}"); return None
-    # --- --- --- --- --- --- --- --- --- ---
-    # print("Auth: Backend token verification is currently disabled.") # Remove when uncommenting
-    return {"placeholder_uid": "backend-auth-disabled"} # Return placeholder if disabled
+    """Returns the caller's decoded Firebase ID token (None if missing or invalid); memoized per request."""
+    if 'user_info' in g: return g.user_info # Already verified for this request (e.g. by admission control)
+    g.user_info = _verify_firebase_token(request)
+    return g.user_info
+
+def _verify_firebase_token(request):
+    if firebase_verifier is None: return None if firebase_auth_broken else {"placeholder_uid": "backend-auth-disabled"} # Auth disabled
+    scheme, _, id_token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not id_token.strip(): return None
+    try:
+        return firebase_verifier.verify(id_token.strip())
+    except AuthError as e:
+        record_error("auth_rejected")
+        log.info("auth.rejected", sample=True, reason=str(e)[:200])
+        return None
+
+# --- Admission Control (per-user / global rate limits) ---
+# Batch endpoints are queued briefly and then shed before interactive ones when
+# the global budget runs low. Budgets are per worker unless ADMISSION_STORE_DB is set.
+ENDPOINT_PRIORITY = {"essay": BATCH, "summarize": BATCH, "dictionary_batch": BATCH} # Everything else is interactive
+FIXED_INPUT_TOKENS = {"identify_objects": 300} # Images cost a fixed ~258 tokens, whatever their byte size
+EXPECTED_OUTPUT_TOKENS = {"essay": 1200, "summarize": 600, "generate_text": 400, "translate_explain": 600, "dictionary_batch": 3000}
+DEFAULT_OUTPUT_TOKENS = 300
+
+try:
+    admission = admission_from_env(os.environ)
+except Exception as admission_init_error:
+    log.error("admission.init_failed", error=str(admission_init_error))
+    admission = None
+
+if admission is not None and firebase_verifier is None and not firebase_auth_broken and TRUSTED_PROXY_HOPS is None:
+    log.warning("admission.global_only", reason="auth disabled and TRUSTED_PROXY_HOPS unset; per-client budgets need one of them")
+
+def _client_id(user_info):
+    """Caller identity for jobs and sessions: the Firebase uid, or the client IP while auth is disabled (see TRUSTED_PROXY_HOPS)."""
+    uid = user_info.get('uid')
+    if uid: return uid
+    return request.remote_addr or "anonymous"
+
+def _admission_user(user_info):
+    """Per-user budget key, or None for global budgets only.
+
+    Without Firebase uids callers are told apart by IP, which is only meaningful
+    once TRUSTED_PROXY_HOPS says how to find it: behind an unconfigured proxy
+    every caller would share the proxy's address, and with it one user budget.
+    """
+    if user_info.get('uid'): return user_info['uid']
+    return _client_id(user_info) if TRUSTED_PROXY_HOPS is not None else None
+
+def admission_controlled(endpoint):
+    """Route decorator: returns 429 + Retry-After when the caller is over budget."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if admission is None: return view(*args, **kwargs)
+            user_info = verify_firebase_token(request)
+            if user_info is None: return view(*args, **kwargs) # The view answers 401
+            # Rough token estimate: ~4 bytes of input per token plus the expected reply size
+            est_tokens = FIXED_INPUT_TOKENS.get(endpoint, (request.content_length or 0) // 4) + EXPECTED_OUTPUT_TOKENS.get(endpoint, DEFAULT_OUTPUT_TOKENS)
+            try:
+                admission.admit(_admission_user(user_info), ENDPOINT_PRIORITY.get(endpoint, INTERACTIVE), est_tokens)
+            except Rejected as rejected:
+                log.warning("admission.rejected", endpoint=endpoint, reason=rejected.reason, retry_after=rejected.retry_after)
+                response = jsonify({"error": "Too many requests. Please wait a moment and try again.", "reason": rejected.reason})
+                response.headers['Retry-After'] = str(rejected.retry_after)
+                return response, 429
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Helper Function: Build Final Prompt ---
+def build_final_prompt(prompt, is_chat=False, chat_history=None):
+    """Returns the exact prompt string sent to Gemini (history folded in for chat)."""
+    if not (is_chat and chat_history):
+        # For generation or scenario start, use the prompt directly
+        return prompt
+
+    # Map frontend history ({sender: 'user'/'bot', text: '...'})
+    # to Gemini format ({role: 'user'/'model', parts: ['...']})
+    gemini_formatted_history = []
+    for entry in chat_history:
+        role = "user" if entry.get('sender') == 'user' else "model"
+        text = entry.get('text', '')
+        # Gemini API prefers list of parts, even if just one
+        gemini_formatted_history.append({"role": role, "parts": [text]})
+
+    # Construct the final prompt including history for generate_content
+    # This approach works for stateless environments like Render
+    full_prompt_string = ""
+    # Add optional system instruction if needed for context (could be passed in)
+    # full_prompt_string += "System: You are Ada...\n"
+    for entry in gemini_formatted_history: # Use the formatted history
+        full_prompt_string += f"{entry['role'].capitalize()}: {entry['parts'][0]}\n"
+    # In chat mode, 'prompt' is the latest user message
+    full_prompt_string += f"User: {prompt}\nAda:" # Use persona name if defined
+    return full_prompt_string
+
+def _cache_slot(final_prompt, endpoint, task=None):
+    """Returns (cache_key, ttl) for a prompt, or (None, 0) if it isn't cacheable."""
+    cache_ttl = CACHE_TTLS.get(endpoint, 0) if response_cache is not None else 0
+    if cache_ttl <= 0: return None, 0
+    return make_cache_key(final_prompt, model_router.preferred(task or endpoint)), cache_ttl
+
+def _gemini_exception_error(e):
+    """Maps an exception from the Gemini SDK to the matching error dict.
+
+    Timeouts (per attempt or the request deadline) are flagged so routes answer
+    504 (see error_status); so are calls abandoned because the client left.
+    """
+    if isinstance(e, Cancelled):
+        record_error("client_disconnected"); log.info("gemini.cancelled", sample=True); return {"error": "Client disconnected", "cancelled": True}
+    if isinstance(e, TIMEOUT_ERRORS):
+        record_error("timeout"); log.warning("gemini.timeout", error_class=type(e).__name__, error=str(e)); return {"error": "AI service timed out", "timeout": True}
+    record_error(type(e).__name__)
+    if isinstance(e, google.api_core.exceptions.ResourceExhausted): log.warning("gemini.quota_exceeded", error=str(e)); return {"error": "AI service quota exceeded"}
+    if isinstance(e, google.api_core.exceptions.InvalidArgument): log.warning("gemini.invalid_argument", error=str(e)); return {"error": "Invalid request to AI"}
+    log.error("gemini.error", error_class=type(e).__name__, error=str(e)); return {"error": "Unexpected AI service error"}
+
+def error_status(result, default=500):
+    """HTTP status for an error dict: 504 on upstream timeouts, 499 if the client went away."""
+    if result.get("timeout"): return 504
+    if result.get("cancelled"): return 499
+    return default
+
+def _blocked_or_empty_error(response):
+    """Maps a response without usable parts to the matching error dict."""
+    block_reason = getattr(response.prompt_feedback, 'block_reason', None)
+    if block_reason:
+        block_reason_name = block_reason.name
+        record_error("blocked")
+        log.warning("gemini.blocked", reason=block_reason_name)
+        return {"error": f"Blocked by safety filters ({block_reason_name})"}
+    record_error("empty_response")
+    log.warning("gemini.empty_response")
+    return {"error": "AI returned empty result"}
+
+def _call_gemini(final_prompt, cache_key=None, cache_ttl=0, generation_config=None, task=None, cancelled=None):
+    """One routed generate_content call; returns (model_name, text or error dict)."""
+    kwargs = {"generation_config": generation_config} if generation_config else {}
+    with timed_upstream("gemini", "generate"):
+        model_name, response = gemini_call(task, lambda model, options: model.generate_content(final_prompt, request_options=options, **kwargs),
+                                           cancelled=cancelled)
+    if model_name != model_router.preferred(task): log.info("gemini.alternate_model", sample=True, task=task, model=model_name)
+
+    # --- Response Handling ---
+    if not response.candidates or not response.candidates[0].content.parts:
+         return model_name, _blocked_or_empty_error(response)
+
+    generated_text = response.text
+    RESPONSE_CHARS.observe(len(generated_text), route=_route_label())
+    # Stored before waiters are released so other workers' leaders find it on recheck
+    cache_ttl = answer_ttl(cache_ttl, task, model_name)
+    if cache_key and cache_ttl > 0: response_cache.set(cache_key, generated_text, cache_ttl)
+    return model_name, generated_text
 
 # --- Helper Function: Call Gemini API ---
-def generate_gemini_response(prompt, is_chat=False, chat_history=None):
-    """Generates content using the Gemini API."""
-    if not GEMINI_API_KEY or text_model is None:
-         print("Error: Gemini API Key or Model is not configured correctly.")
-         return {"error": "AI service not configured"}
+def generate_gemini_response(prompt, is_chat=False, chat_history=None, endpoint=None, generation_config=None, task=None):
+    """Generates content using the Gemini API.
+
+    When `endpoint` has a TTL in CACHE_TTLS, successful text results are served
+    from / stored in the response cache. Error dicts are never cached. The model
+    is picked by model_router for `task` (defaults to `endpoint`). The upstream
+    call is abandoned if the client disconnects and nobody else is waiting on it.
+    """
+    return _generate(prompt, is_chat, chat_history, endpoint, generation_config, task)[1]
+
+def _generate(prompt, is_chat=False, chat_history=None, endpoint=None, generation_config=None, task=None):
+    """generate_gemini_response returning (model_name, result); model_name is None for cache hits and failed calls."""
+    if not GEMINI_API_KEY or get_text_model() is None:
+         log.error("gemini.not_configured", reason="API key or model missing")
+         return None, {"error": "AI service not configured"}
 
     try:
-        print(f"--- Sending Prompt to Gemini (Type: {'Chat' if is_chat else 'Generate/Scenario'}, Len: {len(prompt)}) ---")
-
-        # History Formatting & Prompt Construction for Chat
-        gemini_formatted_history = []
-        if is_chat and chat_history:
-             # Map frontend history ({sender: 'user'/'bot', text: '...'})
-             # to Gemini format ({role: 'user'/'model', parts: ['...']})
-             for entry in chat_history:
-                 role = "user" if entry.get('sender') == 'user' else "model"
-                 text = entry.get('text', '')
-                 # Gemini API prefers list of parts, even if just one
-                 gemini_formatted_history.append({"role": role, "parts": [text]})
-
-             # In chat mode, 'prompt' is the latest user message
-             latest_user_message = prompt
-
-             # Construct the final prompt including history for generate_content
-             # This approach works for stateless environments like Render
-             full_prompt_string = ""
-             # Add optional system instruction if needed for context (could be passed in)
-             # full_prompt_string += "System: You are Ada...\n"
-             for entry in gemini_formatted_history: # Use the formatted history
-                  full_prompt_string += f"{entry['role'].capitalize()}: {entry['parts'][0]}\n"
-             full_prompt_string += f"User: {latest_user_message}\nAda:" # Use persona name if defined
-             final_prompt_for_api = full_prompt_string
-
-        else:
-             # For generation or scenario start, use the prompt directly
-             final_prompt_for_api = prompt
-
-        # --- API Call ---
-        response = text_model.generate_content(final_prompt_for_api)
-
-        # --- Response Handling ---
+        final_prompt_for_api = build_final_prompt(prompt, is_chat, chat_history)
+        log.debug("gemini.request", kind="chat" if is_chat else "generate", prompt_chars=len(final_prompt_for_api))
+        PROMPT_CHARS.observe(len(final_prompt_for_api), route=_route_label())
+
+        # --- Cache Lookup ---
+        cache_key, cache_ttl = _cache_slot(final_prompt_for_api, endpoint, task)
+        if cache_key:
+            cached_text = response_cache.get(cache_key)
+            CACHE_LOOKUPS.inc(cache="response", route=_route_label(), result="miss" if cached_text is None else "hit")
+            if cached_text is not None: return None, cached_text
+
+        # --- API Call (identical concurrent prompts share one upstream call) ---
+        flight_key = cache_key or make_cache_key(final_prompt_for_api, model_router.preferred(task or endpoint))
+        def recheck():
+            cached_text = response_cache.get(cache_key)
+            return None if cached_text is None else (None, cached_text)
+        disconnected = disconnect_check()
+        cancelled = (lambda: gemini_flights.waiters(flight_key) == 0 and disconnected()) if disconnected else None
+        return gemini_flights.do(flight_key, lambda: _call_gemini(final_prompt_for_api, cache_key, cache_ttl, generation_config, task or endpoint, cancelled),
+                                 recheck=recheck if cache_key else None, timeout=remaining_time())
+
+    # --- Error Handling ---
+    except Exception as e: return None, _gemini_exception_error(e)
+
+# --- Helper Function: Stream Gemini API ---
+def stream_gemini_response(prompt, is_chat=False, chat_history=None, endpoint=None, task=None):
+    """Streaming counterpart of generate_gemini_response.
+
+    Yields text chunks as the model produces them. On failure it yields a single
+    error dict (same shape as generate_gemini_response) and stops. Cache hits
+    are yielded as one chunk; completed streams are written to the cache.
+    """
+    if not GEMINI_API_KEY or get_text_model() is None:
+         log.error("gemini.not_configured", reason="API key or model missing")
+         yield {"error": "AI service not configured"}
+         return
+
+    try:
+        final_prompt_for_api = build_final_prompt(prompt, is_chat, chat_history)
+        log.debug("gemini.stream_request", kind="chat" if is_chat else "generate", prompt_chars=len(final_prompt_for_api))
+        PROMPT_CHARS.observe(len(final_prompt_for_api), route=_route_label())
+
+        cache_key, cache_ttl = _cache_slot(final_prompt_for_api, endpoint, task)
+        if cache_key:
+            cached_text = response_cache.get(cache_key)
+            CACHE_LOOKUPS.inc(cache="response", route=_route_label(), result="miss" if cached_text is None else "hit")
+            if cached_text is not None:
+                yield cached_text
+                return
+
+        with timed_upstream("gemini", "stream"):
+            model_name, response = gemini_stream(task or endpoint, lambda model, options: model.generate_content(final_prompt_for_api, stream=True, request_options=options))
+            try: full_text = yield from _iter_stream_text(response)
+            finally: response.close() # Client went away mid-stream: stop reading upstream
+        cache_ttl = answer_ttl(cache_ttl, task or endpoint, model_name)
+        if full_text and cache_key and cache_ttl > 0: response_cache.set(cache_key, full_text, cache_ttl)
+
+    except Exception as e: yield _gemini_exception_error(e)
+
+def _iter_stream_text(response):
+    """Yields the text of a streamed Gemini response chunk by chunk.
+
+    Yields a single error dict instead if the response is blocked or empty.
+    Returns the full text (None after an error) to `yield from` callers.
+    """
+    collected = []
+    for chunk in response:
+        if not chunk.candidates or not chunk.candidates[0].content.parts:
+            if getattr(chunk.prompt_feedback, 'block_reason', None) or not collected:
+                yield _blocked_or_empty_error(chunk)
+                return None
+            continue # e.g. a trailing chunk that only carries finish_reason
+        collected.append(chunk.text)
+        yield chunk.text
+    if not collected:
+        record_error("empty_response")
+        yield {"error": "AI returned empty result"}
+        return None
+    full_text = "".join(collected)
+    RESPONSE_CHARS.observe(len(full_text), route=_route_label())
+    return full_text
+
+# --- Helper Function: Structured (JSON) Output ---
+def structured_cache_slot(prompt, endpoint, task=None):
+    """Cache slot for a structured reply (kept apart from free-text replies to the same prompt)."""
+    return _cache_slot(f"{prompt}\x00json", endpoint, task)
+
+def generate_structured_response(prompt, schema, endpoint=None, task=None):
+    """Asks Gemini for JSON matching `schema`; returns the parsed dict or an error dict.
+
+    A reply that doesn't parse or validate gets exactly one repair call. Only
+    validated payloads are cached (when `endpoint` has a TTL in CACHE_TTLS).
+    """
+    cache_key, cache_ttl = structured_cache_slot(prompt, endpoint, task)
+    if cache_key:
+        cached = structured_output.parse(response_cache.get(cache_key), schema)
+        CACHE_LOOKUPS.inc(cache="response", route=_route_label(), result="miss" if cached is None else "hit")
+        if cached is not None: return cached
+
+    config = structured_output.generation_config(schema)
+    model_name, raw_text = _generate(prompt, generation_config=config, task=task or endpoint)
+    if isinstance(raw_text, dict): return raw_text
+    cache_ttl = answer_ttl(cache_ttl, task or endpoint, model_name)
+    payload, outcome = structured_output.parse(raw_text, schema), "ok"
+    if payload is None:
+        log.warning("structured_output.malformed", endpoint=endpoint, response_chars=len(raw_text))
+        model_name, repaired_text = _generate(structured_output.repair_prompt(raw_text, schema), generation_config=config, task=task or endpoint)
+        cache_ttl = answer_ttl(cache_ttl, task or endpoint, model_name)
+        if isinstance(repaired_text, dict) and (repaired_text.get("timeout") or repaired_text.get("cancelled")): return repaired_text
+        payload = structured_output.parse(repaired_text, schema)
+        outcome = "failed" if payload is None else "repaired"
+    STRUCTURED_OUTPUT.inc(route=_route_label(), outcome=outcome)
+    if payload is None:
+        record_error("parse_error")
+        return {"error": "AI returned a malformed response"}
+    if cache_key and cache_ttl > 0: response_cache.set(cache_key, json.dumps(payload), cache_ttl)
+    return payload
+
+# --- Prompt Budgets (tokens) ---
+PROMPT_BUDGETS = {"chat": 3000, "scenario_chat": 4000, "summarize": 8000}
+MAX_MESSAGE_TOKENS = int(os.environ.get("PROMPT_MAX_MESSAGE_TOKENS", 1000)) # Any single chat turn
+MAX_SCENARIO_TOKENS = 800 # Scenario description
+SUMMARY_CHUNK_TOKENS = 6000 # Map step chunk size for long documents
+SUMMARY_MAX_INPUT_TOKENS = int(os.environ.get("SUMMARY_MAX_INPUT_TOKENS", 120000))
+SUMMARY_MAP_CONCURRENCY = 4
+# Digesting dropped turns costs an extra (cached) Gemini call, so it's opt-in.
+PROMPT_DIGEST_HISTORY = os.environ.get("PROMPT_DIGEST_HISTORY", "false").lower() in ("true", "1", "t")
+for _endpoint in PROMPT_BUDGETS:
+    _override = os.environ.get(f"PROMPT_BUDGET_{_endpoint.upper()}")
+    if _override: PROMPT_BUDGETS[_endpoint] = int(_override)
+
+def count_prompt_tokens(text):
+    """Token counter used for budgeting (PROMPT_TOKEN_COUNTER=sdk asks the API instead)."""
+    if os.environ.get("PROMPT_TOKEN_COUNTER") == "sdk" and get_text_model() is not None:
+        return sdk_token_counter(get_text_model())(text)
+    return estimate_tokens(text)
+
+def report_prompt_tokens(endpoint, before, after, calls=1):
+    """Records pre/post-budget prompt sizes; sent back as X-Prompt-Tokens-* headers."""
+    g.prompt_tokens = (before, after, calls)
+    PROMPT_TOKENS.observe(after, route=_route_label())
+    if before != after or calls > 1:
+        log.info("prompt_budget.trimmed", sample=True, endpoint=endpoint, tokens_before=before, tokens_after=after, calls=calls)
+
+@app.after_request
+def add_prompt_token_headers(response):
+    prompt_tokens = g.get('prompt_tokens')
+    if prompt_tokens:
+        response.headers['X-Prompt-Tokens-Before'], response.headers['X-Prompt-Tokens-After'], response.headers['X-Prompt-Calls'] = map(str, prompt_tokens)
+    return response
+
+def govern_history(endpoint, message, history, fixed_text=""):
+    """Fits a conversation into the endpoint's token budget.
+
+    Truncates the new message, keeps the newest turns that fit next to it and
+    `fixed_text` (instructions/scenario), and optionally replaces the dropped
+    older turns with a short digest. Returns (message, history).
+    """
+    message = truncate_text(message, MAX_MESSAGE_TOKENS, count_prompt_tokens)
+    remaining = PROMPT_BUDGETS[endpoint] - count_prompt_tokens(message) - count_prompt_tokens(fixed_text)
+    kept, dropped = fit_history(history, max(0, remaining), MAX_MESSAGE_TOKENS, count_prompt_tokens)
+    if dropped and PROMPT_DIGEST_HISTORY:
+        digest = generate_gemini_response(
+            "Summarize this earlier part of an English practice conversation in at most 3 sentences, "
+            "keeping names, facts and open questions:\n\n" + format_turns(dropped), endpoint="history_digest")
+        if isinstance(digest, str):
+            kept = [{"sender": "bot", "text": f"(Summary of our earlier conversation: {digest.strip()})"}] + kept
+    return message, kept
+
+def summarize_prompt(text):
+    return f"""
+Instructions:
+Summarize the following text concisely, capturing the main points and key information.
+Output *only* the summary itself.
+
+Text to Summarize:
+---
+{text}
+---
+
+Summary:
+"""
+
+def map_reduce_summary_prompt(text):
+    """Condenses a document too long for one prompt.
+
+    Chunks are summarized concurrently (map); the partial summaries are then
+    combined into a final summarize prompt (reduce), repeating if they are still
+    over budget. Returns (final_prompt, upstream_calls) or an error dict.
+    """
+    calls = 0
+    while count_prompt_tokens(text) > PROMPT_BUDGETS["summarize"]:
+        chunks = chunk_text(text, SUMMARY_CHUNK_TOKENS, count_prompt_tokens)
+        part_prompts = [f"Summarize part {index + 1} of {len(chunks)} of a longer document. Keep every key point, name and number; "
+                        f"output only the summary.\n\n---\n{chunk}\n---" for index, chunk in enumerate(chunks)]
+        summarize_part = with_deadline(lambda prompt: generate_gemini_response(prompt, endpoint="summarize_part"), request_deadline())
+        with ThreadPoolExecutor(max_workers=SUMMARY_MAP_CONCURRENCY) as pool:
+            partials = list(pool.map(summarize_part, part_prompts))
+        calls += len(chunks)
+        for partial in partials:
+            if isinstance(partial, dict): return partial
+        text = "\n\n".join(partial.strip() for partial in partials)
+    return summarize_prompt(text), calls + 1
+
+# --- Content Library (generate_text) ---
+LEVEL_MAP = {
+    "beginner": "very simple (CEFR A1-A2)",
+    "encounter": "simple (CEFR A2-B1)",
+    "investigation": "intermediate (CEFR B1-B2)",
+    "awakening": "upper-intermediate (CEFR B2)",
+    "summit": "advanced (CEFR C1)",
+    "expert": "near-native/highly advanced (CEFR C2)"
+}
+DEFAULT_LEVEL = "investigation" # Unknown levels get the intermediate prompt
+# Library variants rotate through text styles so repeat visitors see different texts
+VARIANT_STYLES = ["an informational article", "a short story", "a personal blog post", "a dialogue between two people",
+                  "a news-style report", "a letter or email"]
+
+def generate_text_prompt(topic, level_description, style=None):
+    style_line = f"\nWrite it as {style}." if style else ""
+    return f"""Instructions:\nGenerate educational content. Write a short text (150-250 words) on a topic for an English learner.\nText should be engaging, correct, and use vocabulary/syntax for the specified level.{style_line}\nOutput *only* the generated text itself.\n\nParameters:\nTopic: "{topic}"\nProficiency Level: {level_description}\n\nGenerated Text:\n"""
+
+def is_level_echo(generated_text, level, level_description):
+    """True if the model just echoed the level back instead of writing a text."""
+    stripped = generated_text.strip()
+    return stripped.lower() == level.lower() or level_description in stripped[:len(level_description) + 20]
+
+def generate_library_text(level, topic, variant):
+    """Generator used by the content library (runs in its background threads)."""
+    level_description = LEVEL_MAP[level]
+    style = VARIANT_STYLES[(variant - 1) % len(VARIANT_STYLES)]
+    text = generate_gemini_response(generate_text_prompt(topic, level_description, style), task="generate_text") # Not response-cached: variants must differ
+    if not isinstance(text, str) or is_level_echo(text, level, level_description): return None
+    return text
+
+try:
+    content_library = library_from_env(os.environ, generate_library_text, LEVEL_MAP)
+except Exception as library_init_error:
+    log.error("content_library.init_failed", error=str(library_init_error))
+    content_library = None
+
+# --- Dictionary Entries (structured) ---
+DICTIONARY_ENTRY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "found": {"type": "boolean"},
+        "definitions": {"type": "array", "items": {"type": "object", "properties": {
+            "part_of_speech": {"type": "string"}, "definition": {"type": "string"}}, "required": ["definition"]}},
+        "synonyms": {"type": "array", "items": {"type": "string"}},
+        "antonyms": {"type": "array", "items": {"type": "string"}},
+        "etymology": {"type": "string"},
+        "examples": {"type": "array", "items": {"type": "string"}},
+        "turkish_meaning": {"type": "string"},
+    },
+    "required": ["found", "definitions"],
+}
+
+def dictionary_prompt(word):
+    return f"""Provide a detailed dictionary entry for "{word}": definition(s) with part of speech, synonyms, antonyms, etymology, example sentence(s) and the Turkish meaning. If the word doesn't exist, set found to false and leave the other fields empty."""
+
+def render_dictionary_entry(word, entry):
+    """Formats a structured entry as the text the dictionary panel displays."""
+    if not entry.get("found") or not entry.get("definitions"): return f'"{word}" was not found in the dictionary.'
+    lines = ["**Definition(s):**"]
+    for number, definition in enumerate(entry["definitions"], 1):
+        part_of_speech = definition.get("part_of_speech", "").strip()
+        lines.append(f"{number}. " + (f"({part_of_speech}) " if part_of_speech else "") + definition["definition"].strip())
+    for label, field in (("Synonyms", "synonyms"), ("Antonyms", "antonyms")):
+        if entry.get(field): lines += ["", f"**{label}:** " + ", ".join(entry[field])]
+    if entry.get("etymology", "").strip(): lines += ["", f"**Etymology:** {entry['etymology'].strip()}"]
+    if entry.get("examples"): lines += ["", "**Example Sentence(s):**"] + [f"- {example}" for example in entry["examples"]]
+    if entry.get("turkish_meaning", "").strip(): lines += ["", f"**Turkish Meaning:** {entry['turkish_meaning'].strip()}"]
+    return "\n".join(lines)
+
+# --- Local Lexicon (dictionary entries served without Gemini, plus autocomplete) ---
+DICTIONARY_SUGGEST_LIMIT = 8
+try:
+    lexicon = lexicon_from_env(os.environ, validate=lambda entry: structured_output.validate(entry, DICTIONARY_ENTRY_SCHEMA))
+except Exception as lexicon_init_error:
+    log.error("lexicon.init_failed", error=str(lexicon_init_error))
+    lexicon = None
+
+def lexicon_lookup(word, route):
+    """Stored entry for `word` or None."""
+    if lexicon is None: return None
+    try:
+        entry = lexicon.get(word)
+        if entry is not None and not structured_output.validate(entry, DICTIONARY_ENTRY_SCHEMA): entry = None
+    except Exception as e:
+        log.warning("lexicon.read_failed", error=str(e))
+        return None
+    CACHE_LOOKUPS.inc(cache="lexicon", route=route, result="miss" if entry is None else "hit")
+    return entry
+
+def lexicon_store(word, entry):
+    if lexicon is None: return
+    try: lexicon.add(word, entry)
+    except Exception as e: log.warning("lexicon.write_failed", error=str(e))
+
+# --- Dictionary Batches (word lists) ---
+# Cached words are answered straight away; the rest are packed several to a
+# prompt with JSON output, and every parsed entry is stored under the same key
+# a single /api/dictionary lookup of that word uses.
+DICTIONARY_BATCH_MAX_WORDS = int(os.environ.get("DICTIONARY_BATCH_MAX_WORDS", 100))
+DICTIONARY_BATCH_CHUNK_SIZE = int(os.environ.get("DICTIONARY_BATCH_CHUNK_SIZE", 8)) # Words per Gemini call
+DICTIONARY_BATCH_CONCURRENCY = int(os.environ.get("DICTIONARY_BATCH_CONCURRENCY", 4)) # Chunks in flight per request
+DICTIONARY_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {"entries": {"type": "array", "items": {"type": "object", "properties": {
+        "word": {"type": "string"}, "entry": DICTIONARY_ENTRY_SCHEMA}, "required": ["word", "entry"]}}},
+    "required": ["entries"],
+}
+
+def dedupe_batch_words(words):
+    """Returns (unique_words, invalid_items); duplicates are dropped case-insensitively."""
+    unique, seen, invalid = [], set(), []
+    for item in words:
+        word = item.strip() if isinstance(item, str) else None
+        if not word: continue
+        if len(word.split()) > 1 or len(word) > 64:
+            invalid.append(word[:64])
+            continue
+        if word.lower() in seen: continue
+        seen.add(word.lower())
+        unique.append(word)
+    return unique, invalid
+
+def _batch_dictionary_prompt(words):
+    word_list = "\n".join(f"- {word}" for word in words)
+    return f"""For each English word below, provide a detailed dictionary entry: definition(s) with part of speech, synonyms, antonyms, etymology, example sentence(s) and the Turkish meaning. Give each word exactly as written. If a word doesn't exist, set found to false for it and leave its other fields empty.
+
+Words:
+{word_list}"""
+
+def _parse_batch_entries(text, words):
+    """Maps each requested word to its validated entry; entries that don't validate are left out."""
+    payload = structured_output.parse(text, {"type": "object", "properties": {"entries": {"type": "array"}}, "required": ["entries"]})
+    wanted = {word.lower(): word for word in words}
+    parsed = {}
+    for item in payload["entries"] if payload else []:
+        if not structured_output.validate(item, DICTIONARY_BATCH_SCHEMA["properties"]["entries"]["items"]): continue
+        word = wanted.get(item["word"].strip().lower())
+        if word: parsed[word] = item["entry"]
+    return parsed
+
+def lookup_dictionary_chunk(words):
+    """One multi-word Gemini call. Returns ({word: entry}, upstream_calls) or an error dict.
+
+    Words missing from the reply (truncated or malformed JSON) are retried one
+    at a time through generate_structured_response.
+    """
+    try:
+        with timed_upstream("gemini", "batch"):
+            model_name, response = gemini_call("dictionary_batch", lambda model, options: model.generate_content(
+                _batch_dictionary_prompt(words), generation_config=structured_output.generation_config(DICTIONARY_BATCH_SCHEMA), request_options=options))
+        if not response.candidates or not response.candidates[0].content.parts: return _blocked_or_empty_error(response)
+        text = response.text
+    except Exception as e: return _gemini_exception_error(e)
+    RESPONSE_CHARS.observe(len(text), route="/api/dictionary/batch")
+
+    results, calls = _parse_batch_entries(text, words), 1
+    STRUCTURED_OUTPUT.inc(route="/api/dictionary/batch", outcome="ok" if len(results) == len(words) else "partial")
+    for word in words:
+        if word in results:
+            cache_key, cache_ttl = structured_cache_slot(dictionary_prompt(word), "dictionary")
+            cache_ttl = answer_ttl(cache_ttl, "dictionary", model_name)
+            if cache_key and cache_ttl > 0: response_cache.set(cache_key, json.dumps(results[word]), cache_ttl)
+            lexicon_store(word, results[word])
+            continue
+        results[word] = generate_structured_response(dictionary_prompt(word), DICTIONARY_ENTRY_SCHEMA, endpoint="dictionary")
+        if 'error' not in results[word]: lexicon_store(word, results[word])
+        calls += 1 # At least one; a repair adds another
+    if calls > 1: log.warning("dictionary_batch.partial_parse", words=len(words), retried=calls - 1)
+    return results, calls
+
+def _batch_line(word, entry, cached):
+    return json.dumps({"word": word, "details": render_dictionary_entry(word, entry), "entry": entry, "cached": cached}) + "\n"
+
+def dictionary_batch_lines(words, invalid):
+    """Yields NDJSON lines: invalid words, cache hits, then each chunk's words as it completes."""
+    stats = {"words": len(words), "cached": 0, "failed": len(invalid), "upstream_calls": 0}
+    for word in invalid:
+        yield json.dumps({"word": word, "error": "Single valid word required"}) + "\n"
+
+    pending = []
+    for word in words:
+        cached_entry = lexicon_lookup(word, "/api/dictionary/batch")
+        if cached_entry is not None:
+            stats["cached"] += 1
+            yield _batch_line(word, cached_entry, True)
+            continue
+        cache_key, _ = structured_cache_slot(dictionary_prompt(word), "dictionary")
+        cached_entry = structured_output.parse(response_cache.get(cache_key), DICTIONARY_ENTRY_SCHEMA) if cache_key else None
+        if cache_key: CACHE_LOOKUPS.inc(cache="response", route="/api/dictionary/batch", result="miss" if cached_entry is None else "hit")
+        if cached_entry is None:
+            pending.append(word)
+            continue
+        stats["cached"] += 1
+        yield _batch_line(word, cached_entry, True)
+
+    if pending and (not GEMINI_API_KEY or get_text_model() is None):
+        log.error("gemini.not_configured", reason="API key or model missing")
+        stats["failed"] += len(pending)
+        for word in pending: yield json.dumps({"word": word, "error": "AI service not configured"}) + "\n"
+        pending = []
+
+    chunks = [pending[start:start + DICTIONARY_BATCH_CHUNK_SIZE] for start in range(0, len(pending), DICTIONARY_BATCH_CHUNK_SIZE)]
+    pool = ThreadPoolExecutor(max_workers=max(1, min(DICTIONARY_BATCH_CONCURRENCY, len(chunks)))) if chunks else None
+    try:
+        # Each chunk gets a full deadline from when it starts: a long list may stream for longer than one request's
+        lookup = with_deadline(lookup_dictionary_chunk, seconds=REQUEST_DEADLINE)
+        futures = {pool.submit(lookup, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            outcome = future.result()
+            if isinstance(outcome, dict) and 'error' in outcome: # Whole chunk failed (quota, blocked, ...)
+                outcome, calls = {word: outcome for word in futures[future]}, 1
+            else:
+                outcome, calls = outcome
+            stats["upstream_calls"] += calls
+            for word in futures[future]:
+                result = outcome[word]
+                if 'error' in result:
+                    stats["failed"] += 1
+                    yield json.dumps({"word": word, "error": result['error']}) + "\n"
+                else:
+                    yield _batch_line(word, result, False)
+    finally:
+        if pool is not None: pool.shutdown(wait=False, cancel_futures=True) # Client went away: drop queued chunks
+    log.info("dictionary_batch.done", sample=True, **stats)
+    yield json.dumps({"done": True, **stats}) + "\n"
+
+# --- Helper Function: Server-Sent Events ---
+def wants_stream(request):
+    """True if the client opted into streaming (?stream=1 or Accept: text/event-stream)."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'): return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def _sse_event(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def sse_response(chunks, result_field, error_prefix="", extra=None, on_complete=None):
+    """Forwards a stream_gemini_response generator to the client as SSE.
+
+    Emits `delta` events ({"text": ...}) per chunk, then one `done` event whose
+    payload has the same shape as the endpoint's non-streaming JSON
+    ({result_field: full_text, **extra}). Failures end the stream with an
+    `error` event. `on_complete(full_text)` runs before the `done` event.
+    """
+    def generate():
+        collected = []
+        for chunk in chunks:
+            if isinstance(chunk, dict):
+                yield _sse_event("error", {"error": f"{error_prefix}{chunk.get('error', 'Unknown error')}", **(extra or {})})
+                return
+            collected.append(chunk)
+            yield _sse_event("delta", {"text": chunk})
+        full_text = "".join(collected)
+        if on_complete is not None: on_complete(full_text)
+        yield _sse_event("done", {result_field: full_text, **(extra or {})})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Disable proxy buffering
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+# --- Conversation Sessions (server-side history) ---
+# Sessions live in a SQLite file shared by the workers on a host (SESSION_STORE_DB); a client whose
+# session isn't found (expired, or another host) simply falls back to sending history.
+try:
+    session_store = session_store_from_env(os.environ)
+except Exception as session_init_error:
+    log.error("sessions.init_failed", error=str(session_init_error))
+    session_store = None
+
+SCENARIO_ACK = "Understood. I'll stay in character as Ada for this scenario."
+
+def _clean_turns(history):
+    """Keeps only well-formed {sender, text} entries from a client-supplied history."""
+    return [{"sender": 'user' if entry.get('sender') == 'user' else 'bot', "text": str(entry.get('text', ''))}
+            for entry in history if isinstance(entry, dict)] if isinstance(history, list) else []
+
+def _session_chat(state, message, endpoint, instruction=None):
+    """Builds a Gemini ChatSession over the budgeted window of a session's turns.
+
+    Scenario sessions pin the role-play instruction as the first exchange so it
+    survives history trimming. Returns (start_chat, message), where start_chat(model)
+    opens the ChatSession on whichever model the router picks.
+    """
+    message, window = govern_history(endpoint, message, state["turns"], fixed_text=instruction or "")
+    gemini_history = [{"role": "user", "parts": [instruction]}, {"role": "model", "parts": [SCENARIO_ACK]}] if instruction else []
+    for entry in window: # Gemini wants alternating roles starting with the user, so merge runs
+        role = "user" if entry['sender'] == 'user' else "model"
+        if gemini_history and gemini_history[-1]["role"] == role: gemini_history[-1]["parts"].append(entry['text'])
+        elif gemini_history or role == "user": gemini_history.append({"role": role, "parts": [entry['text']]})
+    report_prompt_tokens(endpoint, count_prompt_tokens((instruction or "") + format_turns(state["turns"]) + message),
+                         count_prompt_tokens((instruction or "") + format_turns(window) + message))
+    PROMPT_CHARS.observe(len(instruction or "") + sum(len(entry['text']) for entry in window) + len(message), route=_route_label())
+    return (lambda model: model.start_chat(history=gemini_history)), message
+
+def generate_session_reply(state, message, endpoint, instruction=None):
+    """Sends one message within a session; returns text or an error dict."""
+    if not GEMINI_API_KEY or get_text_model() is None: return {"error": "AI service not configured"}
+    try:
+        start_chat, message = _session_chat(state, message, endpoint, instruction)
+        with timed_upstream("gemini", "chat"):
+            _, response = gemini_call(endpoint, lambda model, options: start_chat(model).send_message(message, request_options=options),
+                                      cancelled=disconnect_check())
         if not response.candidates or not response.candidates[0].content.parts:
-             block_reason = getattr(response.prompt_feedback, 'block_reason', None)
-             if block_reason:
-                 block_reason_name = block_reason.name
-                 print(f"Gemini request/response blocked: {block_reason_name}")
-                 return {"error": f"Blocked by safety filters ({block_reason_name})"}
-             else:
-                 print("Gemini response was empty or malformed.")
-                 return {"error": "AI returned empty result"}
+            return _blocked_or_empty_error(response)
+        RESPONSE_CHARS.observe(len(response.text), route=_route_label())
+        return response.text
+    except Exception as e: return _gemini_exception_error(e)
+
+def stream_session_reply(state, message, endpoint, instruction=None):
+    """Streaming counterpart of generate_session_reply (same yield contract as stream_gemini_response)."""
+    if not GEMINI_API_KEY or get_text_model() is None:
+        yield {"error": "AI service not configured"}
+        return
+    try:
+        start_chat, message = _session_chat(state, message, endpoint, instruction)
+        with timed_upstream("gemini", "chat_stream"):
+            _, response = gemini_stream(endpoint, lambda model, options: start_chat(model).send_message(message, stream=True, request_options=options))
+            try: yield from _iter_stream_text(response)
+            finally: response.close()
+    except Exception as e: yield _gemini_exception_error(e)
 
-        generated_text = response.text
-        return generated_text # Return text directly
+def scenario_session_instruction(scenario_desc):
+    """Role-play instruction pinned at the start of every scenario session turn."""
+    return f"""You are an AI role-playing partner continuing an English practice scenario. Maintain the character role assigned to 'Ada' based on the original scenario description provided below. Respond naturally to the user's latest message within the context of the ongoing conversation. Stay in character and keep responses concise.
 
-    # --- Error Handling ---
-    except google.api_core.exceptions.ResourceExhausted as e: print(f"Quota Exceeded: {e}"); return {"error": "AI service quota exceeded"}
-    except google.api_core.exceptions.InvalidArgument as e: print(f"Invalid Argument: {e}"); return {"error": "Invalid request to AI"}
-    except Exception as e: print(f"Generic Gemini Error: {type(e).__name__} - {e}"); return {"error": "Unexpected AI service error"}
+Original Scenario Description:
+---
+{scenario_desc}
+---"""
+
+def session_expired_response():
+    return jsonify({"error": "Conversation session expired. Please resend the history.", "session_expired": True}), 404
+
+def session_turn_response(session_id, state, message, endpoint, result_field="reply", instruction=None, failure_status=500, error_format="{}"):
+    """Runs one session turn (streamed or not) and saves the new turns on success."""
+    def save(reply):
+        append_turns(state, {"sender": "user", "text": message}, {"sender": "bot", "text": reply})
+        session_store.put(session_id, state)
+    extra = {"session_id": session_id}
+    if wants_stream(request):
+        return sse_response(stream_session_reply(state, message, endpoint, instruction), result_field,
+                            extra=extra, on_complete=save)
+    reply = generate_session_reply(state, message, endpoint, instruction)
+    if isinstance(reply, dict):
+        return jsonify({result_field: error_format.format(reply['error']), "error": reply['error'], **extra}), error_status(reply, failure_status)
+    save(reply)
+    return jsonify({result_field: reply, **extra})
+
+# --- Background Jobs (async mode for long generations) ---
+# Clients opt in with `Prefer: respond-async` or ?async=1 and get 202 + a job
+# id; any worker on the host may run the job (JOBS_DB is shared), and clients
+# poll /api/jobs/<id> (JSON or SSE) or pass an allow-listed https callback_url.
+JOBS_WEBHOOK_HOSTS = {host.strip().lower() for host in os.environ.get("JOBS_WEBHOOK_HOSTS", "").split(",") if host.strip()}
+JOBS_SSE_TIMEOUT = int(os.environ.get("JOBS_SSE_TIMEOUT", 300)) # Longest a status stream stays open
+JOBS_SSE_POLL = 0.5
+
+def wants_async(request):
+    """True if the client asked for a job instead of waiting (and the queue is available)."""
+    if job_queue is None: return False
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'): return True
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+def _notify_job_webhook(job):
+    callback_url = job_queue.callback_url(job["job_id"])
+    if callback_url:
+        status = deliver_webhook(callback_url, job)
+        log.info("jobs.webhook", job_id=job["job_id"], status=status)
+
+def _run_job(handler):
+    """Runs a handler in an app context (g, url building) under JOBS_DEADLINE and returns its result dict."""
+    return with_deadline(handler, seconds=JOBS_DEADLINE)
+
+def submit_job_response(kind, payload, user_info, data):
+    """Queues a job and answers 202 with its id and status URL."""
+    callback_url = data.get('callback_url')
+    if callback_url and not webhook_allowed(callback_url, JOBS_WEBHOOK_HOSTS): return jsonify({"error": "callback_url not allowed"}), 400
+    try:
+        job_id = job_queue.submit(kind, payload, owner=_client_id(user_info), callback_url=callback_url)
+    except QueueFull:
+        log.warning("jobs.queue_full", kind=kind)
+        response = jsonify({"error": "Too many background jobs. Please try again shortly."})
+        response.headers['Retry-After'] = "30"
+        return response, 503
+    log.info("jobs.submitted", kind=kind, job_id=job_id)
+    status_url = url_for('job_status', job_id=job_id)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+def _job_body(job):
+    body = {key: job[key] for key in ("job_id", "kind", "status", "created_at", "started_at", "finished_at")}
+    result = job.get("result")
+    if result is not None: body["result"] = result
+    if job["kind"] == "tts" and result and result.get("audio_key"): body["audio_url"] = url_for('elevenlabs_tts_clip', audio_key=result["audio_key"])
+    return body
+
+try:
+    job_queue = queue_from_env(os.environ, on_finish=_notify_job_webhook)
+except Exception as jobs_init_error:
+    log.error("jobs.init_failed", error=str(jobs_init_error))
+    job_queue = None
+if job_queue is not None:
+    job_queue.register("tts", _run_job(lambda payload: synthesize_tts_clip(payload["text"])), priority=0)
+    job_queue.register("essay", _run_job(lambda payload: run_essay(payload["topic"], payload["essay_type"], payload["outline_only"])[0]), priority=1)
+    job_queue.register("summarize", _run_job(lambda payload: run_summarize(payload["text"])[0]), priority=2)
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Job status/result as JSON, or as SSE (`status` events, then `done` or `error`)."""
+    user_info = verify_firebase_token(request)
+    if user_info is None: return jsonify({"error": "Unauthorized"}), 401
+    if job_queue is None: return jsonify({"error": "Background jobs not enabled"}), 404
+    job = job_queue.get(job_id)
+    if job is None or job["owner"] != _client_id(user_info): return jsonify({"error": "Job not found or expired"}), 404
+    job_queue.ensure_workers()
+    if not wants_stream(request): return jsonify(_job_body(job))
+
+    def generate(job=job):
+        deadline, last_status = time.time() + JOBS_SSE_TIMEOUT, None
+        while True:
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield _sse_event("status", {"job_id": job_id, "status": last_status})
+            if job["status"] in TERMINAL:
+                body = _job_body(job)
+                yield _sse_event("done" if job["status"] == "done" else "error", {**body.get("result", {}), **body})
+                return
+            if time.time() > deadline:
+                yield _sse_event("error", {"job_id": job_id, "status": job["status"], "error": "Still running; poll the status URL."})
+                return
+            time.sleep(JOBS_SSE_POLL)
+            job = job_queue.get(job_id) or {**job, "status": "failed", "result": {"error": "Job expired"}}
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+# --- Metrics Endpoint ---
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def collect_component_stats():
+    """Copies the stats() of caches, breaker, coalescing and admission into metrics."""
+    if response_cache is not None:
+        stats = response_cache.stats()
+        for tier, hits in stats["hits"].items(): COMPONENT_EVENTS.set_total(hits, component="response_cache", event=f"hit_{tier}")
+        for tier, evictions in stats["evictions"].items(): COMPONENT_EVENTS.set_total(evictions, component="response_cache", event=f"eviction_{tier}")
+        for event in ("misses", "stores", "errors"): COMPONENT_EVENTS.set_total(stats[event], component="response_cache", event=event)
+    if lexicon is not None:
+        stats = lexicon.stats()
+        for event in ("hits", "misses", "stores", "suggestions"): COMPONENT_EVENTS.set_total(stats[event], component="lexicon", event=event)
+        COMPONENT_STATE.set(stats["entries"], component="lexicon", name="entries")
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        for event in ("hits", "near_hits", "misses", "stores", "evictions", "audits", "false_hits"): COMPONENT_EVENTS.set_total(stats[event], component="semantic_cache", event=event)
+        COMPONENT_STATE.set(stats["entries"], component="semantic_cache", name="entries")
+    if audio_store is not None:
+        stats = audio_store.stats()
+        for event in ("hits", "misses", "evictions"): COMPONENT_EVENTS.set_total(stats[event], component="tts_audio_cache", event=event)
+        COMPONENT_STATE.set(stats["bytes"], component="tts_audio_cache", name="bytes")
+    if elevenlabs_client is not None:
+        stats = elevenlabs_client.stats()
+        for event in ("requests", "retries", "failures", "connections_opened", "circuit_opened"):
+            COMPONENT_EVENTS.set_total(stats[event], component="elevenlabs", event=event)
+        COMPONENT_STATE.set(CIRCUIT_STATES.get(stats["circuit_state"], -1), component="elevenlabs", name="circuit_state")
+    for flights in (gemini_flights, tts_flights):
+        stats = flights.stats()
+        for event in ("leaders", "coalesced", "cross_process_waits"):
+            COMPONENT_EVENTS.set_total(stats[event], component=f"singleflight_{flights.name}", event=event)
+        COMPONENT_STATE.set(stats["in_flight"], component=f"singleflight_{flights.name}", name="in_flight")
+    if admission is not None:
+        stats = admission.stats()
+        for priority, count in stats["admitted"].items(): COMPONENT_EVENTS.set_total(count, component="admission", event=f"admitted_{priority}")
+        for reason, count in stats["rejected"].items(): COMPONENT_EVENTS.set_total(count, component="admission", event=f"rejected_{reason}")
+        COMPONENT_EVENTS.set_total(stats["queued"], component="admission", event="queued")
+    if image_cache is not None:
+        stats = image_cache.stats()
+        for event in ("hits", "near_hits", "misses"): COMPONENT_EVENTS.set_total(stats[event], component="image_cache", event=event)
+        COMPONENT_STATE.set(stats["entries"], component="image_cache", name="entries")
+    if session_store is not None and hasattr(session_store, "__len__"):
+        COMPONENT_STATE.set(len(session_store), component="sessions", name="active")
+    if job_queue is not None:
+        stats = job_queue.stats()
+        for event in ("completed", "failed", "retried"): COMPONENT_EVENTS.set_total(stats[event], component="jobs", event=event)
+        for name in ("queued", "running"): COMPONENT_STATE.set(stats[name], component="jobs", name=name)
+    stats = model_router.stats()
+    for event in ("fallbacks", "hedges", "hedge_wins"): COMPONENT_EVENTS.set_total(stats[event], component="model_router", event=event)
+    for model_name, model_stats in stats["models"].items():
+        for event in ("calls", "errors"): COMPONENT_EVENTS.set_total(model_stats[event], component=f"model:{model_name}", event=event)
+        if model_stats["p95"] is not None: COMPONENT_STATE.set(model_stats["p95"], component=f"model:{model_name}", name="p95_seconds")
+    if content_library is not None:
+        stats = content_library.stats()
+        for event in ("hits", "misses", "generated", "generate_failures", "retired"): COMPONENT_EVENTS.set_total(stats[event], component="content_library", event=event)
+        for name in ("variants", "pairs"): COMPONENT_STATE.set(stats[name], component="content_library", name=name)
+    if firebase_verifier is not None:
+        stats = firebase_verifier.stats()
+        for event in ("hits", "misses", "rejected", "cert_fetches", "cert_fetch_errors"): COMPONENT_EVENTS.set_total(stats[event], component="firebase_auth", event=event)
+        COMPONENT_STATE.set(stats["entries"], component="firebase_auth", name="cached_tokens")
+    if gemini_models is not None:
+        stats = gemini_models.status()
+        COMPONENT_STATE.set(int(stats["ready"]), component="gemini_client", name="ready")
+        if stats["warm_seconds"] is not None: COMPONENT_STATE.set(stats["warm_seconds"], component="gemini_client", name="warm_seconds")
+    COMPONENT_STATE.set(STARTUP_SECONDS, component="startup", name="import_seconds")
+
+metrics.add_collector(collect_component_stats)
+
+def operator_authorized():
+    """Whether the request carries METRICS_TOKEN. Operator endpoints fail closed: without a configured token they're off."""
+    token = os.environ.get("METRICS_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition, merged across gunicorn workers (requires METRICS_TOKEN)."""
+    if not os.environ.get("METRICS_TOKEN"): return Response("Not Found\n", status=404, mimetype='text/plain')
+    if not operator_authorized(): return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/semantic-cache/audits')
+def semantic_cache_audits():
+    """Recent audited near hits of the semantic cache (same token as /metrics), for spotting bad matches; they include users' queries."""
+    if not os.environ.get("METRICS_TOKEN"): return jsonify({"error": "Not found"}), 404
+    if not operator_authorized(): return jsonify({"error": "Unauthorized"}), 401
+    if semantic_cache is None: return jsonify({"error": "Semantic cache not enabled"}), 404
+    return jsonify({"stats": semantic_cache.stats(), "audits": semantic_cache.recent_audits()})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness probe: 503 until this worker's Gemini client is warm (starting the warm-up if it isn't)."""
+    gemini = gemini_models.status() if gemini_models is not None else {"ready": False, "error": "not configured"}
+    if gemini_models is not None and not gemini["ready"] and gemini["error"] is None: gemini_models.warm_async()
+    ready = gemini_models is None or gemini["ready"] # Without an API key there's nothing to warm
+    body = {"ready": ready, "pid": os.getpid(), "import_seconds": round(STARTUP_SECONDS, 3), "gemini": gemini,
+            "elevenlabs": elevenlabs_client is not None, "jobs": job_queue is not None}
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    user_info = verify_firebase_token(request)
+    if user_info is None: return jsonify({"error": "Unauthorized"}), 401
+    if session_store is None or not session_store.delete(session_id, _client_id(user_info)): return jsonify({"error": "Session not found"}), 404
+    return jsonify({"deleted": True})
 
 # Inside app.py, add this route function
 
@@ -141,22 +1288,86 @@ def privacy_policy():
 # Make sure it's outside other functions but under the app = Flask(__name__) line
 # --- Frontend Routes ---
 
+# --- Static Assets & Compression ---
+# Templates link assets through asset_url(), which gives their content-hashed /assets/ URL (immutable, precompressed).
+ASSET_MAX_AGE = 365 * 24 * 3600
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 1024)) # Smaller dynamic bodies aren't worth compressing
+try:
+    asset_manifest = asset_manifest_from_env(os.environ, app.static_folder)
+except Exception as asset_manifest_error:
+    log.error("assets.manifest_failed", error=str(asset_manifest_error))
+    asset_manifest = None
+
+@app.template_global()
+def asset_url(filename):
+    """Fingerprinted URL of a static file (plain /static/ URL if the manifest is unavailable)."""
+    if asset_manifest is None or filename not in asset_manifest.files: return url_for('static', filename=filename)
+    return url_for('fingerprinted_asset', filename=asset_manifest.files[filename])
+
+@app.route('/assets/<path:filename>')
+def fingerprinted_asset(filename):
+    """Serves a content-hashed asset, precompressed when the client accepts it."""
+    if asset_manifest is None: return jsonify({"error": "Not found"}), 404
+    resolved = asset_manifest.resolve(filename, request.headers.get('Accept-Encoding', ''))
+    if resolved is None:
+        current = asset_manifest.current(filename) # Page from before a deploy asking for an old version
+        if current is None: return jsonify({"error": "Not found"}), 404
+        response = redirect(url_for('fingerprinted_asset', filename=current))
+        response.headers['Cache-Control'] = "no-cache"
+        return response
+    path, mimetype, encoding, digest = resolved
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=f"{digest}-{encoding}" if encoding else digest, max_age=ASSET_MAX_AGE)
+    response.headers['Cache-Control'] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    response.vary.add('Accept-Encoding')
+    if encoding: response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.after_request
+def compress_dynamic_response(response):
+    if request.method != 'HEAD': compress_response(response, request.headers.get('Accept-Encoding', ''), COMPRESS_MIN_BYTES)
+    return response
+
 @app.route('/')
 def index(): return render_template('index.html')
 @app.route('/signin')
 def signin_page(): return render_template('signin.html')
 
+# --- Cacheable GET Variants of Lookups ---
+# Dictionary and grammar lookups also answer GET with query parameters, so the browser and the
+# service worker can cache them and revalidate with If-None-Match (a 304 with no body when nothing changed).
+API_GET_MAX_AGE = {"dictionary": 7 * 24 * 3600, "grammar_aid": 24 * 3600}
+
+def request_params():
+    """Request parameters: the JSON body for POST, the query string for GET."""
+    return request.args if request.method == 'GET' else request.json
+
+def lookup_response(body, endpoint):
+    """Successful lookup response; for GET with Cache-Control and an ETag, or a 304 if the client's copy is current."""
+    response = jsonify(body)
+    if request.method != 'GET': return response
+    max_age = API_GET_MAX_AGE[endpoint]
+    response.headers['Cache-Control'] = f"private, max-age={max_age}, stale-while-revalidate={max_age}"
+    response.add_etag()
+    return response.make_conditional(request)
+
 # --- Backend API Routes ---
 @app.route('/sw.js')
 def service_worker():
-    # Serves sw.js file from the static directory at the root path /sw.js
-    # mimetype is important for the browser to interpret it correctly
-    response = send_from_directory('static', 'sw.js', mimetype='application/javascript')
-    # Optional: Add headers to prevent caching of the service worker file itself by intermediate caches
-    # response.headers['Cache-Control'] = 'no-cache'
-    return response
+    """Serves static/sw.js at the root (for its scope), prefixed with the asset manifest it precaches.
+
+    The prefix changes with any asset, so browsers see a new service worker,
+    which installs the new files under a new cache name and drops the old one.
+    """
+    if asset_manifest is None: return send_from_directory('static', 'sw.js', mimetype='application/javascript')
+    with open(os.path.join(app.static_folder, 'sw.js'), encoding='utf-8') as f: source = f.read()
+    assets = {"cacheName": f"adai-static-{asset_manifest.version}", "urls": [url_for('fingerprinted_asset', filename=name) for name in asset_manifest.files.values()]}
+    response = Response(f"self.ASSET_MANIFEST = {json.dumps(assets)};\n{source}", mimetype='application/javascript')
+    response.headers['Cache-Control'] = "no-cache" # Always revalidated, so asset updates are picked up
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/api/chat', methods=['POST'])
+@admission_controlled("chat")
 def api_chat():
     user_info = verify_firebase_token(request)
     if user_info is None: return jsonify({"error": "Unauthorized"}), 401
@@ -165,12 +1376,27 @@ def api_chat():
     user_message = data.get('message')
     history = data.get('history', []) # History from frontend {sender, text}
     if not user_message or not isinstance(history, list): return jsonify({"error": "Invalid input"}), 400
-    # Pass message and history to helper. History formatting happens in helper.
-    response_content = generate_gemini_response(prompt=user_message, is_chat=True, chat_history=history[-6:]) # Limit history
-    if isinstance(response_content, dict) and 'error' in response_content: return jsonify(response_content), 500
+    # --- Session mode: the server keeps the history; the client sends only the new message ---
+    session_id = data.get('session_id')
+    if session_store is not None and (session_id or data.get('session')):
+        if session_id:
+            state = session_store.get(session_id, _client_id(user_info))
+            if state is None or state.get("kind") != "chat": return session_expired_response()
+        else: # Start a session, seeded with whatever history the client already has
+            session_id, state = new_session_id(), new_session_state("chat", _client_id(user_info), turns=_clean_turns(history))
+        return session_turn_response(session_id, state, user_message, "chat")
+    # Limit history by turns and by tokens; history formatting happens in helper.
+    prompt_before = count_prompt_tokens(build_final_prompt(user_message, True, history[-6:]))
+    user_message, history = govern_history("chat", user_message, history[-6:])
+    report_prompt_tokens("chat", prompt_before, count_prompt_tokens(build_final_prompt(user_message, True, history)))
+    if wants_stream(request):
+        return sse_response(stream_gemini_response(prompt=user_message, is_chat=True, chat_history=history, task="chat"), "reply")
+    response_content = generate_gemini_response(prompt=user_message, is_chat=True, chat_history=history, task="chat")
+    if isinstance(response_content, dict) and 'error' in response_content: return jsonify(response_content), error_status(response_content)
     return jsonify({"reply": response_content})
 
 @app.route('/api/generate_text', methods=['POST'])
+@admission_controlled("generate_text")
 def api_generate_text():
     user_info = verify_firebase_token(request)
     if user_info is None: return jsonify({"error": "Unauthorized"}), 401
@@ -179,37 +1405,80 @@ def api_generate_text():
     level = data.get('level')
     topic = data.get('topic')
     if not level or not topic: return jsonify({"error": "Level and topic required"}), 400
-    # --- CORRECTED DICTIONARY ---
-    level_map = {
-        "beginner": "very simple (CEFR A1-A2)",
-        "encounter": "simple (CEFR A2-B1)",
-        "investigation": "intermediate (CEFR B1-B2)",
-        "awakening": "upper-intermediate (CEFR B2)",
-        "summit": "advanced (CEFR C1)",
-        "expert": "near-native/highly advanced (CEFR C2)"
-    }
-    # --- END CORRECTION ---
-    level_description = level_map.get(level.lower(), "intermediate (CEFR B1-B2)")
-    prompt = f"""Instructions:\nGenerate educational content. Write a short text (150-250 words) on a topic for an English learner.\nText should be engaging, correct, and use vocabulary/syntax for the specified level.\nOutput *only* the generated text itself.\n\nParameters:\nTopic: "{topic}"\nProficiency Level: {level_description}\n\nGenerated Text:\n"""
-    generated_text = generate_gemini_response(prompt)
-    if isinstance(generated_text, dict) and 'error' in generated_text: return jsonify({"generated_text": f"Error: {generated_text['error']}"}), 500
-    if isinstance(generated_text, str) and (generated_text.strip().lower() == level.lower() or level_description in generated_text.strip()[:len(level_description)+20]): return jsonify({"generated_text": f"Error: AI failed (echo received '{generated_text[:50]}...'). Try again."}), 500
+    level_key = level.lower() if level.lower() in LEVEL_MAP else DEFAULT_LEVEL
+    level_description = LEVEL_MAP[level_key]
+    if content_library is not None:
+        content_library.ensure_sweeper(LEVEL_MAP)
+        library_text = content_library.take(level_key, topic)
+        CACHE_LOOKUPS.inc(cache="content_library", route=_route_label(), result="miss" if library_text is None else "hit")
+        if library_text is not None: return jsonify({"generated_text": library_text}), 200, {"X-Content-Source": "library"}
+    prompt = generate_text_prompt(topic, level_description)
+    generated_text = generate_gemini_response(prompt, endpoint="generate_text")
+    if isinstance(generated_text, dict) and 'error' in generated_text: return jsonify({"generated_text": f"Error: {generated_text['error']}"}), error_status(generated_text)
+    if isinstance(generated_text, str) and is_level_echo(generated_text, level, level_description): return jsonify({"generated_text": f"Error: AI failed (echo received '{generated_text[:50]}...'). Try again."}), 500
+    if content_library is not None: content_library.add(level_key, topic, generated_text)
     return jsonify({"generated_text": generated_text})
 
-@app.route('/api/dictionary', methods=['POST'])
+@app.route('/api/dictionary', methods=['GET', 'POST'])
+@admission_controlled("dictionary")
 def api_dictionary():
      user_info = verify_firebase_token(request)
      if user_info is None: return jsonify({"error": "Unauthorized"}), 401
-     data = request.json
+     data = request_params()
      if not data: return jsonify({"error": "Invalid JSON"}), 400
      word = data.get('word')
      if not word or not isinstance(word, str) or len(word.split()) > 1: return jsonify({"error": "Single valid word required"}), 400
-     prompt = f"""Provide a detailed dictionary entry for "{word}". Include Definition(s), Synonyms, Antonyms, Etymology, Example Sentence(s), Turkish Meaning. Format clearly. If not found, state that."""
-     definition_details = generate_gemini_response(prompt)
-     if isinstance(definition_details, dict) and 'error' in definition_details: return jsonify({"details": f"Error: {definition_details['error']}"}), 500
-     return jsonify({"details": definition_details})
+     entry = lexicon_lookup(word, _route_label()) or structured_output.parse(semantic_lookup("dictionary", word), DICTIONARY_ENTRY_SCHEMA)
+     if entry is None:
+         entry = generate_structured_response(dictionary_prompt(word), DICTIONARY_ENTRY_SCHEMA, endpoint="dictionary")
+         if 'error' in entry: return jsonify({"details": f"Error: {entry['error']}"}), error_status(entry)
+         lexicon_store(word, entry)
+         if entry.get("found"): semantic_store("dictionary", word, json.dumps(entry)) # Not-found replies are often typos; don't spread them
+     return lookup_response({"details": render_dictionary_entry(word, entry), "entry": entry}, "dictionary")
+
+@app.route('/api/dictionary/batch', methods=['POST'])
+@admission_controlled("dictionary_batch")
+def api_dictionary_batch():
+     """Looks up a word list; streams one NDJSON line per word as results arrive.
+
+     Lines are {"word", "details", "cached"} or {"word", "error"}, followed by a
+     final {"done": true, ...} summary line.
+     """
+     user_info = verify_firebase_token(request)
+     if user_info is None: return jsonify({"error": "Unauthorized"}), 401
+     data = request.json
+     if not data: return jsonify({"error": "Invalid JSON"}), 400
+     words = data.get('words')
+     if isinstance(words, str): words = words.replace(',', '\n').splitlines() # Pasted list
+     if not isinstance(words, list) or not words: return jsonify({"error": "List of words required"}), 400
+     if len(words) > DICTIONARY_BATCH_MAX_WORDS: return jsonify({"error": f"Too many words (max {DICTIONARY_BATCH_MAX_WORDS})"}), 413
+     unique, invalid = dedupe_batch_words(words)
+     log.info("dictionary_batch.request", sample=True, words=len(words), unique=len(unique), invalid=len(invalid))
+     headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+     return Response(stream_with_context(dictionary_batch_lines(unique, invalid)), mimetype='application/x-ndjson', headers=headers)
+
+@app.route('/api/dictionary/suggest', methods=['GET'])
+def api_dictionary_suggest():
+     """Autocomplete for the dictionary input: words in the local lexicon starting with ?q= (or whose Turkish meaning does)."""
+     user_info = verify_firebase_token(request)
+     if user_info is None: return jsonify({"error": "Unauthorized"}), 401
+     prefix = request.args.get('q', '').strip()
+     if not prefix or len(prefix) > 64: return jsonify({"suggestions": []})
+     try: limit = max(1, min(int(request.args.get('limit', DICTIONARY_SUGGEST_LIMIT)), 20))
+     except ValueError: limit = DICTIONARY_SUGGEST_LIMIT
+     suggestions = lexicon.suggest(prefix, limit) if lexicon is not None else []
+     response = jsonify({"suggestions": suggestions})
+     response.headers['Cache-Control'] = "private, max-age=300"
+     return response
+
+CORRECTION_SCHEMA = {
+    "type": "object",
+    "properties": {"corrected_text": {"type": "string"}, "feedback": {"type": "array", "items": {"type": "string"}}},
+    "required": ["corrected_text", "feedback"],
+}
 
 @app.route('/api/correct_text', methods=['POST'])
+@admission_controlled("correct_text")
 def api_correct_text():
      user_info = verify_firebase_token(request)
      if user_info is None: return jsonify({"error": "Unauthorized"}), 401
@@ -217,36 +1486,60 @@ def api_correct_text():
      if not data: return jsonify({"error": "Invalid JSON"}), 400
      text = data.get('text')
      if not text or not isinstance(text, str): return jsonify({"error": "Text required"}), 400
-     prompt = f"""Act as expert proofreader/teacher. Review text by learner. Provide corrected version under "Corrected Text:" and detailed feedback under "Feedback:".\nOriginal Text:\n---\n{text}\n---\nCorrected Text:\n[Your corrected version]\n\nFeedback:\n* [Feedback point 1]\n..."""
-     correction_and_feedback = generate_gemini_response(prompt)
-     if isinstance(correction_and_feedback, dict) and 'error' in correction_and_feedback: return jsonify({"corrected_text": f"Error: {correction_and_feedback['error']}", "feedback": ""}), 500
-     # --- Parsing logic ---
-     corrected_text = "Could not parse correction." ; feedback = "Could not parse feedback."
-     try:
-        corr_marker, feed_marker = "Corrected Text:", "Feedback:"
-        corr_idx, feed_idx = correction_and_feedback.find(corr_marker), correction_and_feedback.find(feed_marker)
-        if corr_idx != -1:
-            corr_start = corr_idx + len(corr_marker); end_idx = feed_idx if (feed_idx != -1 and feed_idx > corr_idx) else len(correction_and_feedback)
-            corrected_text = correction_and_feedback[corr_start:end_idx].strip()
-        if feed_idx != -1: feed_start = feed_idx + len(feed_marker); feedback = correction_and_feedback[feed_start:].strip()
-        elif corr_idx == -1 and len(correction_and_feedback) < 150: feedback = correction_and_feedback
-     except Exception as parse_error: print(f"Error parsing correction: {parse_error}"); feedback = correction_and_feedback
-     return jsonify({"corrected_text": corrected_text, "feedback": feedback})
-
-@app.route('/api/grammar_aid', methods=['POST'])
+     prompt = f"""Act as expert proofreader/teacher. Review text by learner. Give the fully corrected version as corrected_text and detailed feedback as a list of short points (what was wrong and why) as feedback.\nOriginal Text:\n---\n{text}\n---"""
+     correction = generate_structured_response(prompt, CORRECTION_SCHEMA, task="correct_text")
+     if 'error' in correction: return jsonify({"corrected_text": f"Error: {correction['error']}", "feedback": ""}), error_status(correction)
+     feedback = "\n".join(f"* {point.strip()}" for point in correction["feedback"] if point.strip())
+     return jsonify({"corrected_text": correction["corrected_text"].strip(), "feedback": feedback})
+
+@app.route('/api/grammar_aid', methods=['GET', 'POST'])
+@admission_controlled("grammar_aid")
 def api_grammar_aid():
      user_info = verify_firebase_token(request)
      if user_info is None: return jsonify({"error": "Unauthorized"}), 401
-     data = request.json
+     data = request_params()
      if not data: return jsonify({"error": "Invalid JSON"}), 400
      topic = data.get('topic')
      if not topic or not isinstance(topic, str): return jsonify({"error": "Topic required"}), 400
      prompt = f"Explain English grammar topic '{topic}' clearly for intermediate learner (B1-B2). Cover rules, usage, examples, exceptions. Output only the explanation."
-     explanation = generate_gemini_response(prompt)
-     if isinstance(explanation, dict) and 'error' in explanation: return jsonify({"explanation": f"Error: {explanation['error']}"}), 500
-     return jsonify({"explanation": explanation})
+     explanation = semantic_lookup("grammar_aid", topic)
+     if explanation is None:
+         explanation = generate_gemini_response(prompt, endpoint="grammar_aid")
+         if isinstance(explanation, dict) and 'error' in explanation: return jsonify({"explanation": f"Error: {explanation['error']}"}), error_status(explanation)
+         semantic_store("grammar_aid", topic, explanation)
+     return lookup_response({"explanation": explanation}, "grammar_aid")
+
+OUTLINE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "introduction": {"type": "object", "properties": {"hook": {"type": "string"}, "thesis": {"type": "string"}}, "required": ["hook", "thesis"]},
+        "body": {"type": "array", "items": {"type": "object", "properties": {
+            "topic_sentence": {"type": "string"}, "support": {"type": "array", "items": {"type": "string"}}}, "required": ["topic_sentence", "support"]}},
+        "conclusion": {"type": "object", "properties": {"summary": {"type": "string"}, "final_thought": {"type": "string"}}, "required": ["summary", "final_thought"]},
+    },
+    "required": ["introduction", "body", "conclusion"],
+}
+
+def render_outline(outline):
+    lines = [outline["title"].strip(), ""] if outline.get("title", "").strip() else []
+    lines += ["I. Introduction", f"  - Hook: {outline['introduction']['hook']}", f"  - Thesis: {outline['introduction']['thesis']}", ""]
+    for number, paragraph in enumerate(outline["body"], 1):
+        lines.append(f"{_roman(number + 1)}. Body Paragraph {number}: {paragraph['topic_sentence']}")
+        lines += [f"  - {point}" for point in paragraph["support"]] + [""]
+    lines += [f"{_roman(len(outline['body']) + 2)}. Conclusion", f"  - Summary: {outline['conclusion']['summary']}",
+              f"  - Final thought: {outline['conclusion']['final_thought']}"]
+    return "\n".join(lines)
+
+def _roman(number):
+    numerals = ((10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I"))
+    result = ""
+    for value, numeral in numerals:
+        while number >= value: result += numeral; number -= value
+    return result
 
 @app.route('/api/essay', methods=['POST'])
+@admission_controlled("essay")
 def api_essay():
      user_info = verify_firebase_token(request)
      if user_info is None: return jsonify({"error": "Unauthorized"}), 401
@@ -256,39 +1549,205 @@ def api_essay():
      if not topic or not isinstance(topic, str): return jsonify({"error": "Topic required"}), 400
      allowed_essay_types = ['argumentative', 'persuasive', 'expository', 'narrative', 'descriptive', 'compare and contrast', 'cause and effect', 'critical analysis', 'definition', 'process analysis', 'reflective', 'literary analysis', 'review', 'research proposal']
      if not isinstance(essay_type, str) or essay_type.lower() not in allowed_essay_types: essay_type = 'argumentative'
-     if generate_outline: prompt = f"Create detailed outline for a {essay_type} essay on: '{topic}'. Include intro (hook, thesis), body points (topic sentences, support), conclusion (summary, restated thesis)."
-     else: prompt = f"Write complete {essay_type} essay (approx 5 paras) on: '{topic}'. Include intro (hook, thesis), body (topic sentences, support), transitions, conclusion (summary, final thought)."
-     essay_content = generate_gemini_response(prompt)
-     if isinstance(essay_content, dict) and 'error' in essay_content: return jsonify({"essay_content": f"Error: {essay_content['error']}"}), 500
-     return jsonify({"essay_content": essay_content})
+     if wants_async(request): return submit_job_response("essay", {"topic": topic, "essay_type": essay_type, "outline_only": bool(generate_outline)}, user_info, data)
+     if wants_stream(request) and not generate_outline: return sse_response(stream_gemini_response(essay_prompt(topic, essay_type), endpoint="essay"), "essay_content", error_prefix="Error: ")
+     body, status = run_essay(topic, essay_type, generate_outline)
+     return jsonify(body), status
+
+def essay_prompt(topic, essay_type):
+     return f"Write complete {essay_type} essay (approx 5 paras) on: '{topic}'. Include intro (hook, thesis), body (topic sentences, support), transitions, conclusion (summary, final thought)."
+
+def run_essay(topic, essay_type, outline_only=False):
+     """Generates an essay (or structured outline); returns (body, status). Shared with the job queue."""
+     if outline_only:
+         # Outlines come back as JSON (never streamed); essay_content carries the rendered text as before
+         prompt = f"Create detailed outline for a {essay_type} essay on: '{topic}'. Include intro (hook, thesis), body points (topic sentences, support), conclusion (summary, restated thesis)."
+         outline = generate_structured_response(prompt, OUTLINE_SCHEMA, endpoint="essay")
+         if 'error' in outline: return {"essay_content": f"Error: {outline['error']}", "error": outline['error']}, error_status(outline)
+         return {"essay_content": render_outline(outline), "outline": outline}, 200
+     essay_content = generate_gemini_response(essay_prompt(topic, essay_type), endpoint="essay")
+     if isinstance(essay_content, dict) and 'error' in essay_content: return {"essay_content": f"Error: {essay_content['error']}", "error": essay_content['error']}, error_status(essay_content)
+     return {"essay_content": essay_content}, 200
+
+def _send_cached_clip(cached_path, audio_key):
+    log.debug("tts.cache_hit", audio_key=audio_key[:12])
+    response = send_file(cached_path, mimetype='audio/mpeg', conditional=True, etag=audio_key, max_age=TTS_CACHE_MAX_AGE)
+    # Content-Location points at the GET route, which also answers Range/If-None-Match requests.
+    response.headers['Content-Location'] = url_for('elevenlabs_tts_clip', audio_key=audio_key)
+    return response
+
+def _close_after(chunks, upstream_response):
+    """Yields chunks and releases the upstream connection back to the pool."""
+    try:
+        yield from chunks
+    finally:
+        upstream_response.close()
+
+def tts_error_response(error):
+    """Maps an ElevenLabs failure (raised before any audio was sent) to a JSON error response."""
+    if isinstance(error, CircuitOpenError): # ElevenLabs is failing; don't tie up the worker
+        record_error("CircuitOpenError")
+        log.warning("elevenlabs.circuit_open", retry_after=round(error.retry_after, 1))
+        response = jsonify({"error": "TTS service temporarily unavailable."})
+        response.headers['Retry-After'] = str(max(1, int(error.retry_after)))
+        return response, 503
+    if isinstance(error, requests.exceptions.HTTPError):
+        record_error(f"HTTPError_{error.response.status_code}")
+        log.error("elevenlabs.http_error", status=error.response.status_code, body=error.response.text[:500])
+        error_detail = f"ElevenLabs Error ({error.response.status_code})"
+        try: err_json = error.response.json(); error_detail = err_json.get('detail', {}).get('message', str(err_json))
+        except ValueError: error_detail = error.response.text
+        return jsonify({"error": f"Failed audio gen: {error_detail}"}), error.response.status_code if error.response.status_code >= 400 else 500
+    if isinstance(error, requests.exceptions.RequestException):
+        record_error(type(error).__name__)
+        log.error("elevenlabs.network_error", error_class=type(error).__name__, error=str(error))
+        return jsonify({"error": f"Could not connect to TTS: {error}"}), 504
+    record_error(type(error).__name__)
+    log.error("tts.unexpected_error", error_class=type(error).__name__, error=str(error))
+    return jsonify({"error": "Unexpected TTS server error."}), 500
+
+def wants_segmented_tts(data, text):
+    """Segmented playback for long texts, unless the client says otherwise with "segmented"."""
+    segmented = data.get('segmented')
+    if isinstance(segmented, bool): return segmented
+    return len(text) >= TTS_SEGMENTED_MIN_CHARS
+
+def tts_segment_audio(segment):
+    """MP3 bytes for one segment: from the audio cache, an identical in-flight synthesis, or ElevenLabs."""
+    audio_key = AudioStore.key_for(segment, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS)
+    def read_cached():
+        path = audio_store.lookup(audio_key)
+        if path is None: return None
+        with open(path, "rb") as f: return f.read()
+    def synthesize():
+        payload = {"text": segment, "model_id": ELEVENLABS_MODEL_ID, "voice_settings": ELEVENLABS_VOICE_SETTINGS}
+        with timed_upstream("elevenlabs", "tts_segment"):
+            audio = elevenlabs_client.post(ELEVENLABS_API_URL, payload).content
+        if audio_store is not None: audio_store.put(audio_key, audio)
+        return audio
+    if audio_store is None: return synthesize()
+    cached = read_cached()
+    CACHE_LOOKUPS.inc(cache="tts_audio", route="/api/elevenlabs_tts", result="hit" if cached is not None else "miss")
+    if cached is not None: return cached
+    return tts_flights.do(audio_key, synthesize, recheck=read_cached, timeout=TTS_FLIGHT_WAIT)
+
+def segmented_tts_response(segments):
+    """Streams consecutive per-segment MP3s, synthesizing a few segments ahead of the one being sent.
+
+    The first segment is synthesized before responding, so its errors still
+    map to a status code; a later failure ends the stream early (logged).
+    """
+    audio = pipelined(segments, tts_segment_audio, concurrency=TTS_SEGMENT_CONCURRENCY)
+    try:
+        first = next(audio)
+    except Exception as e:
+        audio.close()
+        return tts_error_response(e)
+    def body():
+        sent = 1
+        try:
+            yield first
+            for clip in audio:
+                yield clip
+                sent += 1
+        except Exception as e:
+            record_error(type(e).__name__)
+            log.error("tts.segment_failed", segment=sent, segments=len(segments), error_class=type(e).__name__, error=str(e))
+        finally:
+            audio.close()
+    log.info("tts.segmented", segments=len(segments), chars=sum(map(len, segments)))
+    headers = {"X-TTS-Segments": str(len(segments)), "Cache-Control": "no-store"}
+    return Response(stream_with_context(body()), mimetype='audio/mpeg', headers=headers)
 
 @app.route('/api/elevenlabs_tts', methods=['POST'])
 def elevenlabs_tts():
      user_info = verify_firebase_token(request)
      if user_info is None: return jsonify({"error": "Unauthorized"}), 401
-     if not ELEVENLABS_API_KEY: return jsonify({"error": "TTS service not configured."}), 503
-     data = request.json; # ... data validation ...
-     text_to_speak = data.get('text'); # ... get param ...
-     headers = {"Accept": "audio/mpeg", "Content-Type": "application/json", "xi-api-key": ELEVENLABS_API_KEY}
-     payload = {"text": text_to_speak, "model_id": "eleven_multilingual_v2", "voice_settings": {"stability": 0.55, "similarity_boost": 0.75, "style": 0.3, "use_speaker_boost": True}}
+     if not ELEVENLABS_API_KEY or elevenlabs_client is None: return jsonify({"error": "TTS service not configured."}), 503
+     data = request.json
+     if not data: return jsonify({"error": "Invalid JSON"}), 400
+     text_to_speak = data.get('text')
+     if not text_to_speak or not isinstance(text_to_speak, str): return jsonify({"error": "Text required"}), 400
+     payload = {"text": text_to_speak, "model_id": ELEVENLABS_MODEL_ID, "voice_settings": ELEVENLABS_VOICE_SETTINGS}
+
+     # --- Cache Hit: serve the stored clip via sendfile ---
+     audio_key = AudioStore.key_for(text_to_speak, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS)
+     cached_path = audio_store.lookup(audio_key) if audio_store is not None else None
+     if audio_store is not None: CACHE_LOOKUPS.inc(cache="tts_audio", route=_route_label(), result="hit" if cached_path else "miss")
+     if cached_path: return _send_cached_clip(cached_path, audio_key)
+     # Async clips are stored in the audio cache and fetched from the clip URL once the job is done
+     if audio_store is not None and wants_async(request): return submit_job_response("tts", {"text": text_to_speak}, user_info, data)
+     # Long passages: stream sentence segments as they're synthesized instead of waiting for the whole clip
+     segments = split_sentences(text_to_speak, max_chars=TTS_SEGMENT_MAX_CHARS) if wants_segmented_tts(data, text_to_speak) else []
+     if len(segments) > 1: return segmented_tts_response(segments)
+
+     # --- Identical request already synthesizing? Wait for its clip instead ---
+     flight = tts_flights.begin(audio_key) if audio_store is not None else None
+     if flight is not None and (not flight.leader or flight.contended):
+        if not flight.leader:
+            try: flight.wait(timeout=TTS_FLIGHT_WAIT)
+            except Exception as wait_err: log.warning("tts.coalesce_wait_failed", error=str(wait_err))
+        cached_path = audio_store.lookup(audio_key)
+        if cached_path:
+            if flight.leader: flight.finish()
+            return _send_cached_clip(cached_path, audio_key)
+        if not flight.leader: flight = None # Leader failed; synthesize ourselves uncoordinated
+
+     # --- Cache Miss: stream upstream audio to the client, teeing it to disk ---
+     try:
+        with timed_upstream("elevenlabs", "tts"): # Time to response headers; the body streams afterwards
+            response = elevenlabs_client.post(ELEVENLABS_API_URL, payload, stream=True)
+        chunks = response.iter_content(chunk_size=TTS_STREAM_CHUNK_SIZE)
+        if audio_store is not None:
+            def release_upstream(response=response, flight=flight):
+                response.close()
+                if flight is not None: flight.finish() # Runs after the clip is committed
+            body = audio_store.tee(audio_key, chunks, on_close=release_upstream)
+            flight = None # Finished by the stream from here on
+        else: body = _close_after(chunks, response)
+        headers = {"ETag": f'"{audio_key}"', "Cache-Control": f"private, max-age={TTS_CACHE_MAX_AGE}"}
+        if audio_store is not None: headers["Content-Location"] = url_for('elevenlabs_tts_clip', audio_key=audio_key)
+        return Response(stream_with_context(body), mimetype='audio/mpeg', headers=headers)
+     except Exception as e:
+        return tts_error_response(e)
+     finally:
+        if flight is not None: flight.finish() # Upstream failed before streaming; release waiters
+
+def synthesize_tts_clip(text_to_speak):
+     """Synthesizes a whole clip into the audio cache (job queue path); returns {"audio_key"} or an error."""
+     audio_key = AudioStore.key_for(text_to_speak, ELEVENLABS_VOICE_ID, ELEVENLABS_MODEL_ID, ELEVENLABS_VOICE_SETTINGS)
+     if audio_store.lookup(audio_key): return {"audio_key": audio_key}
+     payload = {"text": text_to_speak, "model_id": ELEVENLABS_MODEL_ID, "voice_settings": ELEVENLABS_VOICE_SETTINGS}
      try:
-        response = requests.post(ELEVENLABS_API_URL, json=payload, headers=headers, timeout=60)
-        response.raise_for_status(); print("ElevenLabs TTS successful.")
-        return Response(response.content, mimetype='audio/mpeg')
-     except requests.exceptions.HTTPError as http_err: # ... error handling ...
-        print(f"HTTP Error ElevenLabs API: {http_err.response.status_code} - {http_err.response.text}")
-        error_detail = f"ElevenLabs Error ({http_err.response.status_code})"
-        try: err_json = http_err.response.json(); error_detail = err_json.get('detail', {}).get('message', str(err_json))
-        except ValueError: error_detail = http_err.response.text
-        return jsonify({"error": f"Failed audio gen: {error_detail}"}), http_err.response.status_code if http_err.response.status_code >= 400 else 500
-     except requests.exceptions.RequestException as req_err: # ... error handling ...
-        print(f"Network Error ElevenLabs API: {req_err}")
-        return jsonify({"error": f"Could not connect to TTS: {req_err}"}), 504
-     except Exception as e: # ... error handling ...
-        print(f"Unexpected TTS error: {type(e).__name__} - {e}")
-        return jsonify({"error": "Unexpected TTS server error."}), 500
+        with timed_upstream("elevenlabs", "tts_job"):
+            response = elevenlabs_client.post(ELEVENLABS_API_URL, payload)
+        audio_store.put(audio_key, response.content)
+        return {"audio_key": audio_key}
+     except CircuitOpenError:
+        record_error("CircuitOpenError")
+        return {"error": "TTS service temporarily unavailable."}
+     except requests.exceptions.HTTPError as http_err:
+        record_error(f"HTTPError_{http_err.response.status_code}")
+        log.error("elevenlabs.http_error", status=http_err.response.status_code, body=http_err.response.text[:500])
+        return {"error": f"Failed audio gen: ElevenLabs Error ({http_err.response.status_code})"}
+     except requests.exceptions.RequestException as req_err:
+        record_error(type(req_err).__name__)
+        log.error("elevenlabs.network_error", error_class=type(req_err).__name__, error=str(req_err))
+        return {"error": "Could not connect to TTS."}
+
+@app.route('/api/elevenlabs_tts/<audio_key>', methods=['GET'])
+def elevenlabs_tts_clip(audio_key):
+     """Serves a previously synthesized clip with ETag and HTTP Range support."""
+     user_info = verify_firebase_token(request)
+     if user_info is None: return jsonify({"error": "Unauthorized"}), 401
+     if audio_store is None: return jsonify({"error": "TTS cache not enabled"}), 404
+     if len(audio_key) != 64 or any(c not in "0123456789abcdef" for c in audio_key): return jsonify({"error": "Invalid audio key"}), 400
+     cached_path = audio_store.lookup(audio_key)
+     if not cached_path: return jsonify({"error": "Audio not found"}), 404
+     return send_file(cached_path, mimetype='audio/mpeg', conditional=True, etag=audio_key, max_age=TTS_CACHE_MAX_AGE)
 
 @app.route('/api/paraphrase', methods=['POST'])
+@admission_controlled("paraphrase")
 def api_paraphrase():
     # --- Verify Auth Token ---
     user_info = verify_firebase_token(request)
@@ -306,12 +1765,11 @@ def api_paraphrase():
         return jsonify({"error": "Text to rephrase is required"}), 400
 
     # Validate style (optional but good practice)
-    allowed_styles = ["simpler", "formal", "informal", "creative", "complex"]
-    if style not in allowed_styles:
-         print(f"Warning: Invalid paraphrase style '{style}' received. Defaulting to 'simpler'.")
+    if style not in PARAPHRASE_STYLES:
+         log.warning("paraphrase.invalid_style", style=str(style)[:50])
          style = 'simpler'
 
-    print(f"Paraphrase request received. Style: {style}. Text: {original_text[:100]}...")
+    log.info("paraphrase.request", sample=True, style=style, text_chars=len(original_text))
 
     # Craft the prompt for Gemini
     prompt = f"""
@@ -330,19 +1788,23 @@ Original Text:
 Rephrased Text:
 """
 
-    rephrased_text_result = generate_gemini_response(prompt)
+    cached_text = semantic_lookup(f"paraphrase:{style}", original_text)
+    if cached_text is not None: return jsonify({"rephrased_text": cached_text})
+
+    rephrased_text_result = generate_gemini_response(prompt, endpoint="paraphrase")
 
     # Check if the helper returned an error object
     if isinstance(rephrased_text_result, dict) and 'error' in rephrased_text_result:
-        print(f"Error during paraphrasing: {rephrased_text_result['error']}")
-        return jsonify({"rephrased_text": f"Error: {rephrased_text_result['error']}"}), 500
+        log.warning("paraphrase.failed", error=rephrased_text_result['error'])
+        return jsonify({"rephrased_text": f"Error: {rephrased_text_result['error']}"}), error_status(rephrased_text_result)
 
-    print(f"Paraphrasing successful. Result: {rephrased_text_result[:100]}...")
+    semantic_store(f"paraphrase:{style}", original_text, rephrased_text_result)
     return jsonify({"rephrased_text": rephrased_text_result})
 
 
 # --- START NEW SCENARIO CHAT ROUTE ---
 @app.route('/api/scenario-chat', methods=['POST'])
+@admission_controlled("scenario_chat")
 def api_scenario_chat():
     user_info = verify_firebase_token(request)
     if user_info is None: return jsonify({"error": "Unauthorized"}), 401
@@ -354,14 +1816,33 @@ def api_scenario_chat():
     history = data.get('history', [])      # Scenario history {sender, text}
     user_message = data.get('message')    # Latest user message (None if start)
     is_start = data.get('start', False)   # Flag for initial message
+    session_id = data.get('session_id') if session_store is not None else None
+    use_session = session_store is not None and bool(session_id or data.get('session'))
+
+    # --- Session continuation: scenario and history come from the server ---
+    if use_session and not is_start:
+        if not user_message: return jsonify({"error": "User message required"}), 400
+        if session_id:
+            state = session_store.get(session_id, _client_id(user_info))
+            if state is None or state.get("kind") != "scenario": return session_expired_response()
+        else: # Start a session mid-conversation, seeded with the client's history
+            if not isinstance(scenario_desc, str) or not scenario_desc: return jsonify({"error": "Scenario description required"}), 400
+            session_id = new_session_id()
+            state = new_session_state("scenario", _client_id(user_info), scenario=truncate_text(scenario_desc, MAX_SCENARIO_TOKENS, count_prompt_tokens), turns=_clean_turns(history))
+        log.info("scenario.continue", sample=True, session=True, message_chars=len(user_message))
+        return session_turn_response(session_id, state, user_message, "scenario_chat", instruction=scenario_session_instruction(state["scenario"]),
+                                     failure_status=200, error_format="Sorry, an error occurred in the scenario ({}). Please try again or reset.")
 
     if not scenario_desc: return jsonify({"error": "Scenario description required"}), 400
     if not is_start and not user_message: return jsonify({"error": "User message required"}), 400
     if not isinstance(history, list): return jsonify({"error": "Invalid history"}), 400
+    if not isinstance(scenario_desc, str): return jsonify({"error": "Scenario description required"}), 400
+    scenario_desc = truncate_text(scenario_desc, MAX_SCENARIO_TOKENS, count_prompt_tokens)
 
     # --- Craft Prompt ---
+    stream = wants_stream(request)
     if is_start:
-        print(f"Starting scenario: {scenario_desc[:100]}...")
+        log.info("scenario.start", sample=True, session=use_session, scenario_chars=len(scenario_desc))
         prompt = f"""You are an AI role-playing partner for English practice. Start the scenario below. Adopt the 'Ada' role and give an engaging opening line/question. Stay in character.
 
 Scenario Description:
@@ -371,10 +1852,22 @@ Scenario Description:
 
 Your Opening Line/Question (as the assigned character):"""
         # Call helper without history for start
-        response_content = generate_gemini_response(prompt, is_chat=False)
+        if use_session: # Remember the scenario and Ada's opening line for later turns
+            session_id, state = new_session_id(), new_session_state("scenario", _client_id(user_info), scenario=scenario_desc)
+            def save_opening(reply):
+                append_turns(state, {"sender": "bot", "text": reply})
+                session_store.put(session_id, state)
+            if stream: return sse_response(stream_gemini_response(prompt, is_chat=False, task="scenario_chat"), "reply", error_prefix="Scenario error: ",
+                                           extra={"session_id": session_id}, on_complete=save_opening)
+            response_content = generate_gemini_response(prompt, is_chat=False, task="scenario_chat")
+            if isinstance(response_content, str):
+                save_opening(response_content)
+                return jsonify({"reply": response_content, "session_id": session_id})
+        elif stream: return sse_response(stream_gemini_response(prompt, is_chat=False, task="scenario_chat"), "reply", error_prefix="Scenario error: ")
+        else: response_content = generate_gemini_response(prompt, is_chat=False, task="scenario_chat")
     else:
         # Continuation
-        print(f"Continuing scenario. User message: {user_message[:100]}...")
+        log.info("scenario.continue", sample=True, session=False, message_chars=len(user_message))
         # Build the full prompt context including instructions, scenario, history, and user message
         # This approach passes the complete context in one go, suitable for stateless generate_content
 
@@ -387,36 +1880,36 @@ Original Scenario Description:
 
 [Conversation History Starts Below]
 """
-        # Format history similar to how the helper would for chat
-        history_string = ""
-        for entry in history: # Use history directly from frontend
-            role = "User" if entry.get('sender') == 'user' else "Ada" # Use Persona name
-            text = entry.get('text', '')
-            history_string += f"{role}: {text}\n"
+        # Keep the newest turns that fit the budget, formatted like the helper does for chat
+        prompt_before = count_prompt_tokens(f"{system_instruction}\n{format_turns(history)}User: {user_message}\nAda:")
+        user_message, history = govern_history("scenario_chat", user_message, history, fixed_text=system_instruction)
+        history_string = format_turns(history)
 
         # Combine all parts for the final prompt
         final_prompt = f"{system_instruction}\n{history_string}User: {user_message}\nAda:"
+        report_prompt_tokens("scenario_chat", prompt_before, count_prompt_tokens(final_prompt))
 
         # Call helper with the fully constructed prompt string directly
         # Set is_chat=False because we manually built the history into the prompt string
-        response_content = generate_gemini_response(final_prompt, is_chat=False)
+        if stream: return sse_response(stream_gemini_response(final_prompt, is_chat=False, task="scenario_chat"), "reply", error_prefix="Scenario error: ")
+        response_content = generate_gemini_response(final_prompt, is_chat=False, task="scenario_chat")
 
 
     # --- Handle Response ---
     if isinstance(response_content, dict) and 'error' in response_content:
-        print(f"Error during scenario chat: {response_content['error']}")
+        log.warning("scenario.failed", error=response_content['error'])
         # Return a user-friendly error in the reply field
         return jsonify({"reply": f"Sorry, an error occurred in the scenario ({response_content['error']}). Please try again or reset."}), 200 # Return 200 OK, but with error message
     elif not isinstance(response_content, str):
          # Handle unexpected non-string, non-error responses
-         print(f"Unexpected response type from generate_gemini_response: {type(response_content)}")
+         log.error("scenario.unexpected_response", response_type=type(response_content).__name__)
          return jsonify({"reply": "Sorry, received an unexpected response format from the AI."}), 500
 
 
-    print(f"Scenario chat reply generated: {response_content[:100]}...")
     return jsonify({"reply": response_content})
 # --- END NEW SCENARIO CHAT ROUTE ---
 @app.route('/api/summarize', methods=['POST'])
+@admission_controlled("summarize")
 def api_summarize():
     # --- Verify Auth Token ---
     user_info = verify_firebase_token(request)
@@ -432,41 +1925,60 @@ def api_summarize():
     if not original_text or not isinstance(original_text, str):
         return jsonify({"error": "Text to summarize is required"}), 400
 
-    # Optional: Add length check if needed (Gemini handles large inputs, but good practice)
-    # MAX_SUMMARY_LENGTH = 20000 # Example limit
-    # if len(original_text) > MAX_SUMMARY_LENGTH:
-    #     return jsonify({"error": f"Input text is too long (max {MAX_SUMMARY_LENGTH} chars)."}), 413 # Payload Too Large
-
-    print(f"Summarizer request received. Text length: {len(original_text)}")
-
-    # Craft the prompt for Gemini - keep it simple and direct
-    prompt = f"""
-Instructions:
-Summarize the following text concisely, capturing the main points and key information.
-Output *only* the summary itself.
+    text_tokens = count_prompt_tokens(original_text)
+    if text_tokens > SUMMARY_MAX_INPUT_TOKENS:
+        return jsonify({"error": f"Input text is too long (max ~{SUMMARY_MAX_INPUT_TOKENS * 3 // 4} words)."}), 413 # Payload Too Large
 
-Text to Summarize:
----
-{original_text}
----
+    log.info("summarize.request", sample=True, text_chars=len(original_text), text_tokens=text_tokens)
+    if wants_async(request): return submit_job_response("summarize", {"text": original_text}, user_info, data)
 
-Summary:
-"""
+    # Craft the prompt for Gemini - keep it simple and direct; long texts go through map-reduce
+    prompt = summary_final_prompt(original_text)
+    if isinstance(prompt, dict): return jsonify({"summary": f"Error: {prompt['error']}"}), error_status(prompt)
     # Call the helper function
-    summary_result = generate_gemini_response(prompt, is_chat=False) # Not a chat interaction
+    if wants_stream(request):
+        return sse_response(stream_gemini_response(prompt, is_chat=False, task="summarize"), "summary", error_prefix="Error: ")
+    body, status = run_summarize(original_text, prompt)
+    return jsonify(body), status
+
+def summary_final_prompt(original_text):
+    """The single prompt that produces the summary (map-reducing long texts first), or an error dict."""
+    prompt = summarize_prompt(original_text)
+    prompt_before = count_prompt_tokens(prompt)
+    calls = 1
+    if count_prompt_tokens(original_text) > PROMPT_BUDGETS["summarize"]:
+        reduced = map_reduce_summary_prompt(original_text)
+        if isinstance(reduced, dict):
+            log.warning("summarize.map_reduce_failed", error=reduced['error'])
+            return reduced
+        prompt, calls = reduced
+    report_prompt_tokens("summarize", prompt_before, count_prompt_tokens(prompt), calls)
+    return prompt
+
+def run_summarize(original_text, prompt=None):
+    """Summarizes a text; returns (body, status). Shared with the job queue."""
+    if prompt is None: prompt = summary_final_prompt(original_text)
+    if isinstance(prompt, dict): return {"summary": f"Error: {prompt['error']}", "error": prompt['error']}, error_status(prompt)
+    summary_result = generate_gemini_response(prompt, is_chat=False, task="summarize") # Not a chat interaction
 
     # Check if the helper returned an error object
     if isinstance(summary_result, dict) and 'error' in summary_result:
-        print(f"Error during summarization: {summary_result['error']}")
+        log.warning("summarize.failed", error=summary_result['error'])
         # Return error message in the expected field for the frontend
-        return jsonify({"summary": f"Error: {summary_result['error']}"}), 500
+        return {"summary": f"Error: {summary_result['error']}", "error": summary_result['error']}, error_status(summary_result)
 
-    print(f"Summarization successful. Summary length: {len(summary_result)}")
     # Return the summary in the expected JSON format
-    return jsonify({"summary": summary_result})
+    return {"summary": summary_result}, 200
 
 # --- START NEW TRANSLATION EXPLAINER ROUTE ---
+TRANSLATION_SCHEMA = {
+    "type": "object",
+    "properties": {"translation": {"type": "string"}, "explanation": {"type": "string"}},
+    "required": ["translation", "explanation"],
+}
+
 @app.route('/api/translate-explain', methods=['POST'])
+@admission_controlled("translate_explain")
 def api_translate_explain():
     # --- Verify Auth Token ---
     user_info = verify_firebase_token(request)
@@ -482,83 +1994,37 @@ def api_translate_explain():
     if not original_text or not isinstance(original_text, str):
         return jsonify({"error": "Text to translate is required"}), 400
 
-    print(f"Translate & Explain request received. Text: {original_text[:100]}...")
+    log.info("translate_explain.request", sample=True, text_chars=len(original_text))
 
-    # Craft the prompt for Gemini based on your instruction
+    # Craft the prompt for Gemini; the reply is JSON with translation and explanation fields
     prompt = f"""
 You are an English language tutor. Your task is twofold:
-1. Translate the following text accurately into English. Present this translation clearly under the heading "Translation:".
-2. Briefly explain any interesting or potentially difficult vocabulary choices or grammatical structures used in *your* English translation that would be useful for an English language learner. Present this explanation clearly under the heading "Explanation:". Keep the explanation concise and focused on learning points.
+1. Translate the following text accurately into English (translation).
+2. Briefly explain any interesting or potentially difficult vocabulary choices or grammatical structures used in *your* English translation that would be useful for an English language learner (explanation). Keep the explanation concise and focused on learning points.
 
 Input Text (may be in any language):
 ---
 {original_text}
 ---
-
-Please provide your response strictly following this structure:
-Translation:
-[Your English translation here]
-
-Explanation:
-[Your explanation of vocab/grammar from the translation here]
 """
 
     # Call the helper function
-    translation_explanation_result = generate_gemini_response(prompt, is_chat=False)
-
-    # Check for direct error from helper
-    if isinstance(translation_explanation_result, dict) and 'error' in translation_explanation_result:
-        print(f"Error during translation/explanation: {translation_explanation_result['error']}")
-        return jsonify({"error": f"AI Service Error: {translation_explanation_result['error']}"}), 500
-    if not isinstance(translation_explanation_result, str):
-         print(f"Unexpected response type from Gemini: {type(translation_explanation_result)}")
-         return jsonify({"error": "Received unexpected response format from AI."}), 500
+    result = generate_structured_response(prompt, TRANSLATION_SCHEMA, task="translate_explain")
 
+    # Check for direct error from helper (includes replies that stayed malformed after the repair call)
+    if 'error' in result:
+        log.warning("translate_explain.failed", error=result['error'])
+        return jsonify({"error": f"AI Service Error: {result['error']}"}), error_status(result)
 
-    # --- Parse the Translation and Explanation ---
-    translation_text = "Could not parse translation."
-    explanation_text = "Could not parse explanation."
-    try:
-        # Define markers robustly
-        translation_marker = "Translation:"
-        explanation_marker = "Explanation:"
-
-        # Find marker positions
-        trans_idx = translation_explanation_result.find(translation_marker)
-        expl_idx = translation_explanation_result.find(explanation_marker)
-
-        if trans_idx != -1:
-            trans_start = trans_idx + len(translation_marker)
-            # End of translation is start of explanation, or end of string if explanation missing
-            trans_end = expl_idx if (expl_idx != -1 and expl_idx > trans_idx) else len(translation_explanation_result)
-            translation_text = translation_explanation_result[trans_start:trans_end].strip()
-
-        if expl_idx != -1:
-             expl_start = expl_idx + len(explanation_marker)
-             explanation_text = translation_explanation_result[expl_start:].strip()
-
-        # Handle case where markers might be missing
-        if trans_idx == -1 and expl_idx == -1 and len(translation_explanation_result) > 0:
-             # If no markers, assume the whole thing is maybe the translation? Or error?
-             # Let's default to putting it in translation for now.
-             translation_text = translation_explanation_result.strip()
-             explanation_text = "(No explanation section found in response)"
-
-    except Exception as parse_error:
-        print(f"Error parsing translation/explanation response: {parse_error}")
-        # Return the raw response if parsing fails, split might help frontend
-        translation_text = "Error processing AI response."
-        explanation_text = translation_explanation_result # Put raw in explanation
-
-    print("Translation & Explanation successful.")
     return jsonify({
-        "translation": translation_text,
-        "explanation": explanation_text
+        "translation": result["translation"].strip(),
+        "explanation": result["explanation"].strip()
     })
     # --- END NEW TRANSLATION EXPLAINER ROUTE ---
 
     # --- START NEW OBJECT IDENTIFIER ROUTE ---
 @app.route('/api/identify-objects', methods=['POST'])
+@admission_controlled("identify_objects")
 def api_identify_objects():
     # --- Verify Auth Token ---
     user_info = verify_firebase_token(request)
@@ -566,72 +2032,91 @@ def api_identify_objects():
         return jsonify({"error": "Unauthorized: Missing or invalid token"}), 401
     # --- --- --- --- --- ---
 
-    data = request.json
-    if not data: return jsonify({"error": "Invalid JSON payload"}), 400
-
-    base64_image_data = data.get('image_data')
-    mime_type = data.get('mime_type') # e.g., 'image/jpeg', 'image/png'
-
-    if not base64_image_data or not mime_type:
-        return jsonify({"error": "Missing image_data or mime_type"}), 400
-
-    if text_model is None: # Check if the multimodal model loaded correctly
+    if get_text_model() is None: # Check if the multimodal model loaded correctly
          return jsonify({"error": "AI Vision service not configured"}), 503
 
-    print(f"Object ID request received. Mime Type: {mime_type}, Data Length: {len(base64_image_data)}")
+    # --- Read + Preprocess (multipart 'image' field, raw image/* body, or base64 JSON) ---
+    try:
+        raw_image, mime_type = read_upload(request, IMAGE_MAX_UPLOAD_BYTES)
+        prepared = prepare_image(raw_image, mime_type, IMAGE_MAX_DIMENSION, IMAGE_JPEG_QUALITY)
+    except ImageRejected as rejected:
+        record_error("image_rejected")
+        return jsonify({"error": rejected.message}), rejected.status
+    del raw_image # Only the downscaled copy is needed from here on
+    log.info("identify_objects.request", sample=True, mime_type=mime_type, original_bytes=prepared.original_bytes, prepared_bytes=len(prepared.data))
+    PROMPT_CHARS.observe(len(prepared.data), route=_route_label())
+
+    # --- Craft the Prompt ---
+    prompt_text = "Identify the main objects clearly visible in this image. List them concisely."
+    # Alternative prompts:
+    # prompt_text = "Describe this image in simple terms, focusing on the objects."
+    # prompt_text = "What items are in this picture?"
+
+    # --- Near-duplicate cache (this worker), then exact-hash cache (shared) ---
+    shared_key = make_cache_key(f"image:{hash_key(prepared.image_hash)}\x00{prompt_text}", model_router.preferred("identify_objects")) if response_cache is not None else None
+    cached_description = image_cache.get(prepared.image_hash) if image_cache is not None else None
+    if cached_description is None and shared_key: cached_description = response_cache.get(shared_key)
+    CACHE_LOOKUPS.inc(cache="image", route=_route_label(), result="miss" if cached_description is None else "hit")
+    if cached_description is not None:
+        if image_cache is not None: image_cache.set(prepared.image_hash, cached_description)
+        return jsonify({"description": cached_description})
 
     try:
         # --- Prepare Image Data for Gemini ---
-        # The Python SDK often expects image data structured like this:
-        image_part = {
-            "mime_type": mime_type,
-            "data": base64_image_data # Pass the base64 string directly
-        }
-
-        # --- Craft the Prompt ---
-        prompt_text = "Identify the main objects clearly visible in this image. List them concisely."
-        # Alternative prompts:
-        # prompt_text = "Describe this image in simple terms, focusing on the objects."
-        # prompt_text = "What items are in this picture?"
-
-        print("--- Sending Image + Prompt to Gemini ---")
+        image_part = {"mime_type": prepared.mime_type, "data": prepared.data}
 
         # --- Call Gemini with Multimodal Input ---
         # The generate_content method accepts a list containing text and image parts
-        response = text_model.generate_content([prompt_text, image_part]) # Send both parts
+        with timed_upstream("gemini", "vision"):
+            model_name, response = gemini_call("identify_objects", lambda model, options: model.generate_content([prompt_text, image_part], request_options=options), # Send both parts
+                                      cancelled=disconnect_check())
 
         # --- Process Response ---
         if not response.candidates or not response.candidates[0].content.parts:
              block_reason = getattr(response.prompt_feedback, 'block_reason', None)
              if block_reason:
                  error_msg = f"Blocked by safety filters ({block_reason.name})"
-                 print(f"Gemini vision request blocked: {block_reason.name}")
+                 record_error("blocked")
+                 log.warning("gemini.blocked", reason=block_reason.name)
                  return jsonify({"error": error_msg}), 400 # Bad Request might be appropriate
              else:
-                 print("Gemini vision response was empty or malformed.")
+                 record_error("empty_response")
+                 log.warning("gemini.empty_response")
                  return jsonify({"error": "AI returned empty result for image"}), 500
 
         description_text = response.text
-        print(f"Object ID successful. Description: {description_text[:100]}...")
+        RESPONSE_CHARS.observe(len(description_text), route=_route_label())
+        shared_ttl = answer_ttl(IMAGE_CACHE_TTL, "identify_objects", model_name)
+        if image_cache is not None and shared_ttl == IMAGE_CACHE_TTL: image_cache.set(prepared.image_hash, description_text) # No per-entry TTL here
+        if shared_key and shared_ttl > 0: response_cache.set(shared_key, description_text, shared_ttl)
         return jsonify({"description": description_text})
 
     # --- Error Handling for Vision Call ---
+    except (Cancelled,) + TIMEOUT_ERRORS as e:
+         error = _gemini_exception_error(e)
+         return jsonify({"error": error['error']}), error_status(error)
     except google.api_core.exceptions.ResourceExhausted as e:
-         print(f"Error calling Gemini Vision API: Quota Exceeded - {e}")
+         record_error(type(e).__name__)
+         log.warning("gemini.quota_exceeded", error=str(e))
          return jsonify({"error": "AI service quota exceeded"}), 500
     except google.api_core.exceptions.InvalidArgument as e:
          # This could be due to badly formatted image data or prompt
-         print(f"Error calling Gemini Vision API: Invalid Argument - {e}")
+         record_error(type(e).__name__)
+         log.warning("gemini.invalid_argument", error=str(e))
          return jsonify({"error": "Invalid request to AI (check image format/prompt)"}), 400
     except Exception as e:
-        print(f"Generic Error calling Gemini Vision API: {type(e).__name__} - {e}")
+        record_error(type(e).__name__)
+        log.error("gemini.error", error_class=type(e).__name__, error=str(e))
         return jsonify({"error": "Unexpected AI service error processing image"}), 500
 # --- END NEW OBJECT IDENTIFIER ROUTE ---
 
 
+STARTUP_SECONDS = time.perf_counter() - _import_started
+log.info("startup.imported", seconds=round(STARTUP_SECONDS, 3))
+
 # --- Main Execution ---
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
-    print(f"Running Flask app on 0.0.0.0:{port} with debug={debug_mode}")
+    log.info("server.start", host="0.0.0.0", port=port, debug=debug_mode)
     app.run(debug=debug_mode, host='0.0.0.0', port=port)
@@ -0,0 +1,151 @@
+"""Fingerprinted static assets, precompressed variants and response compression.
+
+AssetManifest hashes every file under static/ and maps its path to a
+content-addressed name (css/style.css -> css/style.3f9a1c0b7e.css). Those
+names never change meaning, so they are served with a one-year immutable
+Cache-Control; a deploy changes the hash, and with it the URL the templates
+emit. Text assets get .gz (and, when the optional `brotli` package is
+installed, .br) siblings written once per content hash into a build
+directory, so workers only pick the variant the client accepts.
+
+`python -m asset_delivery` does the precompression ahead of time (e.g. in the
+image build); otherwise the first worker to start does it.
+
+compress() is used for dynamic responses: non-streamed text/JSON bodies above
+a size threshold are encoded with the best encoding the client accepts.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import sys
+import tempfile
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = {"application/json", "application/javascript", "application/manifest+json", "application/x-ndjson",
+                      "image/svg+xml", "text/css", "text/html", "text/javascript", "text/plain"}
+_PRECOMPRESS_EXTENSIONS = {".css", ".js", ".json", ".webmanifest", ".svg", ".html", ".txt"}
+_HASH_CHARS = 10
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+def accepted_encodings(accept_encoding):
+    """Encodings we can produce that the Accept-Encoding header allows, best first."""
+    offered = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try: quality = float(params.strip()[2:])
+            except ValueError: quality = 0.0
+        if name: offered[name.strip()] = quality
+    available = (["br"] if brotli is not None else []) + ["gzip"]
+    return [encoding for encoding in available if offered.get(encoding, offered.get("*", 0.0)) > 0]
+
+
+def encode(data, encoding, level="dynamic"):
+    """`data` compressed with `encoding`; "static" spends more CPU for a smaller result (done once per asset)."""
+    if encoding == "br": return brotli.compress(data, quality=11 if level == "static" else 5)
+    return gzip.compress(data, compresslevel=9 if level == "static" else 6, mtime=0)
+
+
+def compress(response, accept_encoding, min_bytes=1024):
+    """Compresses a Flask/Werkzeug response in place when worthwhile; returns the encoding used or None."""
+    if response.direct_passthrough or response.is_streamed or response.status_code != 200: return None
+    if "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_TYPES: return None
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if len(data) < min_bytes: return None
+    encodings = accepted_encodings(accept_encoding)
+    if not encodings: return None
+    body = encode(data, encodings[0])
+    if len(body) >= len(data): return None
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encodings[0]
+    etag, weak = response.get_etag()
+    if etag and not weak: response.set_etag(etag, weak=True) # Same content, different bytes
+    return encodings[0]
+
+
+class AssetManifest:
+    def __init__(self, static_dir, build_dir=None, exclude=("sw.js",)):
+        self.static_dir = os.path.abspath(static_dir)
+        self.build_dir = build_dir or os.path.join(tempfile.gettempdir(), "adai-assets")
+        self.exclude = set(exclude) # Served at fixed URLs (the service worker must keep its scope and name)
+        self.files = {} # logical path -> fingerprinted path
+        self._logical = {} # fingerprinted path -> (logical path, digest)
+        self.version = None
+
+    def build(self, precompress=True):
+        """Hashes every asset (and writes missing compressed variants); returns the manifest."""
+        files, logical, combined = {}, {}, hashlib.sha256()
+        for root, _, names in os.walk(self.static_dir):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                relative = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                if relative in self.exclude or name.startswith("."): continue
+                with open(path, "rb") as f: data = f.read()
+                digest = hashlib.sha256(data).hexdigest()
+                stem, extension = os.path.splitext(relative)
+                fingerprinted = f"{stem}.{digest[:_HASH_CHARS]}{extension}"
+                files[relative], logical[fingerprinted] = fingerprinted, (relative, digest)
+                combined.update(f"{relative}\0{digest}\0".encode("utf-8"))
+                if precompress and extension in _PRECOMPRESS_EXTENSIONS: self._precompress(data, digest)
+        self.files, self._logical, self.version = files, logical, combined.hexdigest()[:_HASH_CHARS]
+        return dict(files)
+
+    def _precompress(self, data, digest):
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding == "br" and brotli is None: continue
+            target = os.path.join(self.build_dir, digest + suffix)
+            if os.path.exists(target): continue
+            os.makedirs(self.build_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.build_dir, suffix=".part")
+            with os.fdopen(fd, "wb") as f: f.write(encode(data, encoding, level="static"))
+            os.replace(tmp_path, target) # Several workers may build at once; any complete copy wins
+            logger.debug("Precompressed asset %s (%s)", digest[:_HASH_CHARS], encoding)
+
+    def url_path(self, logical_path):
+        """Fingerprinted path for a static file (the logical path itself if it isn't in the manifest)."""
+        return self.files.get(logical_path.lstrip("/"), logical_path)
+
+    def resolve(self, fingerprinted, accept_encoding=""):
+        """(file path, mimetype, Content-Encoding or None, digest) for a fingerprinted path, or None if unknown."""
+        match = self._logical.get(fingerprinted)
+        if match is None: return None
+        relative, digest = match
+        mimetype = mimetypes.guess_type(relative)[0] or "application/octet-stream"
+        if mimetype in COMPRESSIBLE_TYPES:
+            for encoding in accepted_encodings(accept_encoding):
+                candidate = os.path.join(self.build_dir, digest + (".br" if encoding == "br" else ".gz"))
+                if os.path.exists(candidate): return candidate, mimetype, encoding, digest
+        return os.path.join(self.static_dir, relative), mimetype, None, digest
+
+    def current(self, fingerprinted):
+        """Fingerprinted path of the current version of a stale fingerprinted name (old HTML after a deploy), or None."""
+        stem, extension = os.path.splitext(fingerprinted)
+        base, _, fingerprint = stem.rpartition(".")
+        if len(fingerprint) != _HASH_CHARS: return None
+        return self.files.get(base + extension)
+
+
+def manifest_from_env(environ, static_dir):
+    """Builds the manifest for `static_dir` (ASSET_BUILD_DIR holds compressed variants; ASSET_PRECOMPRESS=false skips them)."""
+    manifest = AssetManifest(static_dir, build_dir=environ.get("ASSET_BUILD_DIR") or None)
+    manifest.build(precompress=environ.get("ASSET_PRECOMPRESS", "true").lower() in ("true", "1", "t"))
+    return manifest
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    static_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    built = manifest_from_env(os.environ, static_dir)
+    print(json.dumps({"version": built.version, "build_dir": built.build_dir, "files": built.files}, indent=2))
@@ -0,0 +1,150 @@
+"""Content-addressed on-disk store for synthesized TTS audio.
+
+Blobs are named by a hash of everything that affects the audio (text, voice,
+model, voice settings), so any worker on the host can serve a clip another
+worker synthesized. Writes go to a temp file and are renamed into place when
+complete, so readers never see partial audio. Total size is capped; the least
+recently used clips (by mtime, refreshed on every hit) are evicted first.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AudioStore:
+    _RESCAN_EVERY = 50 # Commits between full directory scans (other workers write too)
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, extension=".mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._tmp_dir = os.path.join(directory, "tmp")
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._commits = 0
+        self._approx_bytes = self._scan_total()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(text, voice_id, model_id, voice_settings):
+        """Stable content hash for a synthesis request."""
+        canonical = json.dumps({"text": text, "voice_id": voice_id, "model_id": model_id, "voice_settings": voice_settings},
+                               sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key + self.extension)
+
+    def lookup(self, key):
+        """Returns the blob path for a key (refreshing its LRU position) or None."""
+        path = self.path_for(key)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            with self._lock: self.misses += 1
+            return None
+        with self._lock: self.hits += 1
+        return path
+
+    def tee(self, key, chunks, on_close=None):
+        """Yields `chunks` unchanged while writing them to the store.
+
+        The blob is committed only if the iterator is exhausted; if the client
+        disconnects or upstream fails midway the partial file is discarded.
+        `on_close` runs in every case, after the commit (e.g. to release the
+        upstream response and wake coalesced waiters).
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self._tmp_dir, suffix=".part")
+        completed = False
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                for chunk in chunks:
+                    if not chunk: continue
+                    tmp_file.write(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            try:
+                if completed: self._commit(key, tmp_path)
+                else: os.remove(tmp_path)
+            except OSError as e:
+                logger.warning("Audio cache write failed: %s", e)
+            if on_close is not None: # After the commit, so anyone waiting on us finds the clip
+                try: on_close()
+                except Exception: pass
+
+    def put(self, key, data):
+        """Stores a complete blob (used when the audio is already in memory)."""
+        for _ in self.tee(key, [data]): pass
+
+    def _commit(self, key, tmp_path):
+        final_path = self.path_for(key)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, final_path) # Atomic; a concurrent writer of the same key just wins
+        with self._lock:
+            self._commits += 1
+            self._approx_bytes += size
+            needs_rescan = self._commits % self._RESCAN_EVERY == 0
+            over_budget = self._approx_bytes > self.max_bytes
+        if needs_rescan or over_budget:
+            self._evict()
+
+    def _blobs(self):
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir() or shard.name == "tmp": continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(self.extension):
+                    try: stat = entry.stat()
+                    except FileNotFoundError: continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _scan_total(self):
+        return sum(size for _, size, _ in self._blobs())
+
+    def _evict(self):
+        blobs = sorted(self._blobs(), key=lambda blob: blob[2]) # Oldest first
+        total = sum(size for _, size, _ in blobs)
+        target = int(self.max_bytes * 0.9) if total > self.max_bytes else total
+        removed = 0
+        for path, size, _ in blobs:
+            if total <= target: break
+            try:
+                os.remove(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                continue
+        with self._lock:
+            self._approx_bytes = total
+            self.evictions += removed
+        self._clean_stale_parts()
+
+    def _clean_stale_parts(self, max_age=3600):
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self._tmp_dir):
+            try:
+                if entry.stat().st_mtime < cutoff: os.remove(entry.path)
+            except OSError:
+                continue
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "bytes": self._approx_bytes, "hit_rate": (self.hits / lookups) if lookups else 0.0}
+
+
+def store_from_env(environ):
+    """Builds the store configured by TTS_CACHE_* env vars (None if disabled)."""
+    if environ.get("TTS_CACHE_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    directory = environ.get("TTS_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "adai-tts-cache")
+    return AudioStore(directory, max_bytes=int(environ.get("TTS_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
@@ -0,0 +1 @@
+"""Offline benchmark harness (fake upstreams + load generator). See loadtest.py."""
@@ -0,0 +1,27 @@
+"""WSGI entry point serving the real app against the fake Gemini model.
+
+Used by bench/loadtest.py (`gunicorn -c gunicorn.conf.py bench.fake_app:app`);
+every worker imports this module, so each gets its own fake model configured
+from BENCH_GEMINI_* env vars. Every routed model name resolves to the same
+fake, so GEMINI_*_MODEL / GEMINI_HEDGE_TASKS can be exercised offline; it is
+built through GeminiModels, so /readyz behaves as in production and the SDK
+is never imported. ElevenLabs is pointed at the fake server via
+ELEVENLABS_API_BASE, which the load test sets.
+"""
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "bench-fake-key") # Never sent anywhere: the model is replaced below
+os.environ.setdefault("ELEVENLABS_API_KEY", "bench-fake-key")
+
+import app as adai # noqa: E402
+from bench.fakes import FakeGeminiModel # noqa: E402
+from gemini_models import GeminiModels # noqa: E402
+
+fake_model = FakeGeminiModel.from_env(os.environ)
+adai.gemini_models = GeminiModels(None, adai.GEMINI_MODEL_NAME, build=lambda name: fake_model) # SDK never imported
+if os.environ.get("BENCH_FIREBASE_KEY_FILE"): # loadtest --auth: trust the load generator's fake issuer
+    from tests.fakes import FakeFirebaseIssuer # noqa: E402
+    from firebase_auth import CertCache, TokenVerifier # noqa: E402
+    issuer = FakeFirebaseIssuer.from_file(os.environ["BENCH_FIREBASE_KEY_FILE"], os.environ.get("FIREBASE_PROJECT_ID", "bench-project"))
+    adai.firebase_verifier = TokenVerifier(issuer.project_id, CertCache(issuer.fetch_certs))
+app = adai.app
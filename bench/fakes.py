@@ -0,0 +1,214 @@
+"""Local stand-ins for Gemini and ElevenLabs used by the benchmark harness.
+
+FakeGeminiModel mimics the parts of google.generativeai.GenerativeModel the
+app uses (generate_content with/without stream, start_chat, count_tokens) and
+returns objects with the same shape: candidates[0].content.parts, .text and
+prompt_feedback.block_reason. Latency is a time-to-first-token plus a token
+rate, and errors can be injected (quota exhaustion, invalid argument, safety
+blocks) at configurable rates.
+
+The fake Firebase issuer lives with the tests (tests.fakes) and is shared
+from there.
+
+FakeElevenLabsServer is a tiny threaded HTTP server that answers the
+text-to-speech endpoint with deterministic fake MP3 bytes, streamed at a
+configurable rate, optionally failing with 429/500.
+
+Both only use time.sleep and blocking sockets, so under gevent workers they
+behave like real network I/O.
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import google.api_core.exceptions
+
+from prompt_budget import estimate_tokens
+
+LOREM = ("Ada thinks this is a great question for practising English. Here is a clear answer with a few examples, "
+         "some useful vocabulary, and a short explanation of the grammar involved so that you can use it yourself. ").split()
+
+
+# --- Fake Gemini ---
+class _BlockReason:
+    def __init__(self, name):
+        self.name = name
+
+    def __bool__(self):
+        return True
+
+
+def _response(text=None, block_reason=None):
+    """Object shaped like a GenerateContentResponse (or one streamed chunk of it)."""
+    candidates = [] if text is None else [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))]
+    return SimpleNamespace(candidates=candidates, text=text or "",
+                           prompt_feedback=SimpleNamespace(block_reason=_BlockReason(block_reason) if block_reason else None))
+
+
+class FakeGeminiModel:
+    def __init__(self, first_token_ms=400, tokens_per_sec=80, output_tokens=200, quota_error_rate=0.0,
+                 invalid_rate=0.0, block_rate=0.0, seed=None):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.quota_error_rate = quota_error_rate
+        self.invalid_rate = invalid_rate
+        self.block_rate = block_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls, environ):
+        return cls(first_token_ms=float(environ.get("BENCH_GEMINI_FIRST_TOKEN_MS", 400)),
+                   tokens_per_sec=float(environ.get("BENCH_GEMINI_TOKENS_PER_SEC", 80)),
+                   output_tokens=int(environ.get("BENCH_GEMINI_OUTPUT_TOKENS", 200)),
+                   quota_error_rate=float(environ.get("BENCH_GEMINI_QUOTA_ERROR_RATE", 0)),
+                   invalid_rate=float(environ.get("BENCH_GEMINI_INVALID_RATE", 0)),
+                   block_rate=float(environ.get("BENCH_GEMINI_BLOCK_RATE", 0)))
+
+    def _roll(self):
+        """Picks this call's fate: None (success), or an injected failure."""
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+        if roll < self.quota_error_rate: raise google.api_core.exceptions.ResourceExhausted("Fake quota exceeded")
+        roll -= self.quota_error_rate
+        if roll < self.invalid_rate: raise google.api_core.exceptions.InvalidArgument("Fake invalid argument")
+        roll -= self.invalid_rate
+        return "SAFETY" if roll < self.block_rate else None
+
+    def _words(self, prompt):
+        # Deterministic per prompt, so cached and fresh answers look alike
+        seed = int(hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()[:8], 16)
+        count = max(1, int(self.output_tokens * 3 / 4))
+        return [LOREM[(seed + i) % len(LOREM)] for i in range(count)]
+
+    def _generate(self, prompt, stream, schema=None):
+        block_reason = self._roll()
+        time.sleep(self.first_token_ms / 1000.0)
+        if block_reason:
+            blocked = _response(block_reason=block_reason)
+            return iter([blocked]) if stream else blocked
+        words = self._words(prompt)
+        if not stream:
+            time.sleep(len(words) * 4 / 3 / self.tokens_per_sec)
+            return _response(json.dumps(_fake_json(schema, words)) if schema else " ".join(words))
+        return self._stream(words)
+
+    def _stream(self, words, words_per_chunk=12):
+        for start in range(0, len(words), words_per_chunk):
+            if start: time.sleep(words_per_chunk * 4 / 3 / self.tokens_per_sec)
+            yield _response(" ".join(words[start:start + words_per_chunk]) + " ")
+
+    def generate_content(self, contents, stream=False, generation_config=None, **kwargs):
+        return self._generate(contents, stream, (generation_config or {}).get("response_schema"))
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self, history or [])
+
+    def count_tokens(self, contents):
+        return SimpleNamespace(total_tokens=estimate_tokens(str(contents)))
+
+
+def _fake_json(schema, words):
+    """Schema-shaped payload (JSON mode) filled with the response's words."""
+    kind = schema.get("type")
+    if kind == "object": return {name: _fake_json(subschema, words) for name, subschema in schema.get("properties", {}).items()}
+    if kind == "array": return [_fake_json(schema.get("items", {}), words[index * 12:]) for index in range(3)]
+    if kind == "boolean": return True
+    if kind in ("integer", "number"): return len(words)
+    return " ".join(words[:12]) or "text"
+
+
+class FakeChatSession:
+    def __init__(self, model, history):
+        self._model = model
+        self.history = list(history)
+
+    def send_message(self, content, stream=False, **kwargs):
+        return self._model._generate([self.history, content], stream)
+
+
+# --- Fake ElevenLabs ---
+class _QuietHTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass # Clients dropping keep-alive connections at shutdown isn't interesting
+
+
+class FakeElevenLabsServer:
+    """Serves POST /v1/text-to-speech/<voice_id> on 127.0.0.1 in a background thread."""
+
+    def __init__(self, port=0, latency_ms=250, bytes_per_char=400, kbytes_per_sec=256, error_rate=0.0, rate_limit_rate=0.0):
+        self.latency_ms = latency_ms
+        self.bytes_per_char = bytes_per_char
+        self.kbytes_per_sec = kbytes_per_sec
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._httpd = _QuietHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-elevenlabs", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real API, so pooling shows up
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.requests += 1
+                time.sleep(server.latency_ms / 1000.0)
+                roll = random.random()
+                if roll < server.rate_limit_rate: return self._error(429, "Too many concurrent requests")
+                if roll < server.rate_limit_rate + server.error_rate: return self._error(500, "Fake upstream failure")
+                audio = _fake_audio(body, server.bytes_per_char)
+                self.send_response(200)
+                self.send_header("Content-Type", "audio/mpeg")
+                self.send_header("Content-Length", str(len(audio)))
+                self.end_headers()
+                chunk = 16 * 1024
+                for start in range(0, len(audio), chunk):
+                    self.wfile.write(audio[start:start + chunk])
+                    time.sleep(chunk / 1024.0 / server.kbytes_per_sec)
+
+            def _error(self, status, message):
+                payload = ('{"detail": {"message": "%s"}}' % message).encode("utf-8")
+                self.send_response(status)
+                if status == 429: self.send_header("Retry-After", "1")
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def _fake_audio(request_body, bytes_per_char):
+    """Deterministic pseudo-audio sized roughly like real MP3 for the request's text."""
+    digest = hashlib.sha256(request_body).digest()
+    size = max(4096, min(len(request_body) * bytes_per_char, 2 * 1024 * 1024))
+    return b"ID3" + (digest * (size // len(digest) + 1))[:size - 3]
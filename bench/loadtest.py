@@ -0,0 +1,443 @@
+"""Offline load test: boots the app on fakes and drives mixed /api/* traffic.
+
+    python -m bench.loadtest --duration 30 --concurrency 64 --workers 2 --mode gevent
+    python -m bench.loadtest --json runs/after.json --compare runs/before.json
+
+The app runs under gunicorn with gunicorn.conf.py (so serving modes match
+production) and bench.fake_app, which swaps the Gemini model for
+bench.fakes.FakeGeminiModel; ElevenLabs calls go to a FakeElevenLabsServer
+started in this process. No real quota is used.
+
+Each virtual user loops over a weighted mix of routes with realistic payloads
+(repeated dictionary words and TTS phrases, chat sessions, streamed essays,
+long summaries, ...) and its own X-Forwarded-For, so per-user admission
+limits behave as they would for real clients. The report covers per-route
+p50/p95/p99 latency (and time to first byte for streamed responses),
+throughput, status classes, per-worker in-flight requests against worker
+capacity, and per-worker memory (RSS, Linux /proc). --json writes the results
+so runs can be compared with --compare.
+
+--auth turns on Firebase ID-token verification against a local fake issuer
+(tests.fakes.FakeFirebaseIssuer); each virtual user reuses one token, like
+the frontend does, so the run shows what verification costs per request.
+
+--url skips booting and targets an already running server (fakes and worker
+sampling are then up to you).
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+from bench.fakes import FakeElevenLabsServer
+from tests.fakes import FakeFirebaseIssuer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_METRICS_TOKEN = "bench-metrics-token"
+
+DEFAULT_MIX = {"chat": 25, "dictionary": 15, "tts": 15, "scenario": 8, "generate_text": 6, "correct_text": 6,
+               "grammar_aid": 5, "paraphrase": 5, "essay": 4, "translate": 4, "identify": 4, "summarize": 3}
+
+WORDS = ("apple run happy serendipity book light quick ephemeral house bright garden cautious river whisper "
+         "journey ancient brave curious delicate eager fragile gentle humble island jungle kindle lantern meadow "
+         "narrow ocean patient quiet rhythm shadow thunder umbrella velvet wander yearn zeal anchor blossom canyon "
+         "dazzle echo fathom glimmer harbor ignite jolt keen linger marvel nimble orbit ponder quaint resilient").split()
+TOPICS = ["climate change", "my hometown", "space travel", "healthy eating", "social media", "learning languages",
+          "the ocean", "artificial intelligence", "sports", "music festivals"]
+GRAMMAR = ["present perfect", "conditionals", "passive voice", "reported speech", "articles", "modal verbs"]
+SENTENCES = ["I have went to the store yesterday and buyed some apple.", "She don't like when peoples is late.",
+             "Can you tell me how I can improve my pronunciation?", "What is the difference between make and do?",
+             "Yesterday I am going to the cinema with my friends.", "How do I sound more natural in emails?",
+             "My teacher said that I should practise more listening.", "Could you explain idioms about weather?"]
+SCENARIOS = ["Ordering coffee at a busy cafe", "Checking in at a hotel", "A job interview for a design role",
+             "Asking for directions in London", "Returning a faulty phone to a shop"]
+TTS_PHRASES = [f"Sentence number {i}: practice makes perfect, so let's read this one aloud together." for i in range(30)]
+TINY_PNG = base64.b64encode(bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360f8cfc0f01f0005000201a5f3b0"
+    "ed0000000049454e44ae426082")).decode()
+
+
+def zipf_choice(rng, items, s=1.1):
+    """Few items very popular, long tail - like real dictionary/TTS traffic."""
+    weights = [1.0 / (rank + 1) ** s for rank in range(len(items))]
+    return rng.choices(items, weights=weights)[0]
+
+
+# --- Virtual Users ---
+class VirtualUser:
+    def __init__(self, index, base_url, mix, stream_fraction, seed):
+        self.base_url = base_url
+        self.rng = random.Random(seed * 1000003 + index)
+        self.routes, self.weights = zip(*mix.items())
+        self.stream_fraction = stream_fraction
+        self.http = requests.Session()
+        self.http.headers["X-Forwarded-For"] = f"10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}"
+        self.chat_history = []
+        self.chat_session = None
+        self.scenario = None # (description, session_id)
+
+    def next_request(self):
+        """Returns (label, path, payload, stream) for this user's next request."""
+        route = self.rng.choices(self.routes, weights=self.weights)[0]
+        rng = self.rng
+        stream = rng.random() < self.stream_fraction
+        if route == "chat":
+            payload = {"message": rng.choice(SENTENCES)}
+            if rng.random() < 0.5: # Half the users use server-side sessions
+                payload.update({"session_id": self.chat_session} if self.chat_session else {"history": self.chat_history[-6:], "session": True})
+            else: payload["history"] = self.chat_history[-6:]
+            return "chat", "/api/chat", payload, stream
+        if route == "dictionary": return "dictionary", "/api/dictionary", {"word": zipf_choice(rng, WORDS)}, False
+        if route == "tts": return "tts", "/api/elevenlabs_tts", {"text": zipf_choice(rng, TTS_PHRASES)}, True
+        if route == "scenario":
+            if self.scenario is None or rng.random() < 0.2:
+                self.scenario = (rng.choice(SCENARIOS), None)
+                return "scenario_start", "/api/scenario-chat", {"scenario": self.scenario[0], "start": True, "session": True}, False
+            payload = {"message": rng.choice(SENTENCES)}
+            payload.update({"session_id": self.scenario[1]} if self.scenario[1] else {"scenario": self.scenario[0], "history": [], "session": True})
+            return "scenario", "/api/scenario-chat", payload, stream
+        if route == "generate_text": return route, "/api/generate_text", {"level": rng.choice(["encounter", "awakening", "summit"]), "topic": rng.choice(TOPICS)}, False
+        if route == "correct_text": return route, "/api/correct_text", {"text": rng.choice(SENTENCES)}, False
+        if route == "grammar_aid": return route, "/api/grammar_aid", {"topic": rng.choice(GRAMMAR)}, False
+        if route == "paraphrase": return route, "/api/paraphrase", {"text": rng.choice(SENTENCES), "style": rng.choice(["simpler", "formal", "creative"])}, False
+        if route == "essay": return route, "/api/essay", {"topic": rng.choice(TOPICS), "essay_type": "argumentative", "outline_only": rng.random() < 0.3}, stream
+        if route == "translate": return route, "/api/translate-explain", {"text_translate": "Bugün hava çok güzel, parka gidelim mi?"}, False
+        if route == "identify": return route, "/api/identify-objects", {"image_data": TINY_PNG, "mime_type": "image/png"}, False
+        words = rng.choice([300, 1500, 9000]) # Short, medium and map-reduce sized documents
+        return "summarize", "/api/summarize", {"text": " ".join(rng.choice(WORDS) for _ in range(words)) + "."}, stream
+
+    def remember(self, label, payload, body):
+        """Keeps conversation state (history, session ids) like the real frontend."""
+        if not isinstance(body, dict): return
+        if label == "chat":
+            if body.get("session_expired"): self.chat_session = None
+            elif body.get("session_id"): self.chat_session = body["session_id"]
+            if body.get("reply"): self.chat_history += [{"sender": "user", "text": payload["message"]}, {"sender": "bot", "text": body["reply"]}]
+        elif label in ("scenario_start", "scenario") and self.scenario is not None:
+            if body.get("session_expired"): self.scenario = (self.scenario[0], None)
+            elif body.get("session_id"): self.scenario = (self.scenario[0], body["session_id"])
+
+    def send(self, label, path, payload, stream, timeout):
+        """Performs one request; returns (status, total_seconds, ttfb_seconds, body)."""
+        url = self.base_url + path + ("?stream=1" if stream and label not in ("tts",) else "")
+        started = time.perf_counter()
+        ttfb = None
+        body = None
+        try:
+            with self.http.post(url, json=payload, stream=True, timeout=timeout) as response:
+                content = bytearray()
+                for chunk in response.iter_content(chunk_size=16 * 1024):
+                    if ttfb is None: ttfb = time.perf_counter() - started
+                    content += chunk
+                status = response.status_code
+                if "json" in response.headers.get("Content-Type", ""): body = json.loads(content or b"null")
+                elif "event-stream" in response.headers.get("Content-Type", ""): body = _last_sse_payload(content.decode("utf-8", "replace"))
+        except (requests.RequestException, ValueError) as e:
+            status = type(e).__name__
+        return status, time.perf_counter() - started, ttfb, body
+
+
+def _last_sse_payload(text):
+    """Payload of the final done/error event of an SSE body."""
+    for block in reversed(text.strip().split("\n\n")):
+        if block.startswith("event: done") or block.startswith("event: error"):
+            for line in block.split("\n"):
+                if line.startswith("data:"): return json.loads(line[5:])
+    return None
+
+
+# --- Server Under Test ---
+class ServerProcess:
+    """gunicorn + bench.fake_app in a subprocess, configured like production."""
+
+    def __init__(self, port, workers, mode, env_overrides):
+        self.port = port
+        self.workers = workers
+        self.mode = mode
+        self.metrics_dir = tempfile.mkdtemp(prefix="adai-bench-metrics-")
+        self.env = {**os.environ, "PORT": str(port), "WEB_CONCURRENCY": str(workers), "SERVING_MODE": mode,
+                    "METRICS_DIR": self.metrics_dir, "METRICS_FLUSH_INTERVAL": "0.5", "METRICS_TOKEN": BENCH_METRICS_TOKEN, "LOG_LEVEL": "WARNING",
+                    "TTS_CACHE_DIR": tempfile.mkdtemp(prefix="adai-bench-tts-"), **self._fresh_stores(), **env_overrides}
+        self.process = None
+
+    @staticmethod
+    def _fresh_stores():
+        """Empty lexicon, semantic cache and session files, so earlier runs' entries don't turn lookups into local hits."""
+        scratch = tempfile.mkdtemp(prefix="adai-bench-stores-")
+        return {"LEXICON_DB": os.path.join(scratch, "lexicon.sqlite3"), "SEMANTIC_CACHE_DB": os.path.join(scratch, "semantic.sqlite3"),
+                "SESSION_STORE_DB": os.path.join(scratch, "sessions.sqlite3")}
+
+    @property
+    def capacity_per_worker(self):
+        if self.mode == "gevent": return int(self.env.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+        if self.mode == "gthread": return int(self.env.get("GUNICORN_THREADS", 32))
+        return 1
+
+    def start(self, timeout=60):
+        self.process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "bench.fake_app:app"],
+                                        cwd=REPO_ROOT, env=self.env)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None: raise RuntimeError(f"gunicorn exited with {self.process.returncode}")
+            try:
+                if requests.get(f"http://127.0.0.1:{self.port}/metrics", headers={"Authorization": f"Bearer {BENCH_METRICS_TOKEN}"}, timeout=1).ok and len(self.worker_pids()) >= self.workers: return
+            except requests.RequestException:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError("Server did not become ready in time")
+
+    def stop(self):
+        if self.process is None: return
+        self.process.terminate()
+        try: self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired: self.process.kill()
+
+    def worker_pids(self):
+        master = self.process.pid
+        try:
+            with open(f"/proc/{master}/task/{master}/children") as f: return [int(pid) for pid in f.read().split()]
+        except OSError:
+            return []
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+class WorkerSampler(threading.Thread):
+    """Samples per-worker in-flight requests (from metric snapshots) and RSS."""
+
+    def __init__(self, server, interval=0.5):
+        super().__init__(name="worker-sampler", daemon=True)
+        self.server = server
+        self.interval = interval
+        self.samples = defaultdict(lambda: {"in_flight": [], "rss_mb": []})
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for pid in self.server.worker_pids():
+                sample = self.samples[pid]
+                memory = rss_mb(pid)
+                if memory is not None: sample["rss_mb"].append(memory)
+                snapshot = _read_snapshot(self.server.metrics_dir, pid)
+                in_flight = snapshot.get("adai_http_requests_in_flight", {}).get("values", [])
+                if in_flight: sample["in_flight"].append(in_flight[0][1])
+
+    def handled(self, pid):
+        snapshot = _read_snapshot(self.server.metrics_dir, pid)
+        return sum(value for _, value in snapshot.get("adai_http_requests_total", {}).get("values", []))
+
+
+def _read_snapshot(directory, pid):
+    try:
+        with open(os.path.join(directory, f"{pid}.json")) as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# --- Load Generation ---
+def run_load(base_url, args, mix, issuer=None):
+    results = defaultdict(list) # label -> [(status, seconds, ttfb)]
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.warmup + args.duration
+    measure_from = time.monotonic() + args.warmup
+
+    def user_loop(index):
+        user = VirtualUser(index, base_url, mix, args.stream_fraction, args.seed)
+        if issuer is not None: user.http.headers["Authorization"] = f"Bearer {issuer.mint(f'bench-user-{index}')}" # One token per user, reused like the real frontend
+        while time.monotonic() < deadline:
+            label, path, payload, stream = user.next_request()
+            sent_at = time.monotonic()
+            status, seconds, ttfb, body = user.send(label, path, payload, stream, args.timeout)
+            user.remember(label, payload, body)
+            if sent_at >= measure_from:
+                with lock: results[label].append((status, seconds, ttfb))
+            if args.think_ms: time.sleep(user.rng.expovariate(1000.0 / args.think_ms))
+
+    threads = [threading.Thread(target=user_loop, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results
+
+
+def percentile(values, pct):
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))]
+
+
+def summarize(results, duration):
+    routes = {}
+    all_latencies = []
+    for label, samples in sorted(results.items()):
+        latencies = [seconds for _, seconds, _ in samples]
+        ttfbs = [ttfb for _, _, ttfb in samples if ttfb is not None]
+        statuses = defaultdict(int)
+        for status, _, _ in samples: statuses[f"{status // 100}xx" if isinstance(status, int) else status] += 1
+        all_latencies += latencies
+        routes[label] = {"count": len(samples), "rps": len(samples) / duration, "statuses": dict(statuses),
+                         "rate_limited": sum(1 for status, _, _ in samples if status == 429),
+                         **{f"p{p}_ms": _ms(percentile(latencies, p)) for p in (50, 95, 99)},
+                         "mean_ms": _ms(statistics.fmean(latencies)) if latencies else None,
+                         "ttfb_p50_ms": _ms(percentile(ttfbs, 50)), "ttfb_p95_ms": _ms(percentile(ttfbs, 95))}
+    total = sum(route["count"] for route in routes.values())
+    errors = sum(count for route in routes.values() for status, count in route["statuses"].items() if status != "2xx")
+    return {"routes": routes,
+            "overall": {"count": total, "rps": total / duration, "error_rate": errors / total if total else 0.0,
+                        **{f"p{p}_ms": _ms(percentile(all_latencies, p)) for p in (50, 95, 99)}}}
+
+
+def worker_report(server, sampler):
+    workers = {}
+    for pid, sample in sorted(sampler.samples.items()):
+        in_flight = sample["in_flight"] or [0]
+        workers[str(pid)] = {"handled": sampler.handled(pid),
+                             "in_flight_mean": statistics.fmean(in_flight), "in_flight_max": max(in_flight),
+                             "saturation_max": max(in_flight) / server.capacity_per_worker,
+                             "rss_mb_start": sample["rss_mb"][0] if sample["rss_mb"] else None,
+                             "rss_mb_max": max(sample["rss_mb"]) if sample["rss_mb"] else None}
+    return workers
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000.0, 1)
+
+
+# --- Reporting ---
+def print_report(report, baseline=None):
+    def delta(current, previous):
+        if current is None or previous in (None, 0): return ""
+        return f" ({(current - previous) / previous * 100:+.0f}%)"
+
+    base_routes = (baseline or {}).get("routes", {})
+    print(f"\n{'route':<16}{'count':>7}{'rps':>8}{'p50 ms':>16}{'p95 ms':>16}{'p99 ms':>16}{'ttfb p50':>10}  statuses")
+    for label, route in report["routes"].items():
+        previous = base_routes.get(label, {})
+        cells = "".join(f"{str(route[key]) + delta(route[key], previous.get(key)):>16}" for key in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{label:<16}{route['count']:>7}{route['rps']:>8.1f}{cells}{str(route['ttfb_p50_ms'] or '-'):>10}  {route['statuses']}")
+    overall = report["overall"]
+    previous = (baseline or {}).get("overall", {})
+    print(f"\nthroughput {overall['rps']:.1f} req/s{delta(overall['rps'], previous.get('rps'))}, "
+          f"p50 {overall['p50_ms']} ms{delta(overall['p50_ms'], previous.get('p50_ms'))}, "
+          f"p95 {overall['p95_ms']} ms{delta(overall['p95_ms'], previous.get('p95_ms'))}, "
+          f"p99 {overall['p99_ms']} ms{delta(overall['p99_ms'], previous.get('p99_ms'))}, "
+          f"errors {overall['error_rate'] * 100:.1f}%")
+    if report.get("workers"):
+        print(f"\n{'worker':<10}{'handled':>9}{'in-flight mean/max':>20}{'saturation':>12}{'RSS MB start/max':>20}")
+        for pid, worker in report["workers"].items():
+            rss = f"{worker['rss_mb_start'] or 0:.0f}/{worker['rss_mb_max'] or 0:.0f}"
+            print(f"{pid:<10}{worker['handled']:>9}{worker['in_flight_mean']:>12.1f}/{worker['in_flight_max']:<7}{worker['saturation_max'] * 100:>11.1f}%{rss:>20}")
+    if report.get("upstream"): print(f"\nupstream calls: {report['upstream']}")
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    if text:
+        for part in text.split(","):
+            route, _, weight = part.partition("=")
+            if route.strip() not in DEFAULT_MIX: raise SystemExit(f"Unknown route in --mix: {route!r} (known: {', '.join(DEFAULT_MIX)})")
+            mix[route.strip()] = float(weight)
+    return {route: weight for route, weight in mix.items() if weight > 0}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds of load")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of load before measuring")
+    parser.add_argument("--concurrency", type=int, default=32, help="Virtual users (closed loop)")
+    parser.add_argument("--think-ms", type=float, default=0, help="Mean pause between a user's requests")
+    parser.add_argument("--stream-fraction", type=float, default=0.5, help="Share of streamable requests sent with ?stream=1")
+    parser.add_argument("--mix", help="Route weights, e.g. chat=40,tts=0 (others keep their defaults)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--url", help="Target an already running server instead of booting one")
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--mode", choices=["gevent", "gthread", "sync"], default="gevent")
+    parser.add_argument("--no-cache", action="store_true", help="Disable response and TTS caches")
+    parser.add_argument("--admission", action="store_true", help="Keep admission control on (off by default so limits don't dominate)")
+    parser.add_argument("--auth", action="store_true", help="Verify Firebase ID tokens (minted by a local fake issuer; not with --url)")
+    parser.add_argument("--gemini-first-token-ms", type=float, default=400)
+    parser.add_argument("--gemini-tokens-per-sec", type=float, default=80)
+    parser.add_argument("--gemini-output-tokens", type=int, default=200)
+    parser.add_argument("--gemini-quota-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-invalid-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-block-rate", type=float, default=0.0)
+    parser.add_argument("--tts-latency-ms", type=float, default=250)
+    parser.add_argument("--tts-error-rate", type=float, default=0.0)
+    parser.add_argument("--tts-rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Baseline report (from --json) to show deltas against")
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+
+    server = sampler = fake_tts = issuer = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        fake_tts = FakeElevenLabsServer(latency_ms=args.tts_latency_ms, error_rate=args.tts_error_rate,
+                                        rate_limit_rate=args.tts_rate_limit_rate).start()
+        overrides = {"ELEVENLABS_API_BASE": fake_tts.url,
+                     "BENCH_GEMINI_FIRST_TOKEN_MS": str(args.gemini_first_token_ms),
+                     "BENCH_GEMINI_TOKENS_PER_SEC": str(args.gemini_tokens_per_sec),
+                     "BENCH_GEMINI_OUTPUT_TOKENS": str(args.gemini_output_tokens),
+                     "BENCH_GEMINI_QUOTA_ERROR_RATE": str(args.gemini_quota_error_rate),
+                     "BENCH_GEMINI_INVALID_RATE": str(args.gemini_invalid_rate),
+                     "BENCH_GEMINI_BLOCK_RATE": str(args.gemini_block_rate),
+                     "ADMISSION_ENABLED": "true" if args.admission else "false"}
+        if args.no_cache: overrides.update({"RESPONSE_CACHE_ENABLED": "false", "TTS_CACHE_ENABLED": "false"})
+        if args.auth:
+            issuer = FakeFirebaseIssuer()
+            key_file = os.path.join(tempfile.mkdtemp(prefix="adai-bench-auth-"), "issuer-key.pem")
+            issuer.save_key(key_file)
+            overrides.update({"BENCH_FIREBASE_KEY_FILE": key_file, "FIREBASE_PROJECT_ID": issuer.project_id})
+        server = ServerProcess(args.port, args.workers, args.mode, overrides)
+        server.start()
+        base_url = f"http://127.0.0.1:{args.port}"
+        sampler = WorkerSampler(server)
+        sampler.start()
+
+    try:
+        print(f"Driving {args.concurrency} users for {args.warmup:.0f}s warmup + {args.duration:.0f}s against {base_url} ...")
+        results = run_load(base_url, args, mix, issuer)
+    finally:
+        if sampler is not None: sampler.stopped.set()
+        report = summarize(results if "results" in locals() else {}, args.duration)
+        report["config"] = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+        if server is not None:
+            report["workers"] = worker_report(server, sampler)
+            server.stop()
+        if fake_tts is not None:
+            report["upstream"] = {"elevenlabs_requests": fake_tts.requests}
+            fake_tts.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w") as f: json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
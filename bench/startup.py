@@ -0,0 +1,118 @@
+"""Startup-time benchmark: how long a fresh worker takes to import and warm up.
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --json runs/startup.json --compare runs/startup-before.json
+
+Two measurements, each over --runs fresh processes (medians reported):
+
+  import  `import app` in a new interpreter, then the time to build the
+          default Gemini model (SDK import + configure; no network calls), and
+          whether the SDK was already loaded by the import itself.
+  boot    gunicorn serving the real app (dummy API key) until the first HTTP
+          response and until /readyz answers 200, i.e. what an autoscaled
+          instance waits before it can take traffic.
+
+No request reaches Google: a dummy key is used and nothing calls the model.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+sdk_loaded = "google.generativeai" in sys.modules
+warm_ok = app.gemini_models.warm() if app.gemini_models is not None else False
+print(json.dumps({"import_s": imported - started, "warm_s": time.perf_counter() - imported, "sdk_loaded_on_import": sdk_loaded, "warm_ok": warm_ok}))
+"""
+
+
+def _env(extra=None):
+    scratch = tempfile.mkdtemp(prefix="adai-startup-")
+    return {**os.environ, "GOOGLE_API_KEY": "bench-fake-key", "LOG_LEVEL": "WARNING", "METRICS_DIR": os.path.join(scratch, "metrics"),
+            "JOBS_DB": os.path.join(scratch, "jobs.sqlite3"), "TTS_CACHE_DIR": os.path.join(scratch, "tts"),
+            "LEXICON_DB": os.path.join(scratch, "lexicon.sqlite3"), "SEMANTIC_CACHE_DB": os.path.join(scratch, "semantic.sqlite3"),
+            "SESSION_STORE_DB": os.path.join(scratch, "sessions.sqlite3"), **(extra or {})}
+
+
+def measure_import():
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", _IMPORT_PROBE], cwd=REPO_ROOT, env=_env(), capture_output=True, text=True, check=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["process_s"] = time.perf_counter() - started
+    return result
+
+
+def measure_boot(port, mode, timeout=60):
+    env = _env({"PORT": str(port), "WEB_CONCURRENCY": "1", "SERVING_MODE": mode})
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"], cwd=REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = ready = None
+    try:
+        while time.perf_counter() - started < timeout and ready is None:
+            if process.poll() is not None: raise RuntimeError(f"gunicorn exited with {process.returncode}")
+            try:
+                response = requests.get(f"http://127.0.0.1:{port}/readyz", timeout=1)
+                if first_response is None: first_response = time.perf_counter() - started
+                if response.status_code == 200: ready = time.perf_counter() - started
+            except requests.RequestException:
+                pass
+            time.sleep(0.02)
+    finally:
+        process.terminate()
+        try: process.wait(timeout=30)
+        except subprocess.TimeoutExpired: process.kill()
+    if ready is None: raise RuntimeError("Worker did not become ready in time")
+    return {"first_response_s": first_response, "ready_s": ready}
+
+
+def _median(samples, key):
+    values = [sample[key] for sample in samples if sample.get(key) is not None]
+    return round(statistics.median(values) * 1000.0, 1) if values else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--mode", choices=["gevent", "gthread", "sync"], default="gthread")
+    parser.add_argument("--skip-boot", action="store_true", help="Only measure the import")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--compare", help="Baseline report (from --json) to show deltas against")
+    args = parser.parse_args(argv)
+
+    imports = [measure_import() for _ in range(args.runs)]
+    boots = [] if args.skip_boot else [measure_boot(args.port, args.mode) for _ in range(args.runs)]
+    report = {"import_ms": _median(imports, "import_s"), "warm_ms": _median(imports, "warm_s"), "process_ms": _median(imports, "process_s"),
+              "sdk_loaded_on_import": any(sample["sdk_loaded_on_import"] for sample in imports),
+              "boot_first_response_ms": _median(boots, "first_response_s"), "boot_ready_ms": _median(boots, "ready_s"),
+              "config": {"runs": args.runs, "mode": args.mode}}
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+    for key in ("import_ms", "warm_ms", "process_ms", "boot_first_response_ms", "boot_ready_ms"):
+        previous = (baseline or {}).get(key)
+        delta = f" ({(report[key] - previous) / previous * 100:+.0f}%)" if report[key] is not None and previous else ""
+        print(f"{key:<24}{str(report[key]):>10}{delta}")
+    print(f"{'sdk_loaded_on_import':<24}{str(report['sdk_loaded_on_import']):>10}")
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, "w") as f: json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Pre-generated texts for /api/generate_text.
+
+Most generate_text traffic asks for a handful of popular topics, so the
+library keeps several ready-made variants per (level, topic) in a SQLite file
+and serves them in rotation (least-served first). Request counts per topic are
+tracked in the same file; once a topic is popular its variants are refilled
+in the background whenever they drop below a low-water mark, and a periodic
+sweep pre-generates the most requested topics for every level.
+
+Generation is injected as a callable so this module knows nothing about
+Gemini. Refills are claimed in the database, so with a shared file
+(CONTENT_LIBRARY_DB) only one worker generates a given pair at a time.
+"""
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAX_TOPIC_CHARS = 80 # Longer "topics" are one-off prompts, not worth tracking
+_REFILL_CLAIM_SECONDS = 300 # A crashed refill is retried after this
+
+
+def normalize_topic(topic):
+    return re.sub(r"\s+", " ", topic.strip().strip(".!?\"'").lower())
+
+
+class ContentLibrary:
+    def __init__(self, path, generate, target_variants=4, low_water=2, min_requests=3, max_serves=50,
+                 refill_concurrency=1, sweep_interval=900, sweep_topics=20, max_topics=5000):
+        self.generate = generate # (level, topic, variant_number) -> text or None
+        self.target_variants = target_variants
+        self.low_water = low_water
+        self.min_requests = min_requests
+        self.max_serves = max_serves
+        self.sweep_interval = sweep_interval
+        self.sweep_topics = sweep_topics
+        self.max_topics = max_topics
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=refill_concurrency, thread_name_prefix="content-refill")
+        self._sweeper_pid = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generate_failures = 0
+        self.retired = 0
+        if path != ":memory:": os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS texts (id INTEGER PRIMARY KEY, level TEXT NOT NULL, topic_key TEXT NOT NULL,
+                              text TEXT NOT NULL, created_at REAL NOT NULL, served INTEGER NOT NULL DEFAULT 0, last_served REAL NOT NULL DEFAULT 0)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_texts_pair ON texts(level, topic_key, served, last_served)")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS topics (level TEXT NOT NULL, topic_key TEXT NOT NULL, topic TEXT NOT NULL,
+                              requests INTEGER NOT NULL DEFAULT 0, last_requested REAL NOT NULL, refill_until REAL NOT NULL DEFAULT 0,
+                              PRIMARY KEY (level, topic_key))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_topics_requests ON topics(requests)")
+
+    # --- Request Path ---
+    def take(self, level, topic):
+        """Returns the least-served variant for the pair (or None), counting the request.
+
+        Variants served max_serves times are retired, and a background refill is
+        scheduled when a popular pair runs low.
+        """
+        topic_key = normalize_topic(topic)
+        if not topic_key or len(topic_key) > MAX_TOPIC_CHARS: return None
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            conn.execute("""INSERT INTO topics (level, topic_key, topic, requests, last_requested) VALUES (?, ?, ?, 1, ?)
+                            ON CONFLICT(level, topic_key) DO UPDATE SET requests = requests + 1, last_requested = excluded.last_requested""",
+                         (level, topic_key, topic.strip(), now))
+            requests = conn.execute("SELECT requests FROM topics WHERE level = ? AND topic_key = ?", (level, topic_key)).fetchone()[0]
+            row = conn.execute("""SELECT id, text, served FROM texts WHERE level = ? AND topic_key = ?
+                                  ORDER BY served, last_served LIMIT 1""", (level, topic_key)).fetchone()
+            if row is not None:
+                if row[2] + 1 >= self.max_serves:
+                    conn.execute("DELETE FROM texts WHERE id = ?", (row[0],))
+                    self.retired += 1
+                else:
+                    conn.execute("UPDATE texts SET served = served + 1, last_served = ? WHERE id = ?", (now, row[0]))
+            available = conn.execute("SELECT COUNT(*) FROM texts WHERE level = ? AND topic_key = ?", (level, topic_key)).fetchone()[0]
+            if row is None: self.misses += 1
+            else: self.hits += 1
+        if requests >= self.min_requests and available < self.low_water: self.schedule_refill(level, topic)
+        return row[1] if row is not None else None
+
+    def add(self, level, topic, text):
+        """Stores a variant (e.g. a freshly generated on-demand text) if the pair has room."""
+        topic_key = normalize_topic(topic)
+        if not topic_key or len(topic_key) > MAX_TOPIC_CHARS or not text: return False
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM texts WHERE level = ? AND topic_key = ?", (level, topic_key)).fetchone()[0]
+            if count >= self.target_variants: return False
+            self._conn.execute("INSERT INTO texts (level, topic_key, text, created_at) VALUES (?, ?, ?, ?)", (level, topic_key, text, time.time()))
+        return True
+
+    # --- Refills ---
+    def schedule_refill(self, level, topic):
+        """Queues generation up to target_variants unless another worker already claimed the pair."""
+        topic_key = normalize_topic(topic)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""INSERT OR IGNORE INTO topics (level, topic_key, topic, requests, last_requested) VALUES (?, ?, ?, 0, ?)""",
+                               (level, topic_key, topic.strip(), now))
+            claimed = self._conn.execute("UPDATE topics SET refill_until = ? WHERE level = ? AND topic_key = ? AND refill_until < ?",
+                                         (now + _REFILL_CLAIM_SECONDS, level, topic_key, now)).rowcount
+        if claimed: self._pool.submit(self._refill, level, topic, topic_key)
+        return bool(claimed)
+
+    def _refill(self, level, topic, topic_key):
+        try:
+            with self._lock:
+                count = self._conn.execute("SELECT COUNT(*) FROM texts WHERE level = ? AND topic_key = ?", (level, topic_key)).fetchone()[0]
+            for variant in range(count, self.target_variants):
+                try:
+                    text = self.generate(level, topic, variant + 1)
+                except Exception as e:
+                    logger.warning("content library generation failed for %s/%s: %s", level, topic_key, e)
+                    text = None
+                if not text:
+                    self.generate_failures += 1
+                    break # Likely quota or a blocked topic; the next claim retries
+                self.add(level, topic, text)
+                self.generated += 1
+        finally:
+            with self._lock:
+                self._conn.execute("UPDATE topics SET refill_until = 0 WHERE level = ? AND topic_key = ?", (level, topic_key))
+
+    # --- Background Sweep ---
+    def ensure_sweeper(self, levels):
+        """Starts this process's periodic pre-generation thread (cheap to call per request)."""
+        if self.sweep_interval <= 0 or self._sweeper_pid == os.getpid(): return
+        with self._lock:
+            if self._sweeper_pid == os.getpid(): return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_loop, args=(tuple(levels),), name="content-sweep", daemon=True).start()
+
+    def _sweep_loop(self, levels):
+        while True:
+            try: self.sweep(levels)
+            except Exception as e: logger.warning("content library sweep failed: %s", e)
+            time.sleep(self.sweep_interval)
+
+    def sweep(self, levels):
+        """Refills every level of the most requested topics; prunes the topic table."""
+        with self._lock:
+            popular = self._conn.execute("""SELECT topic_key, MIN(topic), SUM(requests) AS total FROM topics GROUP BY topic_key
+                                            HAVING total >= ? ORDER BY total DESC LIMIT ?""", (self.min_requests, self.sweep_topics)).fetchall()
+            counts = dict(((level, topic_key), count) for level, topic_key, count in self._conn.execute(
+                "SELECT level, topic_key, COUNT(*) FROM texts GROUP BY level, topic_key"))
+            self._conn.execute("""DELETE FROM topics WHERE rowid IN (SELECT rowid FROM topics ORDER BY requests DESC LIMIT -1 OFFSET ?)""",
+                               (self.max_topics,))
+        scheduled = 0
+        for topic_key, topic, _ in popular:
+            for level in levels:
+                if counts.get((level, topic_key), 0) < self.low_water and self.schedule_refill(level, topic): scheduled += 1
+        if scheduled: logger.info("content library sweep scheduled %d refills", scheduled)
+        return scheduled
+
+    def seed(self, topics, levels):
+        """Marks configured topics as popular so they're pre-generated before anyone asks."""
+        now = time.time()
+        with self._lock:
+            for topic in topics:
+                topic_key = normalize_topic(topic)
+                if not topic_key or len(topic_key) > MAX_TOPIC_CHARS: continue
+                for level in levels:
+                    self._conn.execute("""INSERT INTO topics (level, topic_key, topic, requests, last_requested) VALUES (?, ?, ?, ?, ?)
+                                          ON CONFLICT(level, topic_key) DO UPDATE SET requests = MAX(requests, excluded.requests)""",
+                                       (level, topic_key, topic.strip(), self.min_requests, now))
+
+    def stats(self):
+        with self._lock:
+            variants = self._conn.execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+            pairs = self._conn.execute("SELECT COUNT(*) FROM (SELECT DISTINCT level, topic_key FROM texts)").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "generated": self.generated, "generate_failures": self.generate_failures,
+                "retired": self.retired, "variants": variants, "pairs": pairs}
+
+
+def library_from_env(environ, generate, levels):
+    """Builds the library configured by CONTENT_LIBRARY_* env vars (None if disabled)."""
+    if environ.get("CONTENT_LIBRARY_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    library = ContentLibrary(environ.get("CONTENT_LIBRARY_DB", ":memory:"), generate,
+                             target_variants=int(environ.get("CONTENT_LIBRARY_VARIANTS", 4)),
+                             low_water=int(environ.get("CONTENT_LIBRARY_LOW_WATER", 2)),
+                             min_requests=int(environ.get("CONTENT_LIBRARY_MIN_REQUESTS", 3)),
+                             max_serves=int(environ.get("CONTENT_LIBRARY_MAX_SERVES", 50)),
+                             sweep_interval=float(environ.get("CONTENT_LIBRARY_SWEEP_INTERVAL", 900)),
+                             sweep_topics=int(environ.get("CONTENT_LIBRARY_SWEEP_TOPICS", 20)))
+    seed_topics = [topic for topic in environ.get("CONTENT_LIBRARY_SEED_TOPICS", "").split(",") if topic.strip()]
+    if seed_topics: library.seed(seed_topics, levels)
+    return library
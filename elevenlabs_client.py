@@ -0,0 +1,195 @@
+"""Pooled HTTP client for the ElevenLabs text-to-speech API.
+
+One client per worker process keeps TLS connections alive between requests,
+retries transient failures (429/5xx, connection errors) with jittered
+exponential backoff that honours Retry-After, and trips a circuit breaker when
+ElevenLabs keeps failing so requests fail fast instead of holding a worker.
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the breaker is open."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"ElevenLabs circuit open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+# --- Circuit Breaker ---
+class CircuitBreaker:
+    """Classic closed -> open -> half-open breaker.
+
+    After `failure_threshold` consecutive failures the breaker opens for
+    `reset_timeout` seconds. The first call after that is let through as a
+    probe; its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        if self._opened_at is None: return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout: return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not go upstream."""
+        with self._lock:
+            if self._opened_at is None: return
+            elapsed = time.monotonic() - self._opened_at
+            if elapsed < self.reset_timeout:
+                raise CircuitOpenError(self.reset_timeout - elapsed)
+            if self._probe_in_flight: # Only one probe at a time while half-open
+                raise CircuitOpenError(1)
+            self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            was_probe = self._probe_in_flight
+            self._probe_in_flight = False
+            if was_probe or self._failures >= self.failure_threshold:
+                if self._opened_at is None or was_probe: self.times_opened += 1
+                self._opened_at = time.monotonic()
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header (delta-seconds or HTTP date)."""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value: return None
+    try: return max(0.0, float(value))
+    except ValueError: pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Client ---
+class ElevenLabsClient:
+    """Thread-safe wrapper around a pooled requests.Session."""
+
+    def __init__(self, api_key, pool_size=32, max_retries=2, backoff_base=0.5, backoff_max=8.0,
+                 connect_timeout=5.0, read_timeout=60.0, breaker=None):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        self.session.headers.update({"Accept": "audio/mpeg", "Content-Type": "application/json", "xi-api-key": api_key})
+        self._lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+        self.failures = 0
+
+    def _backoff(self, attempt, response=None):
+        retry_after = _retry_after_seconds(response)
+        if retry_after is not None: return min(retry_after, self.backoff_max)
+        # Full jitter: uniform in [0, base * 2^attempt], capped
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, url, payload, stream=False):
+        """POSTs a TTS payload, retrying transient failures.
+
+        Returns the successful requests.Response (with stream=True the body has
+        not been read yet). Non-retryable or exhausted HTTP errors are raised as
+        requests.exceptions.HTTPError, network errors as RequestException, and
+        CircuitOpenError is raised without touching the network.
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            response = None
+            try:
+                self._count("requests_sent")
+                response = self.session.post(url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as network_error:
+                self.breaker.record_failure()
+                if attempt >= self.max_retries:
+                    self._count("failures")
+                    raise
+                logger.warning("ElevenLabs network error (attempt %d), retrying: %s", attempt + 1, network_error)
+            else:
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    return response
+                if response.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    # 429 means "slow down", not "down": don't count it against the breaker
+                    if response.status_code >= 500: self.breaker.record_failure()
+                    else: self.breaker.record_success()
+                    self._count("failures")
+                    if stream: response.content # Read the error body before raising
+                    response.raise_for_status()
+                if response.status_code >= 500: self.breaker.record_failure()
+                else: self.breaker.record_success()
+                logger.warning("ElevenLabs returned %s (attempt %d), retrying.", response.status_code, attempt + 1)
+                response.close()
+            delay = self._backoff(attempt, response)
+            self._count("retries")
+            attempt += 1
+            time.sleep(delay)
+
+    def _count(self, attr):
+        with self._lock: setattr(self, attr, getattr(self, attr) + 1)
+
+    def stats(self):
+        """Request/retry counters plus connection reuse from the urllib3 pools."""
+        connections_opened = 0
+        pooled_requests = 0
+        for pool_key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(pool_key)
+            if pool is None: continue
+            connections_opened += pool.num_connections
+            pooled_requests += pool.num_requests
+        return {
+            "requests": self.requests_sent,
+            "retries": self.retries,
+            "failures": self.failures,
+            "connections_opened": connections_opened,
+            "connection_reuse_ratio": (1 - connections_opened / pooled_requests) if pooled_requests else 0.0,
+            "circuit_state": self.breaker.state,
+            "circuit_opened": self.breaker.times_opened,
+        }
+
+
+def client_from_env(api_key, environ):
+    """Builds a client from ELEVENLABS_* settings."""
+    breaker = CircuitBreaker(failure_threshold=int(environ.get("ELEVENLABS_BREAKER_THRESHOLD", 5)),
+                             reset_timeout=float(environ.get("ELEVENLABS_BREAKER_RESET", 30)))
+    return ElevenLabsClient(api_key,
+                            pool_size=int(environ.get("ELEVENLABS_POOL_SIZE", 32)),
+                            max_retries=int(environ.get("ELEVENLABS_MAX_RETRIES", 2)),
+                            connect_timeout=float(environ.get("ELEVENLABS_CONNECT_TIMEOUT", 5)),
+                            read_timeout=float(environ.get("ELEVENLABS_READ_TIMEOUT", 60)),
+                            breaker=breaker)
@@ -0,0 +1,175 @@
+"""Firebase ID-token verification that stays off the network on the hot path.
+
+Firebase ID tokens are RS256 JWTs signed with keys whose X.509 certificates
+Google publishes at CERTS_URL. CertCache keeps those certificates for as long
+as the response's Cache-Control max-age allows, refreshing them in the
+background shortly before they expire (and at most every few seconds when a
+token names an unknown key id, i.e. right after a key rotation). If a refresh
+fails, the stale certificates keep being used until one succeeds.
+
+TokenVerifier checks signatures locally against the cached certificates, then
+the claims Firebase requires (aud, iss, sub, exp, iat, auth_time). Decoded tokens
+are kept in a bounded LRU keyed by the token's SHA-256 until their exp, so a
+client sending the same token on every request pays for one signature check.
+Revocation (verify_id_token's check_revoked) needs a call to Firebase per
+token and is not done here.
+
+The certificate source is injectable (`fetch`), so everything runs offline
+against locally generated keys (see tests.fakes.FakeFirebaseIssuer).
+google.auth is imported on first verification to keep worker startup light.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+ISSUER_PREFIX = "https://securetoken.google.com/"
+
+
+class AuthError(Exception):
+    """Token rejected (malformed, bad signature, expired, wrong project) or certificates unavailable."""
+
+
+def fetch_google_certs(url=CERTS_URL, timeout=5):
+    """Returns ({key_id: PEM certificate}, max_age_seconds) from Google's certificate endpoint."""
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    match = re.search(r"max-age=(\d+)", response.headers.get("Cache-Control", ""))
+    max_age = int(match.group(1)) if match else 3600
+    max_age -= int(response.headers.get("Age", 0) or 0) # Time already spent in an intermediate cache
+    return response.json(), max(0, max_age)
+
+
+class CertCache:
+    def __init__(self, fetch=fetch_google_certs, refresh_margin=300, retry_interval=30, unknown_kid_interval=5):
+        self.fetch = fetch # () -> ({kid: pem}, max_age)
+        self.refresh_margin = refresh_margin # Refresh in the background this long before expiry
+        self.retry_interval = retry_interval # After a failed fetch, serve stale certs this long before retrying
+        self.unknown_kid_interval = unknown_kid_interval
+        self._certs = {}
+        self._expires_at = 0.0
+        self._next_attempt = 0.0
+        self._last_fetch = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.fetches = 0
+        self.fetch_errors = 0
+
+    def get(self):
+        """Current {kid: pem}; only blocks on the network when nothing usable is cached."""
+        now = time.time()
+        if self._certs and now < self._expires_at - self.refresh_margin: return self._certs
+        if self._certs and (now < self._expires_at or now < self._next_attempt):
+            self._refresh_in_background()
+            return self._certs # Still valid (or stale after a failed refresh): keep serving
+        return self.refresh()
+
+    def get_for(self, kid):
+        """Certificates including `kid`, refetching (rate-limited) if the key is new to us."""
+        certs = self.get()
+        if kid in certs or time.time() - self._last_fetch < self.unknown_kid_interval: return certs
+        return self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            if self._certs and time.time() - self._last_fetch < 1: return self._certs # Another thread just did it
+            try:
+                certs, max_age = self.fetch()
+            except Exception as e:
+                self.fetch_errors += 1
+                self._next_attempt = time.time() + self.retry_interval
+                if not self._certs: raise AuthError(f"Signing certificates unavailable: {e}")
+                logger.warning("Firebase certificate refresh failed, using cached certificates: %s", e)
+                return self._certs
+            now = time.time()
+            self._certs, self._expires_at, self._last_fetch = dict(certs), now + max_age, now
+            self.fetches += 1
+            return self._certs
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.time() < self._next_attempt: return
+            self._refreshing = True
+        def run():
+            try: self.refresh()
+            except AuthError: pass
+            finally: self._refreshing = False
+        threading.Thread(target=run, name="firebase-certs", daemon=True).start()
+
+
+class TokenVerifier:
+    def __init__(self, project_id, certs=None, max_entries=10000, clock_skew=10):
+        self.project_id = project_id
+        self.certs = certs or CertCache()
+        self.max_entries = max_entries
+        self.clock_skew = clock_skew
+        self._cache = OrderedDict() # sha256(token) -> (exp, claims)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+
+    def verify(self, token):
+        """Returns the token's claims (plus "uid") or raises AuthError."""
+        key = hashlib.sha256(token.encode("utf-8")).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None: del self._cache[key]
+            self.misses += 1
+        try:
+            claims = self._verify(token, now)
+        except AuthError:
+            self.rejected += 1
+            raise
+        with self._lock:
+            self._cache[key] = (claims["exp"], claims)
+            while len(self._cache) > self.max_entries: self._cache.popitem(last=False)
+        return claims
+
+    def _verify(self, token, now):
+        from google.auth import exceptions as google_auth_exceptions, jwt as google_jwt
+        try:
+            header = google_jwt.decode_header(token)
+        except (ValueError, TypeError) as e:
+            raise AuthError(f"Malformed token: {e}")
+        if header.get("alg") != "RS256": raise AuthError(f"Unexpected algorithm {header.get('alg')!r}")
+        kid = header.get("kid")
+        cert = self.certs.get_for(kid).get(kid) if kid else None
+        if cert is None: raise AuthError("Token signed with an unknown key")
+        try:
+            claims = google_jwt.decode(token, certs=cert, audience=self.project_id, clock_skew_in_seconds=self.clock_skew)
+        except (ValueError, google_auth_exceptions.GoogleAuthError) as e:
+            raise AuthError(str(e))
+        if claims.get("iss") != ISSUER_PREFIX + self.project_id: raise AuthError("Wrong issuer")
+        subject = claims.get("sub")
+        if not isinstance(subject, str) or not subject or len(subject) > 128: raise AuthError("Invalid subject")
+        if claims.get("auth_time", 0) > now + self.clock_skew: raise AuthError("auth_time in the future")
+        claims["uid"] = subject
+        return claims
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "rejected": self.rejected, "entries": len(self._cache),
+                "cert_fetches": self.certs.fetches, "cert_fetch_errors": self.certs.fetch_errors}
+
+
+def verifier_from_env(environ, fetch=None):
+    """Builds the verifier configured by FIREBASE_* env vars (None while auth is disabled)."""
+    if environ.get("FIREBASE_AUTH_ENABLED", "false").lower() not in ("true", "1", "t"):
+        return None
+    project_id = environ.get("FIREBASE_PROJECT_ID") or environ.get("GOOGLE_CLOUD_PROJECT")
+    if not project_id: raise ValueError("FIREBASE_AUTH_ENABLED needs FIREBASE_PROJECT_ID")
+    return TokenVerifier(project_id, CertCache(fetch or fetch_google_certs),
+                         max_entries=int(environ.get("FIREBASE_TOKEN_CACHE_SIZE", 10000)),
+                         clock_skew=int(environ.get("FIREBASE_CLOCK_SKEW", 10)))
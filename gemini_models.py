@@ -0,0 +1,87 @@
+"""Lazily configured Gemini models.
+
+Importing google.generativeai (generated protobuf types for the whole API) is
+most of a worker's import time, so app.py never imports it directly: the SDK
+is imported and configured, and models are built, on first use. warm() does
+the same ahead of time; gunicorn's post_worker_init hook runs it in a
+background thread so a fresh worker is usually warm before its first Gemini
+request, and /readyz reports when it is.
+
+`build` replaces model construction entirely (the bench harness passes its
+fake model), in which case the SDK is never imported.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiModels:
+    def __init__(self, api_key, default_model, transport=None, build=None):
+        self.api_key = api_key
+        self.default_model = default_model
+        self.transport = transport
+        self._build = build
+        self._models = {} # model name -> GenerativeModel
+        self._genai = None
+        self._lock = threading.Lock()
+        self._warm_pid = None
+        self.error = None # Set if the SDK couldn't be configured; models stay unavailable
+        self.warm_seconds = None # Time the first get() spent importing/configuring
+
+    def _sdk(self):
+        if self._genai is None and self.error is None:
+            started = time.perf_counter()
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key, transport=self.transport)
+            except Exception as e:
+                logger.error("Gemini SDK configuration failed: %s", e)
+                self.error = str(e)
+                return None
+            self._genai = genai
+            logger.info("Gemini SDK configured (transport %s) in %.2fs", self.transport or "default", time.perf_counter() - started)
+        return self._genai
+
+    def get(self, name=None):
+        """Model object for `name` (the default model if None); None if it can't be built."""
+        name = name or self.default_model
+        model = self._models.get(name)
+        if model is not None: return model
+        with self._lock:
+            if name in self._models: return self._models[name]
+            started = time.perf_counter()
+            if self._build is not None:
+                model = self._build(name)
+            else:
+                genai = self._sdk()
+                if genai is None: return None
+                model = genai.GenerativeModel(name)
+            self._models[name] = model
+            if self.warm_seconds is None: self.warm_seconds = time.perf_counter() - started
+        return model
+
+    @property
+    def ready(self):
+        return self.default_model in self._models
+
+    def warm(self):
+        return self.get() is not None
+
+    def warm_async(self):
+        """Warms this process's default model in a background thread (once per process)."""
+        if self.ready or self._warm_pid == os.getpid(): return
+        self._warm_pid = os.getpid()
+        threading.Thread(target=self.warm, name="gemini-warm", daemon=True).start()
+
+    def status(self):
+        return {"ready": self.ready, "error": self.error, "models": sorted(self._models),
+                "warm_seconds": None if self.warm_seconds is None else round(self.warm_seconds, 3)}
+
+
+def models_from_env(environ, api_key, default_model, build=None):
+    """GeminiModels for GEMINI_TRANSPORT (None without an API key)."""
+    if not api_key and build is None: return None
+    return GeminiModels(api_key, default_model, transport=environ.get("GEMINI_TRANSPORT") or None, build=build)
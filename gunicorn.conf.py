@@ -0,0 +1,71 @@
+"""Gunicorn settings for adai.
+
+Gunicorn loads this file automatically when started from the repo root
+(`gunicorn app:app`), so the start command doesn't need any flags.
+
+Serving modes (SERVING_MODE env var):
+  gevent  - default when gevent is installed. Each worker runs one greenlet per
+            request, so hundreds of Gemini/ElevenLabs calls can be in flight per
+            process while they wait on the network. The Gemini SDK is switched
+            to its REST transport so its I/O goes through monkey-patched sockets.
+  gthread - a thread pool per worker (GUNICORN_THREADS, default 32). No extra
+            dependency; the fallback when gevent isn't installed.
+  sync    - one request per worker, the old behaviour.
+"""
+import importlib.util
+import multiprocessing
+import os
+import sys
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+_default_mode = "gevent" if importlib.util.find_spec("gevent") else "gthread"
+SERVING_MODE = os.environ.get("SERVING_MODE", _default_mode).lower()
+
+# I/O-bound workers need far fewer processes than CPU cores * 2 + 1
+workers = int(os.environ.get("WEB_CONCURRENCY", min(4, multiprocessing.cpu_count() + 1)))
+
+if SERVING_MODE == "gevent":
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+    # gRPC isn't gevent-aware; REST goes through requests, which gevent patches.
+    os.environ.setdefault("GEMINI_TRANSPORT", "rest")
+elif SERVING_MODE == "gthread":
+    worker_class = "gthread"
+    threads = int(os.environ.get("GUNICORN_THREADS", 32))
+else:
+    worker_class = "sync"
+
+# Essays and long TTS calls can legitimately take a while; streamed responses
+# keep the connection open for the whole generation.
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+# Workers write metric snapshots here so /metrics can aggregate all of them.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"adai-metrics-{bind.rsplit(':', 1)[-1]}"))
+
+accesslog = "-" if os.environ.get("GUNICORN_ACCESS_LOG", "false").lower() in ("true", "1", "t") else None
+errorlog = "-"
+
+
+def on_starting(server):
+    # Worker snapshots from a previous run would inflate the merged counters
+    metrics_dir = os.environ["METRICS_DIR"]
+    if os.path.isdir(metrics_dir):
+        for name in os.listdir(metrics_dir):
+            if name.endswith((".json", ".tmp")): os.remove(os.path.join(metrics_dir, name))
+
+
+def post_worker_init(worker):
+    # app.py defers the Gemini SDK import (most of its import time) to first use;
+    # start it now in the background so the worker is warm by its first request.
+    # (No preload_app: several stores open SQLite connections at import, which
+    # must not be shared across forked workers.)
+    app_module = sys.modules.get("app")
+    if app_module is not None and hasattr(app_module, "warm_clients"): app_module.warm_clients()
+
+
+def when_ready(server):
+    server.log.info(f"adai serving mode: {worker_class} ({workers} workers)")
@@ -0,0 +1,213 @@
+"""Image preprocessing for /api/identify-objects.
+
+Uploads arrive as multipart form data, a raw image body, or the original
+base64 JSON. They are size-checked before being read, decoded at reduced
+scale where the format allows it (JPEG draft mode), downscaled to a maximum
+dimension and recompressed as JPEG, so Gemini gets a small upload no matter
+how large the phone photo was.
+
+A 64-bit difference hash (dHash) of each image indexes a near-duplicate
+cache: re-uploads, re-encodes and slightly cropped or resized copies of an
+image within a Hamming distance threshold reuse the earlier description.
+
+Pillow is optional; without it images are forwarded unchanged and only exact
+duplicates are recognised.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pass-through mode: no resizing, exact-duplicate cache only
+    Image = None
+
+ALLOWED_MIME_TYPES = {"image/png", "image/jpeg", "image/jpg", "image/webp"}
+_READ_CHUNK = 64 * 1024
+
+
+class ImageRejected(Exception):
+    """Upload that can't be processed; carries the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+class PreparedImage:
+    def __init__(self, data, mime_type, image_hash, original_bytes, size=None):
+        self.data = data
+        self.mime_type = mime_type
+        self.image_hash = image_hash # dHash as int (Pillow) or a sha256 hex string (pass-through)
+        self.original_bytes = original_bytes
+        self.size = size
+
+
+# --- Reading Uploads ---
+def read_upload(request, max_bytes):
+    """Returns (raw_bytes, mime_type) from a multipart, raw-binary or base64 JSON request.
+
+    Rejects oversized requests from Content-Length before reading the body,
+    and never reads more than max_bytes (+ base64 overhead) of a body.
+    """
+    content_type = (request.mimetype or "").lower()
+    limit = max_bytes * 4 // 3 + 4096 if content_type == "application/json" else max_bytes + 64 * 1024
+    if request.content_length is not None and request.content_length > limit:
+        raise ImageRejected(f"Image too large (max {max_bytes // (1024 * 1024)} MB)", 413)
+
+    if content_type == "multipart/form-data":
+        upload = request.files.get("image")
+        if upload is None: raise ImageRejected("Missing 'image' file field")
+        return _read_bounded(upload.stream, max_bytes), (upload.mimetype or "").lower()
+    if content_type.startswith("image/"):
+        return _read_bounded(request.stream, max_bytes), content_type
+
+    data = request.get_json(silent=True)
+    if not data: raise ImageRejected("Invalid JSON payload")
+    base64_image_data, mime_type = data.get("image_data"), data.get("mime_type")
+    if not base64_image_data or not mime_type or not isinstance(base64_image_data, str):
+        raise ImageRejected("Missing image_data or mime_type")
+    if base64_image_data.startswith("data:"): base64_image_data = base64_image_data.partition(",")[2] # Tolerate data URLs
+    try:
+        raw = base64.b64decode(base64_image_data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImageRejected("image_data is not valid base64")
+    if len(raw) > max_bytes: raise ImageRejected(f"Image too large (max {max_bytes // (1024 * 1024)} MB)", 413)
+    return raw, str(mime_type).lower()
+
+
+def _read_bounded(stream, max_bytes):
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(_READ_CHUNK)
+        if not chunk: break
+        buffer.write(chunk)
+        if buffer.tell() > max_bytes: raise ImageRejected(f"Image too large (max {max_bytes // (1024 * 1024)} MB)", 413)
+    if not buffer.tell(): raise ImageRejected("Empty image upload")
+    return buffer.getvalue()
+
+
+# --- Preprocessing ---
+def prepare_image(raw, mime_type, max_dimension=1024, quality=80, max_pixels=40_000_000):
+    """Downscales/recompresses an upload; returns a PreparedImage."""
+    mime_type = "image/jpeg" if mime_type == "image/jpg" else mime_type
+    if mime_type not in ALLOWED_MIME_TYPES: raise ImageRejected(f"Unsupported image type: {mime_type}", 415)
+    if Image is None:
+        return PreparedImage(raw, mime_type, hashlib.sha256(raw).hexdigest(), len(raw))
+
+    try:
+        image = Image.open(io.BytesIO(raw))
+        original_size = image.size
+        if image.width * image.height > max_pixels: # Checked from the header, before decoding any pixels
+            raise ImageRejected("Image dimensions too large", 413)
+        image.draft("RGB", (max_dimension, max_dimension)) # JPEG: decode at 1/2, 1/4 or 1/8 scale directly
+        image = ImageOps.exif_transpose(image)
+        image_hash = dhash(image)
+        if image.mode in ("RGBA", "LA", "P"): # Flatten transparency onto white for JPEG
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS, reducing_gap=3.0)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True, progressive=True)
+    except ImageRejected:
+        raise
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageRejected(f"Could not decode image ({type(e).__name__})", 422)
+
+    data = output.getvalue()
+    if mime_type == "image/jpeg" and max(original_size) <= max_dimension and len(raw) <= len(data):
+        return PreparedImage(raw, mime_type, image_hash, len(raw), original_size) # Recompressing would only lose quality
+    return PreparedImage(data, "image/jpeg", image_hash, len(raw), image.size)
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash: brightness gradients of a 9x8 grayscale thumbnail."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            value = (value << 1) | (left > pixels[row * (hash_size + 1) + col + 1])
+    return value
+
+
+# --- Near-Duplicate Cache ---
+class NearDuplicateCache:
+    """Maps image hashes to descriptions, matching hashes within max_distance bits.
+
+    dHashes are split into 8 bytes; by the pigeonhole principle two hashes
+    within 7 bits of each other share at least one byte, so lookups only
+    compare against entries in the 8 matching buckets. Pass-through (string)
+    hashes only match exactly.
+    """
+    _BANDS = 8
+
+    def __init__(self, max_entries=5000, ttl=24 * 3600, max_distance=6):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = min(max_distance, self._BANDS - 1)
+        self._entries = OrderedDict() # hash -> (expires_at, description)
+        self._bands = [dict() for _ in range(self._BANDS)] # byte value -> set of hashes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _band_keys(self, image_hash):
+        return [(image_hash >> (8 * band)) & 0xFF for band in range(self._BANDS)]
+
+    def get(self, image_hash):
+        now = time.time()
+        with self._lock:
+            match = image_hash if image_hash in self._entries else None
+            if match is None and isinstance(image_hash, int):
+                candidates = set()
+                for band, key in enumerate(self._band_keys(image_hash)):
+                    candidates |= self._bands[band].get(key, set())
+                best = min(candidates, key=lambda other: bin(other ^ image_hash).count("1"), default=None)
+                if best is not None and bin(best ^ image_hash).count("1") <= self.max_distance: match = best
+            if match is None or self._entries[match][0] < now:
+                if match is not None: self._remove(match)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(match)
+            if match == image_hash: self.hits += 1
+            else: self.near_hits += 1
+            return self._entries[match][1]
+
+    def set(self, image_hash, description):
+        with self._lock:
+            if image_hash in self._entries: self._remove(image_hash)
+            self._entries[image_hash] = (time.time() + self.ttl, description)
+            if isinstance(image_hash, int):
+                for band, key in enumerate(self._band_keys(image_hash)):
+                    self._bands[band].setdefault(key, set()).add(image_hash)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, image_hash):
+        self._entries.pop(image_hash, None)
+        if isinstance(image_hash, int):
+            for band, key in enumerate(self._band_keys(image_hash)):
+                bucket = self._bands[band].get(key)
+                if bucket is not None:
+                    bucket.discard(image_hash)
+                    if not bucket: del self._bands[band][key]
+
+    def stats(self):
+        return {"hits": self.hits, "near_hits": self.near_hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+def hash_key(image_hash):
+    """String form of an image hash, for keys in the shared response cache."""
+    return f"{image_hash:016x}" if isinstance(image_hash, int) else image_hash
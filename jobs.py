@@ -0,0 +1,245 @@
+"""Durable background jobs for long generations (essays, long summaries, TTS).
+
+Jobs are rows in a SQLite file shared by every worker process on the host, so
+a job submitted to one worker can be run by any other and polled from any
+other. Each process runs a few worker threads that claim the next queued job
+(lowest priority value first, then oldest) under a lease, renewed every third
+of lease_seconds while the handler runs; if a process dies mid-job the lease
+expires and another worker picks the job up again, up to max_attempts. Only
+the attempt holding the lease can finish the job. Finished jobs keep their
+result for result_ttl seconds; a sweeper thread deletes them after that.
+on_finish callbacks (webhooks) run on their own threads, so a slow endpoint
+doesn't hold up the queue.
+
+Handlers are plain callables registered per job kind: handler(payload) returns
+a JSON-serializable dict, with an "error" key if the job failed.
+"""
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+TERMINAL = (DONE, FAILED)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    def __init__(self, path, workers=2, lease_seconds=300, result_ttl=3600, max_attempts=2, max_queued=1000,
+                 poll_interval=0.5, on_finish=None, sweep_interval=60, notify_workers=4):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.result_ttl = result_ttl
+        self.max_attempts = max_attempts
+        self.max_queued = max_queued
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.on_finish = on_finish # Called with the finished job dict (webhooks), on a notifier thread
+        self._notifier = ThreadPoolExecutor(max_workers=notify_workers, thread_name_prefix="job-notify") # Threads start on first use
+        self._handlers = {} # kind -> (handler, priority)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._workers_pid = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, priority INTEGER NOT NULL,
+                              owner TEXT, payload TEXT NOT NULL, callback_url TEXT, status TEXT NOT NULL, result TEXT,
+                              attempts INTEGER NOT NULL DEFAULT 0, lease_until REAL NOT NULL DEFAULT 0,
+                              created_at REAL NOT NULL, started_at REAL, finished_at REAL)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_next ON jobs(status, priority, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs(finished_at)")
+
+    def register(self, kind, handler, priority=0):
+        self._handlers[kind] = (handler, priority)
+
+    # --- Clients ---
+    def submit(self, kind, payload, owner=None, callback_url=None):
+        """Queues a job and returns its id; raises QueueFull past max_queued."""
+        if kind not in self._handlers: raise ValueError(f"Unknown job kind: {kind}")
+        job_id = secrets.token_urlsafe(12)
+        with self._lock:
+            queued = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)).fetchone()[0]
+            if queued >= self.max_queued: raise QueueFull(f"{queued} jobs pending")
+            self._conn.execute("""INSERT INTO jobs (id, kind, priority, owner, payload, callback_url, status, created_at)
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                               (job_id, kind, self._handlers[kind][1], owner, json.dumps(payload), callback_url, QUEUED, time.time()))
+        self.ensure_workers()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("""SELECT id, kind, owner, status, result, attempts, created_at, started_at, finished_at
+                                        FROM jobs WHERE id = ?""", (job_id,)).fetchone()
+        if row is None: return None
+        job = dict(zip(("job_id", "kind", "owner", "status", "result", "attempts", "created_at", "started_at", "finished_at"), row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        if job["status"] == RUNNING and job["attempts"] > 1: job["retrying"] = True
+        return job
+
+    # --- Workers ---
+    def ensure_workers(self):
+        """Starts this process's worker threads (cheap to call per request).
+
+        Started lazily so they run in each forked worker rather than the master.
+        """
+        if self.workers <= 0 or self._workers_pid == os.getpid(): return
+        with self._lock:
+            if self._workers_pid == os.getpid(): return
+            self._workers_pid = os.getpid()
+        for index in range(self.workers):
+            threading.Thread(target=self._work_loop, name=f"job-worker-{index}", daemon=True).start()
+        threading.Thread(target=self._sweep_loop, name="job-sweeper", daemon=True).start()
+
+    def _work_loop(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is not None:
+                    self._run(*job)
+                    continue
+            except Exception as e:
+                logger.exception("job worker error: %s", e)
+            self._wakeup.wait(self.poll_interval) # Local submits wake us at once; others' are seen by polling
+            self._wakeup.clear()
+
+    def _sweep_loop(self):
+        while True:
+            try: self._sweep()
+            except Exception as e: logger.exception("job sweep error: %s", e)
+            time.sleep(self.sweep_interval)
+
+    def _claim(self):
+        """Atomically takes the next runnable job: queued, or running with an expired lease."""
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("""SELECT id, kind, payload, attempts FROM jobs
+                                      WHERE status = ? OR (status = ? AND lease_until < ?)
+                                      ORDER BY priority, created_at LIMIT 1""", (QUEUED, RUNNING, now)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, started_at = ? WHERE id = ?",
+                                 (RUNNING, now + self.lease_seconds, now, row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None: return None
+        job_id, kind, payload, attempts = row
+        attempt = attempts + 1 # This claim's attempt number; identifies the lease holder
+        if attempt > self.max_attempts: # Previous attempts died with their process
+            self._finish(job_id, attempt, FAILED, {"error": "Job failed repeatedly; please try again."})
+            return None
+        return job_id, attempt, kind, json.loads(payload)
+
+    def _run(self, job_id, attempt, kind, payload):
+        handler = self._handlers.get(kind, (None, 0))[0]
+        stop_heartbeat = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job_id, attempt, stop_heartbeat), name="job-heartbeat", daemon=True).start()
+        try:
+            if handler is None: raise ValueError(f"No handler for job kind {kind}")
+            result = handler(payload)
+        except Exception as e:
+            logger.warning("job %s (%s) raised %s: %s", job_id, kind, type(e).__name__, e)
+            if attempt < self.max_attempts:
+                with self._lock:
+                    requeued = self._conn.execute("UPDATE jobs SET status = ?, lease_until = 0 WHERE id = ? AND status = ? AND attempts = ?",
+                                                  (QUEUED, job_id, RUNNING, attempt)).rowcount
+                    if requeued: self.retried += 1
+                return
+            result = {"error": "Job failed unexpectedly."}
+        finally:
+            stop_heartbeat.set()
+        self._finish(job_id, attempt, FAILED if "error" in result else DONE, result)
+
+    def _heartbeat(self, job_id, attempt, stop):
+        """Extends the lease while attempt `attempt` runs, so long handlers aren't re-claimed by other workers."""
+        while not stop.wait(self.lease_seconds / 3):
+            with self._lock:
+                renewed = self._conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND attempts = ?",
+                                             (time.time() + self.lease_seconds, job_id, RUNNING, attempt)).rowcount
+            if not renewed: return # Finished, or the lease was lost to another worker
+
+    def _finish(self, job_id, attempt, status, result):
+        with self._lock:
+            updated = self._conn.execute("""UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_until = 0
+                                            WHERE id = ? AND status = ? AND attempts = ?""",
+                                         (status, json.dumps(result), time.time(), job_id, RUNNING, attempt)).rowcount
+            if not updated: # Another attempt holds the job now; its result counts
+                logger.warning("job %s: attempt %d lost its lease, result dropped", job_id, attempt)
+                return
+            if status == DONE: self.completed += 1
+            else: self.failed += 1
+        if self.on_finish is not None: self._notifier.submit(self._notify, job_id)
+
+    def _notify(self, job_id):
+        try: self.on_finish(self.get(job_id))
+        except Exception as e: logger.warning("job %s on_finish failed: %s", job_id, e)
+
+    def _sweep(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - self.result_ttl,))
+
+    def callback_url(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT callback_url FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"completed": self.completed, "failed": self.failed, "retried": self.retried,
+                "queued": counts.get(QUEUED, 0), "running": counts.get(RUNNING, 0)}
+
+
+# --- Webhooks ---
+def webhook_allowed(url, allowed_hosts):
+    """Only https URLs on explicitly allowed hosts (keeps callbacks from probing the internal network)."""
+    parts = urlsplit(url or "")
+    return parts.scheme == "https" and (parts.hostname or "").lower() in allowed_hosts
+
+
+def deliver_webhook(url, job, timeout=5, attempts=2):
+    """POSTs the finished job as JSON; retries once on network errors or 5xx."""
+    body = {key: job[key] for key in ("job_id", "kind", "status", "result", "finished_at")}
+    for attempt in range(attempts):
+        try:
+            response = requests.post(url, json=body, timeout=timeout)
+            if response.status_code < 500: return response.status_code
+        except requests.exceptions.RequestException as e:
+            logger.warning("webhook for job %s failed: %s", job["job_id"], e)
+        time.sleep(1 + attempt)
+    return None
+
+
+def queue_from_env(environ, on_finish=None):
+    """Builds the queue configured by JOBS_* env vars (None if disabled)."""
+    if environ.get("JOBS_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    path = environ.get("JOBS_DB") or os.path.join(tempfile.gettempdir(), "adai-jobs.sqlite3")
+    return JobQueue(path, workers=int(environ.get("JOBS_WORKERS", 2)),
+                    lease_seconds=float(environ.get("JOBS_LEASE_SECONDS", 300)),
+                    result_ttl=float(environ.get("JOBS_RESULT_TTL", 3600)),
+                    max_attempts=int(environ.get("JOBS_MAX_ATTEMPTS", 2)),
+                    max_queued=int(environ.get("JOBS_MAX_QUEUED", 1000)),
+                    sweep_interval=float(environ.get("JOBS_SWEEP_INTERVAL", 60)),
+                    on_finish=on_finish)
@@ -0,0 +1,163 @@
+"""Local store of structured dictionary entries, with prefix search for autocomplete.
+
+Every entry Gemini produces for /api/dictionary is kept here (keyed by the
+lowercased headword) and served locally from then on; the store can also be
+bulk-seeded from a JSON Lines file of {"word": ..., "entry": {...}} objects.
+Lookups are a primary-key read in a SQLite file shared by the workers on a
+host.
+
+suggest() answers prefix queries: headwords by their B-tree index, most looked
+up first, then (when SQLite has FTS5) entries whose Turkish meaning starts
+with the prefix, so a learner can also type the Turkish word. Entries for
+words Gemini reported as not found are kept to answer repeat typos, but never
+suggested.
+"""
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_WORD_CHARS = 64
+
+
+def _key(word):
+    return word.strip().lower()
+
+
+class Lexicon:
+    def __init__(self, path=":memory:", validate=None):
+        self.validate = validate # entry -> bool; seeded entries failing it are skipped
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.suggestions = 0
+        if path != ":memory:": os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS lexicon (key TEXT PRIMARY KEY, word TEXT NOT NULL, entry TEXT NOT NULL,
+                              found INTEGER NOT NULL, turkish TEXT NOT NULL DEFAULT '', source TEXT NOT NULL,
+                              lookups INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)""")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS lexicon_seeds (path TEXT PRIMARY KEY, signature TEXT NOT NULL)")
+        try:
+            self._conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS lexicon_fts USING fts5(turkish, content='lexicon', content_rowid='rowid',
+                                  tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+            self.full_text = True
+        except sqlite3.OperationalError: # SQLite built without FTS5: headword prefixes only
+            self.full_text = False
+
+    def get(self, word):
+        """The stored entry for `word` (a dict, possibly {"found": False, ...}) or None."""
+        key = _key(word)
+        with self._lock:
+            row = self._conn.execute("SELECT entry FROM lexicon WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE lexicon SET lookups = lookups + 1 WHERE key = ?", (key,))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def add(self, word, entry, source="gemini"):
+        """Stores (or replaces) the entry for `word`."""
+        if not word.strip() or len(word) > MAX_WORD_CHARS: return
+        with self._lock:
+            self._upsert(word.strip(), entry, source, replace=True)
+            self.stores += 1
+
+    def _upsert(self, word, entry, source, replace):
+        key, found = _key(word), bool(entry.get("found") and entry.get("definitions"))
+        turkish = entry.get("turkish_meaning", "").strip() if found else ""
+        previous = self._conn.execute("SELECT rowid, turkish FROM lexicon WHERE key = ?", (key,)).fetchone()
+        if previous is not None and not replace: return False
+        own_transaction = not self._conn.in_transaction # seed_file imports in one transaction
+        if own_transaction: self._conn.execute("BEGIN")
+        try:
+            if previous is not None:
+                if self.full_text and previous[1]: self._conn.execute("INSERT INTO lexicon_fts(lexicon_fts, rowid, turkish) VALUES ('delete', ?, ?)", previous)
+                self._conn.execute("UPDATE lexicon SET word = ?, entry = ?, found = ?, turkish = ?, source = ?, updated_at = ? WHERE rowid = ?",
+                                   (word, json.dumps(entry), int(found), turkish, source, time.time(), previous[0]))
+                rowid = previous[0]
+            else:
+                rowid = self._conn.execute("INSERT INTO lexicon (key, word, entry, found, turkish, source, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                           (key, word, json.dumps(entry), int(found), turkish, source, time.time())).lastrowid
+            if self.full_text and turkish: self._conn.execute("INSERT INTO lexicon_fts(rowid, turkish) VALUES (?, ?)", (rowid, turkish))
+            if own_transaction: self._conn.execute("COMMIT")
+        except Exception:
+            if own_transaction: self._conn.execute("ROLLBACK")
+            raise
+        return True
+
+    def seed_file(self, path):
+        """Imports a JSON Lines file of {"word", "entry"} without replacing existing entries; skipped if unchanged since the last import."""
+        stat = os.stat(path)
+        signature = f"{stat.st_size}:{int(stat.st_mtime)}"
+        with self._lock:
+            row = self._conn.execute("SELECT signature FROM lexicon_seeds WHERE path = ?", (os.path.abspath(path),)).fetchone()
+            if row is not None and row[0] == signature: return 0
+        added = skipped = 0
+        with open(path, encoding="utf-8") as f, self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for line in f:
+                    try:
+                        item = json.loads(line)
+                        word, entry = item["word"], item["entry"]
+                    except (ValueError, KeyError, TypeError):
+                        skipped += 1
+                        continue
+                    if not isinstance(word, str) or not word.strip() or len(word) > MAX_WORD_CHARS or not isinstance(entry, dict) \
+                            or (self.validate is not None and not self.validate(entry)):
+                        skipped += 1
+                        continue
+                    if self._upsert(word.strip(), entry, "seed", replace=False): added += 1
+                self._conn.execute("INSERT OR REPLACE INTO lexicon_seeds (path, signature) VALUES (?, ?)", (os.path.abspath(path), signature))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if skipped: logger.warning("Lexicon seed %s: skipped %d invalid lines", path, skipped)
+        logger.info("Lexicon seed %s: added %d entries", path, added)
+        return added
+
+    def suggest(self, prefix, limit=8):
+        """Up to `limit` found words starting with `prefix` (or whose Turkish meaning does): [{"word", "turkish_meaning"}]."""
+        prefix = _key(prefix)[:MAX_WORD_CHARS]
+        if not prefix: return []
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        with self._lock:
+            self.suggestions += 1
+            rows = self._conn.execute("""SELECT word, turkish FROM lexicon WHERE key >= ? AND key < ? AND found = 1
+                                         ORDER BY lookups DESC, key LIMIT ?""", (prefix, upper, limit)).fetchall()
+            if self.full_text and len(rows) < limit:
+                seen = {word for word, _ in rows}
+                query = 'turkish : "' + prefix.replace('"', '""') + '"*'
+                try:
+                    more = self._conn.execute("""SELECT l.word, l.turkish FROM lexicon_fts JOIN lexicon l ON l.rowid = lexicon_fts.rowid
+                                                 WHERE lexicon_fts MATCH ? AND l.found = 1 ORDER BY l.lookups DESC LIMIT ?""", (query, limit)).fetchall()
+                except sqlite3.OperationalError: # Prefix FTS5 can't parse (punctuation only, ...)
+                    more = []
+                rows += [row for row in more if row[0] not in seen][:limit - len(rows)]
+        return [{"word": word, "turkish_meaning": turkish} for word, turkish in rows]
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM lexicon").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "suggestions": self.suggestions, "entries": entries}
+
+
+def lexicon_from_env(environ, validate=None):
+    """Builds the lexicon configured by LEXICON_* env vars (None if disabled), importing LEXICON_SEED_FILE if set."""
+    if environ.get("LEXICON_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    path = environ.get("LEXICON_DB") or os.path.join(tempfile.gettempdir(), "adai-lexicon.sqlite3")
+    lexicon = Lexicon(path, validate=validate)
+    seed_path = environ.get("LEXICON_SEED_FILE")
+    if seed_path: lexicon.seed_file(seed_path)
+    return lexicon
@@ -0,0 +1,72 @@
+"""Leveled, structured, sampled logging.
+
+configure_logging() sets up the root logger once per process: LOG_LEVEL picks
+the level and LOG_FORMAT picks JSON lines (default) or plain text. EventLogger
+logs an event name plus key/value fields; routine per-request events can be
+marked `sample=True` and are then only emitted for a LOG_SAMPLE_RATE fraction
+of calls. Warnings and errors are never sampled.
+"""
+import json
+import logging
+import random
+import sys
+import time
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"ts": round(record.created, 3), "level": record.levelname.lower(), "logger": record.name,
+                 "event": record.getMessage()}
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", None) or {}
+        line = f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.name}: {record.getMessage()}"
+        if fields: line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info: line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class EventLogger:
+    """Thin wrapper over a stdlib logger: log.info("event", key=value, ...).
+
+    `context` (optional) returns extra fields added to every record, e.g. the
+    current request id.
+    """
+
+    def __init__(self, name, sample_rate=1.0, context=None):
+        self._logger = logging.getLogger(name)
+        self.sample_rate = sample_rate
+        self._context = context
+
+    def _log(self, level, event, sample, exc_info, fields):
+        if not self._logger.isEnabledFor(level): return
+        if sample and level < logging.WARNING and random.random() >= self.sample_rate: return
+        if self._context is not None:
+            try: fields = {**self._context(), **fields}
+            except Exception: pass
+        self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, sample=False, **fields): self._log(logging.DEBUG, event, sample, None, fields)
+    def info(self, event, sample=False, **fields): self._log(logging.INFO, event, sample, None, fields)
+    def warning(self, event, **fields): self._log(logging.WARNING, event, False, None, fields)
+    def error(self, event, exc_info=None, **fields): self._log(logging.ERROR, event, False, exc_info, fields)
+
+
+def configure_logging(environ):
+    """Installs the configured handler on the root logger (idempotent)."""
+    root = logging.getLogger()
+    if getattr(root, "_adai_configured", False): return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(TextFormatter() if environ.get("LOG_FORMAT", "json").lower() == "text" else JsonFormatter())
+    root.handlers = [handler]
+    root.setLevel(environ.get("LOG_LEVEL", "INFO").upper())
+    root._adai_configured = True
+
+
+def sample_rate_from_env(environ):
+    return min(1.0, max(0.0, float(environ.get("LOG_SAMPLE_RATE", 1.0))))
@@ -0,0 +1,245 @@
+"""Minimal Prometheus-style metrics that work across gunicorn workers.
+
+Each worker keeps counters, gauges and histograms in memory. With a metrics
+directory configured (gunicorn.conf.py sets one up), a background thread in
+each worker writes a snapshot to <dir>/<pid>.json every flush_interval
+seconds, and /metrics merges every snapshot into one Prometheus text
+exposition: counters and histograms are summed over all workers (including
+ones that have exited, so totals never go backwards), gauges only over
+workers that are still alive.
+
+Components that already keep their own stats() (caches, breaker, ...) are
+exported through collectors: callables run at snapshot time that copy their
+values into metrics.
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self._registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {} # label values tuple -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._registry._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Mirrors a cumulative count kept elsewhere (e.g. a component's stats())."""
+        key = self._key(labels)
+        with self._registry._lock: self._values[key] = value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._registry._lock: self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._registry._lock: self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._registry._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["buckets"][bisect.bisect_left(self.buckets, value)] += 1 # Last slot is +Inf
+            state["sum"] += value
+            state["count"] += 1
+
+
+class Registry:
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        if directory: os.makedirs(directory, exist_ok=True)
+
+    def _register(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None: return existing # Idempotent, e.g. on module reload
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Registers a callable run before every snapshot (typically to set gauges)."""
+        self._collectors.append(collector)
+
+    # --- Snapshots ---
+    def _collect(self):
+        for collector in self._collectors:
+            try: collector()
+            except Exception: pass # A broken collector must not break /metrics
+
+    def snapshot(self):
+        self._collect()
+        with self._lock:
+            return {name: {"kind": metric.kind, "help": metric.documentation, "labelnames": list(metric.labelnames),
+                           "buckets": list(getattr(metric, "buckets", ())),
+                           "values": [[list(key), json.loads(json.dumps(value))] for key, value in metric._values.items()]}
+                    for name, metric in self._metrics.items()}
+
+    def ensure_flusher(self):
+        """Starts this process's background snapshot writer (cheap to call per request).
+
+        Started lazily so it runs in each forked worker rather than the master.
+        """
+        if not self.directory or self._flusher_pid == os.getpid(): return
+        with self._lock:
+            if self._flusher_pid == os.getpid(): return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        if not self.directory: return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w") as f: json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError:
+            try: os.remove(tmp_path)
+            except OSError: pass
+
+    def _snapshots(self):
+        """(pid, alive, snapshot) for every worker; just this process without a directory."""
+        if not self.directory:
+            yield os.getpid(), True, self.snapshot()
+            return
+        self.flush()
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            try:
+                pid = int(os.path.basename(path)[:-5])
+                with open(path) as f: snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield pid, _pid_alive(pid), snapshot
+
+    # --- Exposition ---
+    def render(self):
+        """All workers' metrics merged, in Prometheus text format (version 0.0.4)."""
+        merged = {}
+        for _, alive, snapshot in self._snapshots():
+            for name, metric in snapshot.items():
+                if metric["kind"] == "gauge" and not alive: continue
+                target = merged.setdefault(name, {**metric, "values": {}})
+                for key, value in metric["values"]:
+                    key = tuple(key)
+                    current = target["values"].get(key)
+                    if metric["kind"] == "histogram":
+                        if current is None: target["values"][key] = value
+                        else:
+                            current["buckets"] = [a + b for a, b in zip(current["buckets"], value["buckets"])]
+                            current["sum"] += value["sum"]
+                            current["count"] += value["count"]
+                    else:
+                        target["values"][key] = (current or 0) + value
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            lines.append(f"# HELP {name} {_escape_help(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            labelnames = metric["labelnames"]
+            for key, value in sorted(metric["values"].items()):
+                labels = list(zip(labelnames, key))
+                if metric["kind"] != "histogram":
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + ["+Inf"], value["buckets"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', _number(bound) if bound != '+Inf' else bound)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value['sum'])}")
+                lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    if pid == os.getpid(): return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _labels(pairs):
+    if not pairs: return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, bool): return "1" if value else "0"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15: return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def registry_from_env(environ):
+    """Registry configured by METRICS_DIR (shared across workers) and METRICS_FLUSH_INTERVAL."""
+    return Registry(directory=environ.get("METRICS_DIR") or None,
+                    flush_interval=float(environ.get("METRICS_FLUSH_INTERVAL", 1.0)))
+
@@ -0,0 +1,262 @@
+"""Per-task Gemini model selection with fallback and hedged requests.
+
+Each task (endpoint) maps to a chain of model names, e.g. a light model for
+dictionary lookups and chat and a stronger one for essays, each followed by
+fallbacks. Calls go to the first healthy model in the chain and move on to the
+next on quota exhaustion, timeouts and 5xx-style errors; other errors (invalid
+argument, ...) are returned as-is since another model wouldn't fare better.
+
+For tasks listed as hedged, a duplicate request is sent to the next model in
+the chain once the first has been running longer than its recent p95 latency,
+and whichever answers first wins. Per-model latency windows and error rates
+feed both the hedge delay and the chain order: a model failing most of its
+recent calls is tried last until it recovers.
+
+Calls take a per-attempt timeout and an overall deadline (time.monotonic())
+that also bounds fallbacks and hedges; `fn(model, timeout)` is expected to
+pass the timeout on to the SDK. A `cancelled()` callable (client went away)
+abandons the wait: the upstream call is left to finish on its own timeout in
+its own thread (a greenlet under gevent) while the request returns at once.
+Cancellable calls don't share a pool, so they never queue behind each other
+or behind abandoned calls; only hedged calls use the bounded hedge pool.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import google.api_core.exceptions
+import requests
+
+TIMEOUT_ERRORS = (google.api_core.exceptions.DeadlineExceeded, TimeoutError, requests.exceptions.Timeout)
+RETRYABLE_ERRORS = (google.api_core.exceptions.ResourceExhausted, google.api_core.exceptions.ServiceUnavailable,
+                    google.api_core.exceptions.InternalServerError) + TIMEOUT_ERRORS
+_CANCEL_POLL = 0.25 # Seconds between client-disconnect checks while waiting on upstream
+
+
+class Cancelled(Exception):
+    """The caller went away (client disconnect) before the upstream call finished."""
+
+
+def attempt_timeout(timeout, deadline):
+    """Timeout for the next attempt: `timeout` capped by what's left of `deadline`."""
+    if deadline is None: return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0.5: raise google.api_core.exceptions.DeadlineExceeded("Request deadline exceeded")
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+class ModelStats:
+    """Sliding window of recent call latencies and outcomes for one model."""
+
+    def __init__(self, window=200):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=50)
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, latency, ok):
+        self.calls += 1
+        if not ok: self.errors += 1
+        if ok: self._latencies.append(latency)
+        self._outcomes.append(ok)
+
+    def p95(self):
+        if not self._latencies: return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def error_rate(self, min_samples=10):
+        if len(self._outcomes) < min_samples: return 0.0
+        return 1 - sum(self._outcomes) / len(self._outcomes)
+
+
+class ModelRouter:
+    def __init__(self, resolve, routes=None, default_chain=(), hedge_tasks=(), hedge_min_delay=1.0, hedge_max_delay=15.0,
+                 unhealthy_error_rate=0.5, hedge_pool_size=16):
+        self.resolve = resolve # model name -> GenerativeModel-like object
+        self.routes = dict(routes or {}) # task -> [model names]
+        self.default_chain = list(default_chain)
+        self.hedge_tasks = set(hedge_tasks)
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_delay = hedge_max_delay
+        self.unhealthy_error_rate = unhealthy_error_rate
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=hedge_pool_size, thread_name_prefix="gemini-hedge")
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _model_stats(self, name):
+        with self._lock:
+            return self._stats.setdefault(name, ModelStats())
+
+    def chain(self, task):
+        """Model names to try for a task, with currently unhealthy models moved last."""
+        names = list(dict.fromkeys(self.routes.get(task) or self.default_chain))
+        return sorted(names, key=lambda name: self._model_stats(name).error_rate() >= self.unhealthy_error_rate)
+
+    def primary(self, task):
+        return self.chain(task)[0]
+
+    def preferred(self, task):
+        """The task's configured first model, whatever its health (cache keys stay put while it's down)."""
+        return (self.routes.get(task) or self.default_chain)[0]
+
+    def _timed(self, name, fn, timeout=None):
+        model = self.resolve(name)
+        started = time.monotonic()
+        try:
+            result = fn(model, timeout)
+        except Exception:
+            self._model_stats(name).record(time.monotonic() - started, False)
+            raise
+        self._model_stats(name).record(time.monotonic() - started, True)
+        return result
+
+    def hedge_delay(self, name):
+        p95 = self._model_stats(name).p95()
+        return self.hedge_max_delay if p95 is None else min(self.hedge_max_delay, max(self.hedge_min_delay, p95))
+
+    # --- Calls ---
+    def call(self, task, fn, timeout=None, deadline=None, cancelled=None):
+        """Runs fn(model, timeout) on the task's chain; returns (model_name, result) or raises the last error."""
+        names = self.chain(task)
+        if task in self.hedge_tasks and len(names) > 1: return self._hedged(names, fn, timeout, deadline, cancelled)
+        last_error = None
+        for index, name in enumerate(names):
+            attempt = attempt_timeout(timeout, deadline) # Out of time: stop here rather than try the next model
+            try:
+                if cancelled is None: return name, self._timed(name, fn, attempt)
+                if cancelled(): raise Cancelled() # Gone before we started; don't spend a call on it
+                return name, self._wait_one(_spawn(self._timed, name, fn, attempt), cancelled)
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                if index + 1 < len(names):
+                    with self._lock: self.fallbacks += 1
+        raise last_error
+
+    def _wait_one(self, future, cancelled):
+        while True:
+            done, _ = wait([future], timeout=_CANCEL_POLL)
+            if done: return future.result()
+            if cancelled(): raise Cancelled()
+
+    def _wait(self, futures, timeout, cancelled, return_when=FIRST_COMPLETED):
+        """concurrent.futures.wait that also gives up when cancelled() turns true."""
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            slice_timeout = _CANCEL_POLL if cancelled is not None else None
+            if end is not None: slice_timeout = max(0.0, min(slice_timeout or timeout, end - time.monotonic()))
+            done, pending = wait(futures, timeout=slice_timeout, return_when=return_when)
+            if done or (end is not None and time.monotonic() >= end): return done, pending
+            if cancelled is not None and cancelled(): raise Cancelled()
+
+    def _hedged(self, names, fn, timeout=None, deadline=None, cancelled=None):
+        """Primary call, plus one duplicate on the next model if the primary is slower than its p95."""
+        primary, backup = names[0], names[1]
+        futures = {self._pool.submit(self._timed, primary, fn, attempt_timeout(timeout, deadline)): primary}
+        done, _ = self._wait(set(futures), self.hedge_delay(primary), cancelled)
+        if not done:
+            with self._lock: self.hedges += 1
+            futures[self._pool.submit(self._timed, backup, fn, attempt_timeout(timeout, deadline))] = backup
+        last_error, pending = None, set(futures)
+        while pending:
+            done, pending = self._wait(pending, None, cancelled)
+            for future in done:
+                try:
+                    result = future.result()
+                except RETRYABLE_ERRORS as e:
+                    last_error = e
+                    if futures[future] == primary and backup not in futures.values(): # Failed fast: fall back now
+                        with self._lock: self.fallbacks += 1
+                        backup_future = self._pool.submit(self._timed, backup, fn, attempt_timeout(timeout, deadline))
+                        futures[backup_future] = backup
+                        pending.add(backup_future)
+                    continue
+                if futures[future] != primary:
+                    with self._lock: self.hedge_wins += 1
+                return futures[future], result # The slower call finishes in the background and is dropped
+        raise last_error
+
+    def open_stream(self, task, fn, timeout=None, deadline=None):
+        """Starts a streamed call, falling back until a model yields its first chunk.
+
+        Returns (model_name, iterator); once a chunk has been yielded the stream
+        stays on that model. Closing the iterator closes the upstream stream.
+        """
+        last_error, names = None, self.chain(task)
+        for index, name in enumerate(names):
+            attempt = attempt_timeout(timeout, deadline)
+            model, started = self.resolve(name), time.monotonic()
+            try:
+                iterator = iter(fn(model, attempt))
+                first = next(iterator, None)
+            except RETRYABLE_ERRORS as e:
+                self._model_stats(name).record(time.monotonic() - started, False)
+                last_error = e
+                if index + 1 < len(names):
+                    with self._lock: self.fallbacks += 1
+                continue
+            except Exception:
+                self._model_stats(name).record(time.monotonic() - started, False)
+                raise
+            self._model_stats(name).record(time.monotonic() - started, True) # Time to first chunk
+            return name, _resumed(first, iterator)
+        raise last_error
+
+    def stats(self):
+        with self._lock:
+            models = {name: {"calls": stats.calls, "errors": stats.errors, "p95": stats.p95()} for name, stats in self._stats.items()}
+            return {"models": models, "fallbacks": self.fallbacks, "hedges": self.hedges, "hedge_wins": self.hedge_wins}
+
+
+def _spawn(fn, *args):
+    """Runs fn(*args) on a new daemon thread; returns its Future."""
+    future = Future()
+    def run():
+        if not future.set_running_or_notify_cancel(): return
+        try: future.set_result(fn(*args))
+        except BaseException as e: future.set_exception(e)
+    threading.Thread(target=run, name="gemini-call", daemon=True).start()
+    return future
+
+
+def _resumed(first, iterator):
+    """Re-attaches the already-read first chunk; closing this closes the upstream iterator."""
+    try:
+        if first is not None: yield first
+        yield from iterator
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None: close()
+
+
+def _names(value):
+    return [name.strip() for name in value.split("|") if name.strip()]
+
+
+def router_from_env(environ, resolve, default_model, task_tiers):
+    """Builds the router from GEMINI_* env vars.
+
+    GEMINI_LIGHT_MODEL / GEMINI_STRONG_MODEL pick the model for each tier in
+    `task_tiers` (both default to `default_model`), GEMINI_FALLBACK_MODELS
+    ("a|b") is appended to every chain, GEMINI_MODEL_ROUTES
+    ("task=model|fallback,task2=model") overrides single tasks, and
+    GEMINI_HEDGE_TASKS lists tasks that may send a hedged duplicate (at most
+    GEMINI_HEDGE_POOL_SIZE hedged calls run at once per worker).
+    """
+    fallbacks = _names(environ.get("GEMINI_FALLBACK_MODELS", ""))
+    tiers = {"default": default_model,
+             "light": environ.get("GEMINI_LIGHT_MODEL") or default_model,
+             "strong": environ.get("GEMINI_STRONG_MODEL") or default_model}
+    routes = {task: [tiers[tier]] + fallbacks for task, tier in task_tiers.items()}
+    for entry in environ.get("GEMINI_MODEL_ROUTES", "").split(","):
+        task, _, models = entry.partition("=")
+        if task.strip() and _names(models): routes[task.strip()] = _names(models)
+    hedge_tasks = [task.strip() for task in environ.get("GEMINI_HEDGE_TASKS", "").split(",") if task.strip()]
+    return ModelRouter(resolve, routes, [default_model] + fallbacks, hedge_tasks,
+                       hedge_min_delay=float(environ.get("GEMINI_HEDGE_MIN_DELAY", 1.0)),
+                       hedge_max_delay=float(environ.get("GEMINI_HEDGE_MAX_DELAY", 15.0)),
+                       hedge_pool_size=int(environ.get("GEMINI_HEDGE_POOL_SIZE", 16)))
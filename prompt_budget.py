@@ -0,0 +1,114 @@
+"""Prompt size governor.
+
+Keeps prompts inside per-endpoint token budgets: counts tokens (a fast local
+estimate by default), truncates over-long messages, drops or digests the oldest
+conversation turns, and splits over-long documents into chunks for map-reduce
+summarization.
+"""
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4 # Good enough for English with Gemini's tokenizer
+TRUNCATION_MARK = " [...]"
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text):
+    """Local token estimate: the larger of a chars/4 and a words*4/3 guess."""
+    if not text: return 0
+    return max((len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN, (len(text.split()) * 4 + 2) // 3)
+
+
+def sdk_token_counter(model, fallback=estimate_tokens):
+    """Counter backed by model.count_tokens (one API call per count)."""
+    def count(text):
+        if not text: return 0
+        try: return model.count_tokens(text).total_tokens
+        except Exception as e:
+            logger.warning("count_tokens failed, using local estimate: %s", e)
+            return fallback(text)
+    return count
+
+
+def truncate_text(text, max_tokens, counter=estimate_tokens):
+    """Cuts text to roughly max_tokens, on a word boundary, marking the cut."""
+    if counter(text) <= max_tokens: return text
+    limit = max(0, max_tokens * CHARS_PER_TOKEN - len(TRUNCATION_MARK))
+    cut = text[:limit]
+    if " " in cut[limit // 2:]: cut = cut[:cut.rindex(" ")]
+    return cut.rstrip() + TRUNCATION_MARK
+
+
+def fit_history(history, budget_tokens, max_message_tokens, counter=estimate_tokens):
+    """Keeps the newest turns of a {sender, text} history that fit the budget.
+
+    Each message is first truncated to max_message_tokens. Returns
+    (kept_history, dropped_history); dropped turns are the oldest ones.
+    """
+    kept = []
+    used = 0
+    entries = [entry for entry in history if isinstance(entry, dict)]
+    for index in range(len(entries) - 1, -1, -1):
+        entry = entries[index]
+        text = truncate_text(str(entry.get('text', '')), max_message_tokens, counter)
+        cost = counter(text) + 2 # Role label + newline
+        if used + cost > budget_tokens:
+            return list(reversed(kept)), entries[:index + 1]
+        kept.append({"sender": entry.get('sender'), "text": text})
+        used += cost
+    return list(reversed(kept)), []
+
+
+def chunk_text(text, chunk_tokens, counter=estimate_tokens):
+    """Splits text into chunks of at most ~chunk_tokens on paragraph/sentence boundaries."""
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if current: chunks.append("\n\n".join(current))
+        current, current_tokens = [], 0
+
+    pieces = []
+    for paragraph in _PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph: continue
+        if counter(paragraph) <= chunk_tokens: pieces.append(paragraph)
+        else: pieces.extend(_split_long(paragraph, chunk_tokens, counter))
+
+    for piece in pieces:
+        piece_tokens = counter(piece)
+        if current and current_tokens + piece_tokens > chunk_tokens: flush()
+        current.append(piece)
+        current_tokens += piece_tokens
+    flush()
+    return chunks
+
+
+def _split_long(paragraph, chunk_tokens, counter):
+    """Sentence-level split for a paragraph that alone exceeds the chunk size."""
+    pieces = []
+    current = ""
+    for sentence in _SENTENCE_RE.split(paragraph):
+        if counter(sentence) > chunk_tokens: # A single runaway "sentence": hard-cut it
+            if current: pieces.append(current)
+            step = chunk_tokens * CHARS_PER_TOKEN
+            pieces.extend(sentence[i:i + step] for i in range(0, len(sentence), step))
+            current = ""
+        elif current and counter(current) + counter(sentence) > chunk_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current: pieces.append(current)
+    return pieces
+
+
+def format_turns(history, user_label="User", bot_label="Ada"):
+    """Renders {sender, text} turns as 'Label: text' lines."""
+    return "".join(f"{user_label if entry.get('sender') == 'user' else bot_label}: {entry.get('text', '')}\n" for entry in history)
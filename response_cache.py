@@ -0,0 +1,206 @@
+"""Response cache for Gemini generations.
+
+Keys are a hash of the normalized final prompt plus the model name. Lookups go
+through an ordered list of tiers (in-process LRU first, then an optional SQLite
+file shared by every gunicorn worker on the host). Any object with
+get(key) / set(key, value, ttl) methods can be plugged in as a tier.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def make_cache_key(prompt, model_name):
+    """Returns a stable hex key for a (prompt, model) pair."""
+    normalized = _WHITESPACE_RE.sub(" ", prompt).strip()
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalized.encode("utf-8"))
+    return digest.hexdigest()
+
+
+# --- Tier: In-Process LRU ---
+class MemoryTier:
+    """Size-bounded LRU with per-entry expiry. Thread-safe."""
+    name = "memory"
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# --- Tier: Shared SQLite File ---
+class SqliteTier:
+    """On-disk tier shared between worker processes via a single SQLite file.
+
+    Entries are evicted least-recently-used once the stored values exceed
+    max_bytes. One connection is shared by all threads/greenlets of a worker
+    behind a lock; every statement is a short indexed lookup.
+    """
+    name = "sqlite"
+    _EVICT_EVERY = 50 # Writes between size checks
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn = conn
+        conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                            key TEXT PRIMARY KEY,
+                            value TEXT NOT NULL,
+                            size INTEGER NOT NULL,
+                            expires_at REAL NOT NULL,
+                            last_access REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            row = conn.execute("SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            value, expires_at = row
+            if expires_at <= now:
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        with self._lock:
+            conn = self._conn
+            conn.execute("INSERT OR REPLACE INTO response_cache (key, value, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                         (key, value, len(value.encode("utf-8")), now + ttl, now))
+            self._writes += 1
+            if self._writes % self._EVICT_EVERY == 0:
+                self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+        if total <= self.max_bytes: return
+        # Drop the oldest entries until we're back under 90% of the cap
+        excess = total - int(self.max_bytes * 0.9)
+        removed = 0
+        for key, size in conn.execute("SELECT key, size FROM response_cache ORDER BY last_access ASC").fetchall():
+            if excess <= 0: break
+            conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+            excess -= size
+            removed += 1
+        self.evictions += removed
+
+
+# --- Multi-Tier Cache ---
+class ResponseCache:
+    """Looks keys up tier by tier, promoting hits into faster tiers."""
+
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+        self._lock = threading.Lock()
+        self.hits = {tier.name: 0 for tier in self.tiers}
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+
+    def get(self, key):
+        for index, tier in enumerate(self.tiers):
+            try:
+                value = tier.get(key)
+            except Exception as e:
+                logger.warning("Response cache read error (%s): %s", tier.name, e)
+                self._count("errors")
+                continue
+            if value is not None:
+                with self._lock: self.hits[tier.name] += 1
+                for faster in self.tiers[:index]:
+                    try: faster.set(key, value, _PROMOTE_TTL)
+                    except Exception: pass
+                return value
+        self._count("misses")
+        return None
+
+    def set(self, key, value, ttl):
+        if not isinstance(value, str) or ttl <= 0: return # Only cache successful text
+        for tier in self.tiers:
+            try: tier.set(key, value, ttl)
+            except Exception as e:
+                logger.warning("Response cache write error (%s): %s", tier.name, e)
+                self._count("errors")
+        self._count("stores")
+
+    def _count(self, attr):
+        with self._lock: setattr(self, attr, getattr(self, attr) + 1)
+
+    def stats(self):
+        total_hits = sum(self.hits.values())
+        lookups = total_hits + self.misses
+        return {
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "stores": self.stores,
+            "errors": self.errors,
+            "hit_rate": (total_hits / lookups) if lookups else 0.0,
+            "evictions": {tier.name: getattr(tier, "evictions", 0) for tier in self.tiers},
+        }
+
+
+# Entries promoted from the shared tier only live briefly in memory so that
+# they can't outlive the authoritative copy by much.
+_PROMOTE_TTL = 300
+
+
+def cache_from_env():
+    """Builds the cache configured by RESPONSE_CACHE_* env vars (None if disabled)."""
+    if os.environ.get("RESPONSE_CACHE_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    tiers = [MemoryTier(max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1024)))]
+    db_path = os.environ.get("RESPONSE_CACHE_DB")
+    if db_path:
+        try:
+            tiers.append(SqliteTier(db_path, max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))))
+        except Exception as e:
+            logger.warning("Shared response cache disabled (%s)", e)
+    return ResponseCache(tiers)
@@ -0,0 +1,315 @@
+"""Near-duplicate query cache for short lookups (dictionary, grammar topics, paraphrases).
+
+The response cache only hits when the final prompt is byte-identical, but
+learners ask for the same thing in many spellings: "present perfect", "Present
+Perfect tense", "the present perfect"; "relative clauses", "relative clause". Queries are
+normalized (case, punctuation, filler words and, per namespace, a lemmatizer:
+`lemma` for rule-based lemmas, `singular` for plurals only) and embedded as hashed word + character-trigram vectors. An identical normalized
+query is an exact hit; otherwise a SimHash of the vector, split into bands,
+finds candidate neighbours (entries sharing at least one band) and the most
+similar one is used if its cosine similarity reaches the namespace threshold.
+
+Entries are bounded per process (LRU) and written through to a SQLite file,
+which restores the index on startup and lets workers on a host see each
+other's entries for exact normalized matches.
+
+A small fraction of near hits are audited: the cached answer is withheld, and
+when the fresh answer is stored it is compared with the one that would have
+been served. Answers that have little in common count as false hits, are
+logged, and the most recent ones are kept for review (recent_audits()).
+"""
+import hashlib
+import logging
+import math
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import Counter, OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:['’-][a-z0-9]+)*")
+_BANDS = 16 # 128-bit SimHash split into 16 bands of 8 bits; neighbours must agree on at least one band
+_VOWELS = set("aeiou")
+_IRREGULAR = {
+    "ran": "run", "went": "go", "gone": "go", "was": "be", "were": "be", "been": "be", "is": "be", "are": "be",
+    "am": "be", "had": "have", "has": "have", "did": "do", "does": "do", "goes": "go", "done": "do", "said": "say",
+    "made": "make", "took": "take", "taken": "take", "came": "come", "seen": "see", "got": "get", "gotten": "get",
+    "knew": "know", "known": "know", "thought": "think", "told": "tell", "gave": "give", "given": "give",
+    "brought": "bring", "began": "begin", "begun": "begin", "kept": "keep", "held": "hold", "wrote": "write",
+    "written": "write", "stood": "stand", "heard": "hear", "meant": "mean", "met": "meet", "paid": "pay", "sat": "sit",
+    "spoken": "speak", "led": "lead", "grew": "grow", "grown": "grow", "lost": "lose", "fallen": "fall", "sent": "send",
+    "built": "build", "understood": "understand", "drew": "draw", "drawn": "draw", "broke": "break", "broken": "break",
+    "spent": "spend", "risen": "rise", "drove": "drive", "driven": "drive", "bought": "buy", "wore": "wear",
+    "worn": "wear", "chose": "choose", "chosen": "choose", "ate": "eat", "eaten": "eat", "flew": "fly", "flown": "fly",
+    "swam": "swim", "swum": "swim", "sang": "sing", "sung": "sing", "drank": "drink", "slept": "sleep",
+    "taught": "teach", "caught": "catch", "fought": "fight", "sold": "sell", "forgot": "forget", "forgotten": "forget",
+    "children": "child", "men": "man", "women": "woman", "people": "person", "mice": "mouse", "feet": "foot",
+    "teeth": "tooth", "geese": "goose",
+}
+
+
+def _measure(stem):
+    """Porter's measure: the number of vowel-consonant sequences in the stem."""
+    pattern = "".join("v" if letter in _VOWELS else "c" for letter in stem)
+    return len(re.findall(r"v+c+", pattern))
+
+
+def lemma(word):
+    """Rule-based lemma: irregular forms, plurals, -ing/-ed/-ies (conservative; errs toward leaving words alone)."""
+    if word in _IRREGULAR: return _IRREGULAR[word]
+    if len(word) <= 3 or not word.isalpha(): return word
+    if word.endswith("ies") and len(word) > 4: return word[:-3] + "y"
+    for suffix in ("ing", "ed"):
+        stem = word[:-len(suffix)]
+        if not word.endswith(suffix) or len(stem) < 3 or not _VOWELS & set(stem) or word.endswith("eed"): continue
+        if len(stem) >= 4 and stem[-1] == stem[-2] and stem[-1] not in "lsz": return stem[:-1] # running -> run
+        if _measure(stem) == 1 and stem[-1] not in _VOWELS | set("wxy") and stem[-2] in _VOWELS and stem[-3] not in _VOWELS:
+            return stem + "e" # making -> make, hoped -> hope (but opened -> open)
+        return stem
+    return _singular(word)
+
+
+def singular(word):
+    """Regular plurals only ("clauses" -> "clause"). Unlike lemma(), keeps verb forms and -ed/-ing words apart
+    (was/is, does/did, bored/boring), which name different grammar topics."""
+    if len(word) <= 3 or not word.isalpha(): return word
+    if word.endswith("ies") and len(word) > 4: return word[:-3] + "y"
+    return _singular(word)
+
+
+def _singular(word):
+    if word.endswith("sses") or word.endswith("xes") or word.endswith("ches") or word.endswith("shes"): return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")): return word[:-1]
+    return word
+
+
+def normalize(text, fillers=frozenset(), lemmatize=None):
+    """Lowercased words of `text` without punctuation or filler words, mapped through `lemmatize` (if given), joined by spaces."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    words = [lemmatize(word) if lemmatize else word for word in _WORD_RE.findall(text) if word not in fillers]
+    return " ".join(word for word in words if word not in fillers)
+
+
+def _feature(token):
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest(), "big")
+
+
+def embed(normalized):
+    """Sparse L2-normalized vector {feature hash: weight} of words (weight 2) and character trigrams."""
+    weights = Counter()
+    for word in normalized.split():
+        weights[_feature("w:" + word)] += 2.0
+        padded = f"#{word}#"
+        for index in range(len(padded) - 2): weights[_feature("c:" + padded[index:index + 3])] += 1.0
+    norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+    return {feature: weight / norm for feature, weight in weights.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b): a, b = b, a
+    return sum(weight * b.get(feature, 0.0) for feature, weight in a.items())
+
+
+def simhash(vector):
+    """128-bit SimHash: each feature votes on every bit with its weight."""
+    totals = [0.0] * (8 * _BANDS)
+    for feature, weight in vector.items():
+        for bit in range(8 * _BANDS):
+            totals[bit] += weight if (feature >> bit) & 1 else -weight
+    return sum(1 << bit for bit, total in enumerate(totals) if total > 0)
+
+
+def _bands(signature):
+    return [(band, (signature >> (8 * band)) & 0xFF) for band in range(_BANDS)]
+
+
+class SemanticCache:
+    _PRUNE_EVERY = 100 # Writes between trims of the file (kept to a few times what fits in memory)
+
+    def __init__(self, path=":memory:", max_entries=5000, audit_rate=0.02, audit_min_similarity=0.3, max_query_chars=2000):
+        self.max_entries = max_entries
+        self.audit_rate = audit_rate
+        self.audit_min_similarity = audit_min_similarity # Answer similarity below which an audited near hit was wrong
+        self.max_query_chars = max_query_chars
+        self._namespaces = {} # namespace -> (threshold, fillers, lemmatize)
+        self._entries = OrderedDict() # (namespace, normalized) -> [expires_at, query, value, vector, signature]
+        self._buckets = {} # (namespace, band, byte) -> set of normalized queries
+        self._pending_audits = OrderedDict() # (namespace, normalized) -> (matched query, cached value, similarity)
+        self._audits = deque(maxlen=50)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.audits = 0
+        self.false_hits = 0
+        self._writes = 0
+        if path != ":memory:": os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS semantic_cache (namespace TEXT NOT NULL, normalized TEXT NOT NULL, query TEXT NOT NULL,
+                              value TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (namespace, normalized))""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_semantic_cache_access ON semantic_cache(last_access)")
+
+    def configure(self, namespace, threshold=0.9, fillers=(), lemmatize=None):
+        """Registers a namespace: the similarity needed for a near hit (>= 1: normalized matches only), words to
+        ignore, and which inflections count as the same query (lemma, singular or None)."""
+        self._namespaces[namespace] = (threshold, frozenset(fillers), lemmatize)
+
+    def load(self):
+        """Rebuilds the in-memory index from the most recently used unexpired entries on disk."""
+        with self._lock:
+            self._conn.execute("DELETE FROM semantic_cache WHERE expires_at <= ?", (time.time(),))
+            rows = self._conn.execute("""SELECT namespace, normalized, query, value, expires_at FROM semantic_cache
+                                         ORDER BY last_access DESC LIMIT ?""", (self.max_entries,)).fetchall()
+            rows = [row for row in rows if row[0] in self._namespaces and self._key(row[0], row[2]) == row[1]] # Skip ones normalized under other settings
+            for namespace, normalized, query, value, expires_at in reversed(rows):
+                self._insert(namespace, normalized, query, value, expires_at)
+        return len(rows)
+
+    def _key(self, namespace, query):
+        if namespace not in self._namespaces: raise KeyError(f"Unconfigured semantic cache namespace {namespace!r}")
+        if len(query) > self.max_query_chars: return None
+        _, fillers, lemmatize = self._namespaces[namespace]
+        return normalize(query, fillers, lemmatize) or None
+
+    def get(self, namespace, query):
+        """Cached value for `query` or a close enough earlier query in `namespace`, else None."""
+        normalized = self._key(namespace, query)
+        if normalized is None: return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((namespace, normalized))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((namespace, normalized))
+                self.hits += 1
+                return entry[2]
+            if entry is not None: self._remove(namespace, normalized)
+        row = self._read(namespace, normalized, now) # Another worker may have stored it
+        with self._lock:
+            if row is not None:
+                self._insert(namespace, normalized, *row)
+                self.hits += 1
+                return row[1]
+            match, similarity = self._nearest(namespace, normalized, now)
+            if match is None:
+                self.misses += 1
+                return None
+            _, matched_query, value, _, _ = self._entries[(namespace, match)]
+            if random.random() < self.audit_rate: # Answer this one fresh and compare (see store)
+                self._pending_audits[(namespace, normalized)] = (matched_query, value, similarity)
+                while len(self._pending_audits) > 100: self._pending_audits.popitem(last=False)
+                self.misses += 1
+                return None
+            self._entries.move_to_end((namespace, match))
+            self.near_hits += 1
+        logger.debug("Semantic cache near hit %r -> %r (%.2f)", query[:80], matched_query[:80], similarity)
+        return value
+
+    def set(self, namespace, query, value, ttl):
+        normalized = self._key(namespace, query)
+        if normalized is None or not isinstance(value, str) or ttl <= 0: return
+        now = time.time()
+        with self._lock:
+            self._insert(namespace, normalized, query, value, now + ttl)
+            self.stores += 1
+            audit = self._pending_audits.pop((namespace, normalized), None)
+        try:
+            with self._lock:
+                self._conn.execute("INSERT OR REPLACE INTO semantic_cache (namespace, normalized, query, value, expires_at, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                                   (namespace, normalized, query, value, now + ttl, now))
+                self._writes += 1
+                if self._writes % self._PRUNE_EVERY == 0: self._prune(now)
+        except sqlite3.Error as e:
+            logger.warning("Semantic cache write failed: %s", e)
+        if audit is not None: self._audit(namespace, query, value, *audit)
+
+    def _audit(self, namespace, query, fresh_value, matched_query, cached_value, similarity):
+        answer_similarity = cosine(embed(normalize(fresh_value, lemmatize=lemma)), embed(normalize(cached_value, lemmatize=lemma)))
+        false_hit = answer_similarity < self.audit_min_similarity
+        with self._lock:
+            self.audits += 1
+            if false_hit: self.false_hits += 1
+            self._audits.append({"namespace": namespace, "query": query[:200], "matched": matched_query[:200], "similarity": round(similarity, 3),
+                                 "answer_similarity": round(answer_similarity, 3), "false_hit": false_hit, "at": time.time()})
+        if false_hit:
+            logger.warning("Semantic cache false hit in %s: %r matched %r (similarity %.2f, answers %.2f)",
+                           namespace, query[:80], matched_query[:80], similarity, answer_similarity)
+
+    def _read(self, namespace, normalized, now):
+        try:
+            with self._lock:
+                row = self._conn.execute("SELECT query, value, expires_at FROM semantic_cache WHERE namespace = ? AND normalized = ? AND expires_at > ?",
+                                         (namespace, normalized, now)).fetchone()
+                if row is None or self._key(namespace, row[0]) != normalized: return None # Stored under other normalization settings
+                self._conn.execute("UPDATE semantic_cache SET last_access = ? WHERE namespace = ? AND normalized = ?", (now, namespace, normalized))
+                return row
+        except sqlite3.Error as e:
+            logger.warning("Semantic cache read failed: %s", e)
+            return None
+
+    def _prune(self, now):
+        self._conn.execute("DELETE FROM semantic_cache WHERE expires_at <= ?", (now,))
+        self._conn.execute("""DELETE FROM semantic_cache WHERE rowid NOT IN
+                              (SELECT rowid FROM semantic_cache ORDER BY last_access DESC LIMIT ?)""", (self.max_entries * 4,))
+
+    # --- In-Memory Index (caller holds the lock) ---
+    def _nearest(self, namespace, normalized, now):
+        threshold = self._namespaces[namespace][0]
+        if threshold >= 1: return None, 0.0
+        vector = embed(normalized)
+        candidates = set()
+        for band, byte in _bands(simhash(vector)): candidates |= self._buckets.get((namespace, band, byte), set())
+        best, best_similarity = None, threshold
+        for candidate in candidates:
+            entry = self._entries[(namespace, candidate)]
+            if entry[0] <= now: continue
+            similarity = cosine(vector, entry[3])
+            if similarity >= best_similarity: best, best_similarity = candidate, similarity
+        return best, best_similarity
+
+    def _insert(self, namespace, normalized, query, value, expires_at):
+        if (namespace, normalized) in self._entries: self._remove(namespace, normalized)
+        vector = embed(normalized)
+        signature = simhash(vector)
+        self._entries[(namespace, normalized)] = [expires_at, query, value, vector, signature]
+        for band, byte in _bands(signature): self._buckets.setdefault((namespace, band, byte), set()).add(normalized)
+        while len(self._entries) > self.max_entries:
+            evicted_namespace, evicted = next(iter(self._entries))
+            self._remove(evicted_namespace, evicted)
+            self.evictions += 1
+
+    def _remove(self, namespace, normalized):
+        entry = self._entries.pop((namespace, normalized), None)
+        if entry is None: return
+        for band, byte in _bands(entry[4]):
+            bucket = self._buckets.get((namespace, band, byte))
+            if bucket is not None:
+                bucket.discard(normalized)
+                if not bucket: del self._buckets[(namespace, band, byte)]
+
+    def recent_audits(self):
+        with self._lock: return list(self._audits)
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {"hits": self.hits, "near_hits": self.near_hits, "misses": self.misses, "stores": self.stores, "evictions": self.evictions,
+                "audits": self.audits, "false_hits": self.false_hits, "entries": len(self._entries),
+                "hit_rate": (self.hits + self.near_hits) / lookups if lookups else 0.0}
+
+
+def semantic_cache_from_env(environ):
+    """Builds the cache configured by SEMANTIC_CACHE_* env vars (None if disabled); namespaces are configured by the caller."""
+    if environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() not in ("true", "1", "t"):
+        return None
+    path = environ.get("SEMANTIC_CACHE_DB") or os.path.join(tempfile.gettempdir(), "adai-semantic-cache.sqlite3")
+    return SemanticCache(path, max_entries=int(environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 5000)),
+                         audit_rate=float(environ.get("SEMANTIC_CACHE_AUDIT_RATE", 0.02)),
+                         audit_min_similarity=float(environ.get("SEMANTIC_CACHE_AUDIT_MIN_SIMILARITY", 0.3)))
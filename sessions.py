@@ -0,0 +1,138 @@
+"""Server-side conversation sessions for /api/chat and /api/scenario-chat.
+
+A session holds everything needed to continue a conversation (kind, scenario
+description, turns), so clients only send the new message. It belongs to the
+client that started it: get() and delete() with another owner act as if it
+didn't exist. State is plain
+JSON, so it can live in a SQLite file shared by all workers on a host (the
+default: a follow-up turn may land on any worker) or, for a single process, in
+memory. Both stores are bounded and evict idle sessions.
+"""
+import json
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+MAX_STORED_TURNS = 100 # Older turns are only needed for the budgeted window / digest
+
+
+def new_session_id():
+    return secrets.token_urlsafe(18)
+
+
+def new_session_state(kind, owner, scenario=None, turns=None):
+    return {"kind": kind, "owner": owner, "scenario": scenario, "turns": list(turns or [])[-MAX_STORED_TURNS:], "created_at": time.time()}
+
+
+def append_turns(state, *turns):
+    state["turns"] = (state["turns"] + list(turns))[-MAX_STORED_TURNS:]
+
+
+# --- Stores ---
+class MemorySessionStore:
+    def __init__(self, max_sessions=5000, idle_ttl=3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict() # id -> (last_used, state)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id, owner):
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1].get("owner") != owner: return None
+            if now - entry[0] > self.idle_ttl:
+                del self._sessions[session_id]
+                self.evictions += 1
+                return None
+            self._sessions[session_id] = (now, entry[1])
+            self._sessions.move_to_end(session_id)
+            return json.loads(json.dumps(entry[1])) # Callers get their own copy
+
+    def put(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (time.time(), state)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, session_id, owner):
+        """Deletes the session if `owner` owns it; returns whether it did."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1].get("owner") != owner: return False
+            del self._sessions[session_id]
+            return True
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SqliteSessionStore:
+    """Shared between worker processes, so any worker can continue any session."""
+    _SWEEP_EVERY = 100 # Writes between idle/size sweeps
+
+    def __init__(self, path, max_sessions=50000, idle_ttl=3600):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_used ON sessions(last_used)")
+
+    def get(self, session_id, owner):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT state, last_used FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None: return None
+            if now - row[1] > self.idle_ttl:
+                self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                return None
+            state = json.loads(row[0])
+            if state.get("owner") != owner: return None
+            self._conn.execute("UPDATE sessions SET last_used = ? WHERE id = ?", (now, session_id))
+        return state
+
+    def put(self, session_id, state):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO sessions (id, state, last_used) VALUES (?, ?, ?)", (session_id, json.dumps(state), now))
+            self._writes += 1
+            if self._writes % self._SWEEP_EVERY == 0: self._sweep(now)
+
+    def delete(self, session_id, owner):
+        """Deletes the session if `owner` owns it; returns whether it did."""
+        with self._lock:
+            row = self._conn.execute("SELECT state FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None or json.loads(row[0]).get("owner") != owner: return False
+            self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            return True
+
+    def __len__(self):
+        with self._lock: return self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _sweep(self, now):
+        removed = self._conn.execute("DELETE FROM sessions WHERE last_used < ?", (now - self.idle_ttl,)).rowcount
+        removed += self._conn.execute("""DELETE FROM sessions WHERE id IN (
+                                             SELECT id FROM sessions ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                                      (self.max_sessions,)).rowcount
+        self.evictions += removed
+
+
+def store_from_env(environ):
+    """Builds the store configured by SESSION_* env vars: SESSION_STORE_DB (default: a file in the temp dir) or ":memory:" for per-process sessions."""
+    idle_ttl = int(environ.get("SESSION_IDLE_TTL", 3600))
+    db_path = environ.get("SESSION_STORE_DB") or os.path.join(tempfile.gettempdir(), "adai-sessions.sqlite3")
+    if db_path == ":memory:":
+        return MemorySessionStore(max_sessions=int(environ.get("SESSION_MAX", 5000)), idle_ttl=idle_ttl)
+    return SqliteSessionStore(db_path, max_sessions=int(environ.get("SESSION_MAX", 50000)), idle_ttl=idle_ttl)
@@ -0,0 +1,178 @@
+"""In-flight request coalescing ("singleflight").
+
+Concurrent callers asking for the same key share one upstream call: the first
+caller becomes the leader and does the work, everyone else waits for its
+result. Within a worker this uses an in-memory registry; with a lock directory
+configured, leaders of cacheable calls in different worker processes also
+serialize on a per-key lock file, and a leader that had to wait for another
+process re-checks the shared cache (`recheck`) before calling upstream itself.
+Calls without a shared cache to re-check gain nothing from waiting, so they
+are only coalesced in-process.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError: # Not POSIX; fall back to per-process coalescing only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """One in-flight call. Leaders must call finish() exactly once."""
+
+    def __init__(self, group, key, leader):
+        self._group = group
+        self.key = key
+        self.leader = leader
+        self.contended = False # Leader waited on another process's lock
+        self._event = threading.Event()
+        self._result = None
+        self._error = None
+        self._lock_fd = None
+        self.waiters = 0
+
+    def wait(self, timeout=None):
+        """Blocks until the leader finishes; returns its result or re-raises its error."""
+        if not self._event.wait(timeout):
+            raise TimeoutError(f"Timed out waiting for in-flight call {self.key[:12]}")
+        if self._error is not None: raise self._error
+        return self._result
+
+    def finish(self, result=None, error=None):
+        self._result = result
+        self._error = error
+        self._group._release(self)
+        self._event.set()
+
+
+class _Follower:
+    """View of someone else's flight; can only wait for it."""
+    leader = False
+
+    def __init__(self, flight):
+        self._flight = flight
+        self.key = flight.key
+
+    def wait(self, timeout=None):
+        try: return self._flight.wait(timeout)
+        finally: self._flight._group._leave(self._flight)
+
+
+class SingleFlight:
+    def __init__(self, name, lock_dir=None, lock_timeout=30.0, poll_interval=0.05):
+        self.name = name
+        self.lock_dir = os.path.join(lock_dir, name) if (lock_dir and fcntl) else None
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.cross_process_waits = 0
+        if self.lock_dir: os.makedirs(self.lock_dir, exist_ok=True)
+
+    def begin(self, key, cross_process=True):
+        """Joins the in-flight call for `key`, or starts one as its leader.
+
+        Followers must wait() exactly once. A leader also takes the key's
+        cross-process lock when `cross_process` is set (callers that re-check a
+        shared cache once they get it).
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                self.coalesced += 1
+                return _Follower(flight)
+            flight = Flight(self, key, leader=True)
+            self._flights[key] = flight
+            self.leaders += 1
+        if self.lock_dir and cross_process: self._acquire_file_lock(flight)
+        return flight
+
+    def _leave(self, flight):
+        with self._lock: flight.waiters -= 1
+
+    def waiters(self, key):
+        """Followers currently sharing the in-flight call for `key` (0 if there is none)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            return flight.waiters if flight is not None else 0
+
+    def do(self, key, fn, recheck=None, timeout=None):
+        """Runs fn() once per key across concurrent callers and returns its result.
+
+        `recheck` (optional) is consulted by a leader that had to wait for
+        another process; a non-None value is used instead of calling fn().
+        """
+        flight = self.begin(key, cross_process=recheck is not None)
+        if not flight.leader: return flight.wait(timeout)
+        try:
+            result = recheck() if (flight.contended and recheck is not None) else None
+            if result is None: result = fn()
+        except BaseException as e:
+            flight.finish(error=e)
+            raise
+        flight.finish(result=result)
+        return result
+
+    # --- Cross-Process Lock Files ---
+    def _lock_path(self, key):
+        # One lock file per key, removed by the leader when it finishes, so unrelated keys never wait on each other
+        return os.path.join(self.lock_dir, hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest() + ".lock")
+
+    def _acquire_file_lock(self, flight):
+        path = self._lock_path(flight.key)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            except OSError as e:
+                logger.warning("Singleflight (%s): lock file unavailable, coalescing in-process only: %s", self.name, e)
+                return
+            while True:
+                try:
+                    # Non-blocking + sleep so gevent workers keep serving other greenlets
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if not flight.contended:
+                        flight.contended = True
+                        with self._lock: self.cross_process_waits += 1
+                    if time.monotonic() >= deadline: # Give up on coordination rather than stall
+                        os.close(fd)
+                        return
+                    time.sleep(self.poll_interval)
+            try:
+                current = os.stat(path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(fd).st_ino:
+                flight._lock_fd = fd
+                return
+            os.close(fd) # Locked a file its previous leader already removed; lock the current one instead
+
+    def _release(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight: del self._flights[flight.key]
+        if flight._lock_fd is not None:
+            try:
+                os.unlink(self._lock_path(flight.key)) # Before unlocking, so a waiter on this file sees it's stale
+            except OSError:
+                pass
+            try:
+                fcntl.flock(flight._lock_fd, fcntl.LOCK_UN)
+                os.close(flight._lock_fd)
+            except OSError:
+                pass
+            flight._lock_fd = None
+
+    def stats(self):
+        return {"leaders": self.leaders, "coalesced": self.coalesced,
+                "cross_process_waits": self.cross_process_waits, "in_flight": len(self._flights)}
@@ -0,0 +1,68 @@
+"""Sentence segmentation and pipelined synthesis for long TTS passages.
+
+A generated passage (150-250 words) read as one ElevenLabs call can't start
+playing until the whole clip exists. Split at sentence boundaries instead,
+each segment is a separate, independently cached synthesis, run a few at a
+time ahead of the one being streamed: the first audio is ready after roughly
+one sentence, and editing one sentence of a passage only re-synthesizes that
+sentence.
+"""
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])[\"'”’)\]]*\s+|\n\s*\n+")
+_SOFT_BREAK = re.compile(r"(?<=[,;:—])\s+")
+
+
+def split_sentences(text, max_chars=250, min_chars=40):
+    """Splits text into sentence-aligned segments of at most max_chars.
+
+    Sentences shorter than min_chars are merged into the next one (a lone
+    "Yes." sounds clipped on its own); longer ones than max_chars are split at
+    commas/semicolons, then at spaces.
+    """
+    segments, pending = [], ""
+    for sentence in (part.strip() for part in _SENTENCE_END.split(text)):
+        if not sentence: continue
+        pending = f"{pending} {sentence}".strip()
+        if len(pending) < min_chars: continue
+        segments += _split_long(pending, max_chars)
+        pending = ""
+    if pending:
+        if segments and len(segments[-1]) + len(pending) < max_chars: segments[-1] = f"{segments[-1]} {pending}"
+        else: segments += _split_long(pending, max_chars)
+    return segments
+
+
+def _split_long(sentence, max_chars):
+    if len(sentence) <= max_chars: return [sentence]
+    pieces, current = [], ""
+    for part in _SOFT_BREAK.split(sentence):
+        for word in ([part] if len(part) <= max_chars else part.split()):
+            if current and len(current) + 1 + len(word) > max_chars:
+                pieces.append(current)
+                current = word
+            else:
+                current = f"{current} {word}".strip()
+    if current: pieces.append(current)
+    return pieces
+
+
+def pipelined(items, fn, concurrency=3):
+    """Yields fn(item) for each item, in order, running up to `concurrency` calls ahead.
+
+    Exceptions from fn are raised when their item's turn comes. Closing the
+    generator (client went away) drops the calls that haven't started.
+    """
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="tts-segment")
+    remaining = iter(items)
+    pending = deque(pool.submit(fn, item) for _, item in zip(range(max(1, concurrency)), remaining))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            following = next(remaining, None)
+            if following is not None: pending.append(pool.submit(fn, following))
+            yield result
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
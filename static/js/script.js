@@ -14,6 +14,14 @@ document.addEventListener('DOMContentLoaded', () => {
     if (bodyElement) bodyElement.classList.add('auth-loading');
 
 
+    // Cached lookups and queued offline requests belong to the signed-in user; drop them when nobody is (shared devices)
+    function clearUserCaches() {
+        if (!('serviceWorker' in navigator)) return;
+        const message = { type: 'clear-user-data' };
+        if (navigator.serviceWorker.controller) { navigator.serviceWorker.controller.postMessage(message); return; }
+        navigator.serviceWorker.ready.then(registration => { if (registration.active) registration.active.postMessage(message); });
+    }
+
     // --- Auth State Listener (Core Logic) ---
     let initialAuthCheckComplete = false;
     auth.onAuthStateChanged(user => {
@@ -36,6 +44,7 @@ document.addEventListener('DOMContentLoaded', () => {
         } else {
             // User is SIGNED OUT
             console.log('Auth State: Signed Out');
+            clearUserCaches();
             if(userInfo) userInfo.style.display = 'none';
             if(mainContent) mainContent.style.display = 'none';
             if (currentPath !== '/signin' && !currentPath.startsWith('/signin?')) {
@@ -70,7 +79,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- API Call Helper (Sends ID Token) ---
-    async function callApi(endpoint, data) {
+    // method 'GET' sends data as query parameters: used for lookups the service worker caches and serves offline
+    async function callApi(endpoint, data, method = 'POST') {
         showLoading(true);
         let idToken = null;
         if (!auth.currentUser) {
@@ -79,20 +89,26 @@ document.addEventListener('DOMContentLoaded', () => {
             return null;
         }
         try {
-            idToken = await auth.currentUser.getIdToken(true);
+            idToken = await auth.currentUser.getIdToken(); // Cached by the SDK until near expiry, so the server can reuse its verification
         } catch (tokenError) {
              console.error("Error getting Firebase ID token:", tokenError);
              alert("Authentication error getting token. Please try signing out and back in. Error: " + tokenError.message);
              showLoading(false);
              return null;
         }
-        const headers = { 'Content-Type': 'application/json', 'Authorization': `Bearer ${idToken}` };
+        // FormData (file uploads) is sent as multipart; the browser sets its Content-Type boundary
+        const isForm = data instanceof FormData;
+        const isGet = method === 'GET';
+        const headers = (isForm || isGet) ? { 'Authorization': `Bearer ${idToken}` } : { 'Content-Type': 'application/json', 'Authorization': `Bearer ${idToken}` };
         try {
-            const response = await fetch(endpoint, { method: 'POST', headers: headers, body: JSON.stringify(data) });
+            const response = isGet
+                ? await fetch(`${endpoint}?${new URLSearchParams(data)}`, { headers: headers })
+                : await fetch(endpoint, { method: 'POST', headers: headers, body: isForm ? data : JSON.stringify(data) });
             if (!response.ok) {
                 let errorMsg = `API Error (${response.status})`;
                 let errorData = null;
                 try { errorData = await response.json(); } catch (e) { /* Ignore */ }
+                if (errorData && errorData.session_expired) { return errorData; } // Caller resends with full history
                 errorMsg = (errorData && errorData.error) ? errorData.error : `${errorMsg} - ${response.statusText}`;
                 console.error(`API Error calling ${endpoint}:`, errorMsg, errorData);
                 if (response.status === 401 || response.status === 403) {
@@ -117,6 +133,62 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // Lookups queued by the service worker while offline are replayed with a fresh token once we're back online
+    window.addEventListener('online', async () => {
+        const controller = navigator.serviceWorker && navigator.serviceWorker.controller;
+        if (!controller) return;
+        let token = null;
+        try { if (auth.currentUser) token = await auth.currentUser.getIdToken(); } catch (e) { /* Replay with the queued token */ }
+        controller.postMessage({ type: 'replay', token: token });
+    });
+
+    // --- Streaming API Call Helper (Server-Sent Events) ---
+    // Calls an endpoint in streaming mode and invokes onDelta(chunk, textSoFar) as text arrives.
+    // Resolves to the same payload shape as callApi (from the final 'done' event), or null on error.
+    async function callApiStream(endpoint, data, onDelta) {
+        if (!auth.currentUser || !window.ReadableStream || !window.TextDecoder) { return callApi(endpoint, data); }
+        let idToken = null;
+        try { idToken = await auth.currentUser.getIdToken(); }
+        catch (tokenError) { console.error("Error getting Firebase ID token:", tokenError); return callApi(endpoint, data); }
+        const headers = { 'Content-Type': 'application/json', 'Accept': 'text/event-stream', 'Authorization': `Bearer ${idToken}` };
+        let response;
+        try {
+            response = await fetch(`${endpoint}?stream=1`, { method: 'POST', headers: headers, body: JSON.stringify(data) });
+        } catch (error) { console.error(`Network error streaming ${endpoint}:`, error); alert(`Network or processing error: ${error.message}`); return null; }
+        const contentType = response.headers.get("content-type") || '';
+        if (!response.ok || !contentType.includes("text/event-stream") || !response.body) {
+            // Server answered without streaming (error or old server) - handle like a normal JSON call
+            let payload = null; try { payload = await response.json(); } catch (e) { /* Ignore */ }
+            if (payload && payload.session_expired) { return payload; } // Caller resends with full history
+            if (!response.ok) { console.error(`API Error calling ${endpoint}:`, response.status, payload); alert(`Error communicating with server: ${(payload && payload.error) || response.statusText}`); return null; }
+            return payload;
+        }
+        const reader = response.body.getReader(); const decoder = new TextDecoder();
+        let buffer = ''; let textSoFar = ''; let result = null;
+        try {
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary); buffer = buffer.slice(boundary + 2);
+                    let eventName = 'message'; let dataLines = [];
+                    rawEvent.split('\n').forEach(line => {
+                        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+                    });
+                    if (!dataLines.length) continue;
+                    const payload = JSON.parse(dataLines.join('\n'));
+                    if (eventName === 'delta') { textSoFar += payload.text; if (onDelta) onDelta(payload.text, textSoFar); }
+                    else if (eventName === 'done') { result = payload; }
+                    else if (eventName === 'error') { console.error(`Stream error from ${endpoint}:`, payload.error); result = payload; }
+                }
+            }
+        } catch (error) { console.error(`Error reading stream from ${endpoint}:`, error); return textSoFar ? null : callApi(endpoint, data); }
+        return result;
+    }
+
     // --- Feature Switching Logic ---
     const featureButtons = document.querySelectorAll('.feature-button');
     const featureContents = document.querySelectorAll('.feature-content');
@@ -167,6 +239,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const speakModeButton = document.getElementById('speak-mode-button');
     const speechStatus = document.getElementById('speech-status');
     let chatHistory = [];
+    let chatSessionId = null; // Server-side session; once set, only new messages are sent
     let isSpeakMode = false;
     let recognition;
 
@@ -227,6 +300,44 @@ document.addEventListener('DOMContentLoaded', () => {
          } catch (e) { console.error("Error initiating speech synthesis:", e); }
     }
 
+    // Long passages: the server streams sentence-sized MP3 segments in order, so playback starts after the first one
+    let passageAudio = null;
+    async function speakPassage(text) {
+        if (!text || typeof text !== 'string') return;
+        if (passageAudio) { passageAudio.pause(); passageAudio = null; }
+        if (typeof synth !== 'undefined') synth.cancel();
+        if (!auth.currentUser) { speakUtterance(text); return; }
+        let response;
+        try {
+            const idToken = await auth.currentUser.getIdToken();
+            response = await fetch('/api/elevenlabs_tts', { method: 'POST', headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${idToken}` }, body: JSON.stringify({ text: text, segmented: true }) });
+        } catch (error) { console.error("Error fetching passage audio:", error); speakUtterance(text); return; }
+        if (!response.ok || !response.body) { console.warn("Passage TTS failed, falling back:", response.status); speakUtterance(text); return; }
+        const audio = new Audio(); passageAudio = audio;
+        if (!window.MediaSource || !MediaSource.isTypeSupported('audio/mpeg')) {
+            // No MSE for MP3 (e.g. older Safari): wait for the whole response
+            const audioUrl = URL.createObjectURL(await response.blob()); audio.src = audioUrl;
+            audio.onended = () => URL.revokeObjectURL(audioUrl);
+            audio.play().catch(e => { console.error("Error playing passage audio:", e); speakUtterance(text); });
+            return;
+        }
+        const mediaSource = new MediaSource(); audio.src = URL.createObjectURL(mediaSource);
+        mediaSource.addEventListener('sourceopen', async () => {
+            const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg'); const reader = response.body.getReader();
+            const appended = () => new Promise(resolve => sourceBuffer.addEventListener('updateend', resolve, { once: true }));
+            try {
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done || passageAudio !== audio) break; // Finished, or replaced by another passage
+                    sourceBuffer.appendBuffer(value); await appended();
+                    if (audio.paused && audio.currentTime === 0) audio.play().catch(e => console.error("Error playing passage audio:", e));
+                }
+                if (mediaSource.readyState === 'open') mediaSource.endOfStream();
+            } catch (error) { console.error("Error streaming passage audio:", error); reader.cancel().catch(() => {}); }
+        }, { once: true });
+        audio.onended = () => URL.revokeObjectURL(audio.src);
+    }
+
 
     // Web Speech API - Speech Recognition (STT)
     const SpeechRecognition = window.SpeechRecognition || window.webkitSpeechRecognition;
@@ -266,7 +377,12 @@ document.addEventListener('DOMContentLoaded', () => {
         const typingIndicator = document.createElement('div'); typingIndicator.classList.add('message', 'bot', 'typing'); typingIndicator.textContent = 'Ada is typing...'; if(chatBox) { chatBox.appendChild(typingIndicator); chatBox.scrollTop = chatBox.scrollHeight; }
         const historyForApi = chatHistory.slice(0, -1).slice(-6); let botReplyText = null;
         try {
-            const response = await callApi('/api/chat', { message: currentMessage, history: historyForApi });
+            // Stream the reply into the typing bubble; it is swapped for the final message below
+            const onDelta = (chunk, textSoFar) => { typingIndicator.classList.remove('typing'); typingIndicator.textContent = textSoFar; if(chatBox) chatBox.scrollTop = chatBox.scrollHeight; };
+            const fullRequest = { message: currentMessage, history: historyForApi, session: true };
+            let response = await callApiStream('/api/chat', chatSessionId ? { message: currentMessage, session_id: chatSessionId } : fullRequest, onDelta);
+            if (response?.session_expired) { chatSessionId = null; response = await callApiStream('/api/chat', fullRequest, onDelta); }
+            if (response?.session_id) { chatSessionId = response.session_id; }
             if (response && response.reply) { botReplyText = response.reply; addChatMessage('bot', botReplyText); }
             else { addChatMessage('bot', 'Sorry, I couldn\'t get a response.'); }
         } catch (error) { console.error("Error processing /api/chat call:", error); addChatMessage('bot', 'An error occurred.'); }
@@ -279,12 +395,30 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Text Generator ---
     const textGenLevel = document.getElementById('text-gen-level'); const textGenTopic = document.getElementById('text-gen-topic'); const generateTextButton = document.getElementById('generate-text-button'); const textGenOutput = document.getElementById('text-gen-output');
+    const readTextButton = document.getElementById('read-text-button');
+    if(readTextButton) { readTextButton.addEventListener('click', () => { const passage = textGenOutput?.textContent.trim(); if (!passage) { alert('Generate a text first.'); return; } speakPassage(passage); }); }
     if(generateTextButton) { generateTextButton.addEventListener('click', async () => { const level = textGenLevel?.value || 'encounter'; const topic = textGenTopic?.value.trim() || ''; if (!topic) { alert('Please enter topic.'); return; } if(textGenOutput) textGenOutput.textContent = ''; showOutputLoading('text-gen-output', true); const response = await callApi('/api/generate_text', { level, topic }); showOutputLoading('text-gen-output', false); if(textGenOutput) textGenOutput.textContent = (response?.generated_text) || 'Error generating text.'; }); } else { console.warn("Generate Text Button not found."); }
 
     // --- Dictionary ---
     const dictWordInput = document.getElementById('dict-word'); const lookupWordButton = document.getElementById('lookup-word-button'); const dictOutput = document.getElementById('dict-output');
     function renderDictionaryResult(details, word) { /* ... same rendering logic ... */ if (!dictOutput) return; dictOutput.innerHTML = ''; if (!details || details.toLowerCase().includes("not found") || details.toLowerCase().includes("nonsensical")) { dictOutput.textContent = `Could not find info for "${word}".`; return; } const header = document.createElement('h4'); header.textContent = word.charAt(0).toUpperCase() + word.slice(1) + ' '; const speakButton = document.createElement('button'); speakButton.innerHTML = '<i class="fas fa-volume-up"></i>'; speakButton.classList.add('speak-word-button'); speakButton.title = `Speak "${word}"`; speakButton.onclick = () => { speakText(word, false); }; header.appendChild(speakButton); dictOutput.appendChild(header); const detailsDiv = document.createElement('div'); detailsDiv.innerHTML = details.replace(/</g, "<").replace(/>/g, ">").replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>').replace(/(\r\n|\r|\n){2,}/g, '<br><br>').replace(/(\r\n|\r|\n)/g, '<br>'); dictOutput.appendChild(detailsDiv); }
-    if(lookupWordButton) { lookupWordButton.addEventListener('click', async () => { const word = dictWordInput?.value.trim() || ''; if (!word) { alert('Please enter word.'); return; } if(dictOutput) dictOutput.innerHTML = ''; showOutputLoading('dict-output', true); const response = await callApi('/api/dictionary', { word }); showOutputLoading('dict-output', false); if (response?.details) { renderDictionaryResult(response.details, word); } else if(dictOutput) { dictOutput.textContent = 'Error looking up word.'; } }); } else { console.warn("Lookup Button not found."); }
+    // Autocomplete from the server's local lexicon (no AI call); debounced, and skipped until signed in
+    const dictSuggestions = document.getElementById('dict-suggestions'); let suggestTimer = null; let suggestController = null;
+    async function fetchDictionarySuggestions(prefix) {
+        if (!auth.currentUser || !dictSuggestions) return;
+        if (suggestController) suggestController.abort();
+        suggestController = new AbortController();
+        try {
+            const idToken = await auth.currentUser.getIdToken();
+            const response = await fetch(`/api/dictionary/suggest?q=${encodeURIComponent(prefix)}`, { headers: { 'Authorization': `Bearer ${idToken}` }, signal: suggestController.signal });
+            if (!response.ok) return;
+            const { suggestions } = await response.json();
+            dictSuggestions.innerHTML = '';
+            (suggestions || []).forEach(suggestion => { const option = document.createElement('option'); option.value = suggestion.word; if (suggestion.turkish_meaning) option.label = suggestion.turkish_meaning; dictSuggestions.appendChild(option); });
+        } catch (error) { if (error.name !== 'AbortError') console.warn("Dictionary suggestions failed:", error); }
+    }
+    if(dictWordInput) { dictWordInput.addEventListener('input', () => { clearTimeout(suggestTimer); const prefix = dictWordInput.value.trim(); if (prefix.length < 2) { if (dictSuggestions) dictSuggestions.innerHTML = ''; return; } suggestTimer = setTimeout(() => fetchDictionarySuggestions(prefix), 150); }); }
+    if(lookupWordButton) { lookupWordButton.addEventListener('click', async () => { const word = dictWordInput?.value.trim() || ''; if (!word) { alert('Please enter word.'); return; } if(dictOutput) dictOutput.innerHTML = ''; showOutputLoading('dict-output', true); const response = await callApi('/api/dictionary', { word }, 'GET'); showOutputLoading('dict-output', false); if (response?.details) { renderDictionaryResult(response.details, word); } else if(dictOutput) { dictOutput.textContent = 'Error looking up word.'; } }); } else { console.warn("Lookup Button not found."); }
     if(dictWordInput) dictWordInput.addEventListener('keypress', (e) => { if (e.key === 'Enter' && lookupWordButton) { lookupWordButton.click(); } });
 
     // --- Text Corrector ---
@@ -293,12 +427,12 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Grammar Aid ---
     const grammarTopicInput = document.getElementById('grammar-topic'); const explainGrammarButton = document.getElementById('explain-grammar-button'); const grammarOutput = document.getElementById('grammar-output');
-    if(explainGrammarButton) { explainGrammarButton.addEventListener('click', async () => { const topic = grammarTopicInput?.value.trim() || ''; if (!topic) { alert('Please enter topic.'); return; } if(grammarOutput) grammarOutput.textContent = ''; showOutputLoading('grammar-output', true); const response = await callApi('/api/grammar_aid', { topic }); showOutputLoading('grammar-output', false); if(grammarOutput) grammarOutput.innerHTML = (response?.explanation) ? response.explanation.replace(/\n/g, '<br>') : 'Error explaining topic.'; }); } else { console.warn("Explain Grammar Button not found."); }
+    if(explainGrammarButton) { explainGrammarButton.addEventListener('click', async () => { const topic = grammarTopicInput?.value.trim() || ''; if (!topic) { alert('Please enter topic.'); return; } if(grammarOutput) grammarOutput.textContent = ''; showOutputLoading('grammar-output', true); const response = await callApi('/api/grammar_aid', { topic }, 'GET'); showOutputLoading('grammar-output', false); if(grammarOutput) grammarOutput.innerHTML = (response?.explanation) ? response.explanation.replace(/\n/g, '<br>') : 'Error explaining topic.'; }); } else { console.warn("Explain Grammar Button not found."); }
     if(grammarTopicInput) grammarTopicInput.addEventListener('keypress', (e) => { if (e.key === 'Enter' && explainGrammarButton) { explainGrammarButton.click(); } });
 
     // --- Essay Helper ---
     const essayTopicInput = document.getElementById('essay-topic'); const essayTypeSelect = document.getElementById('essay-type'); const generateOutlineButton = document.getElementById('generate-outline-button'); const generateEssayButton = document.getElementById('generate-essay-button'); const essayOutput = document.getElementById('essay-output');
-    async function generateEssayContent(outlineOnly) { const topic = essayTopicInput?.value.trim() || ''; const essayType = essayTypeSelect?.value || 'argumentative'; if (!topic) { alert('Please enter topic.'); return; } if(essayOutput) essayOutput.textContent = ''; showOutputLoading('essay-output', true); const response = await callApi('/api/essay', { topic, essay_type: essayType, outline_only: outlineOnly }); showOutputLoading('essay-output', false); if(essayOutput) essayOutput.innerHTML = (response?.essay_content) ? response.essay_content.replace(/\n/g, '<br>') : `Error generating ${outlineOnly ? 'outline' : 'essay'}.`; }
+    async function generateEssayContent(outlineOnly) { const topic = essayTopicInput?.value.trim() || ''; const essayType = essayTypeSelect?.value || 'argumentative'; if (!topic) { alert('Please enter topic.'); return; } if(essayOutput) essayOutput.textContent = ''; showOutputLoading('essay-output', true); const response = await callApiStream('/api/essay', { topic, essay_type: essayType, outline_only: outlineOnly }, (chunk, textSoFar) => { showOutputLoading('essay-output', false); if(essayOutput) essayOutput.textContent = textSoFar; }); showOutputLoading('essay-output', false); if(essayOutput) essayOutput.innerHTML = (response?.essay_content) ? response.essay_content.replace(/\n/g, '<br>') : `Error generating ${outlineOnly ? 'outline' : 'essay'}.`; }
     if(generateOutlineButton) generateOutlineButton.addEventListener('click', () => generateEssayContent(true)); else { console.warn("Generate Outline Button not found."); }
     if(generateEssayButton) generateEssayButton.addEventListener('click', () => generateEssayContent(false)); else { console.warn("Generate Essay Button not found."); }
 
@@ -319,6 +453,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const resetScenarioButton = document.getElementById('reset-scenario-button');
     let currentScenarioDescription = null;
     let scenarioChatHistory = [];
+    let scenarioSessionId = null;
 
     function addScenarioChatMessage(sender, text) {
         if (!scenarioChatBox) return;
@@ -343,7 +478,11 @@ document.addEventListener('DOMContentLoaded', () => {
         let botReplyText = null;
 
         try {
-            const response = await callApi('/api/scenario-chat', { scenario: currentScenarioDescription, history: historyForApi, message: currentUserMessage });
+            const onDelta = (chunk, textSoFar) => { typingIndicator.classList.remove('typing'); typingIndicator.textContent = textSoFar; if(scenarioChatBox) scenarioChatBox.scrollTop = scenarioChatBox.scrollHeight; };
+            const fullRequest = { scenario: currentScenarioDescription, history: historyForApi, message: currentUserMessage, session: true };
+            let response = await callApiStream('/api/scenario-chat', scenarioSessionId ? { message: currentUserMessage, session_id: scenarioSessionId } : fullRequest, onDelta);
+            if (response?.session_expired) { scenarioSessionId = null; response = await callApiStream('/api/scenario-chat', fullRequest, onDelta); }
+            if (response?.session_id) { scenarioSessionId = response.session_id; }
             if (response?.reply) { botReplyText = response.reply; addScenarioChatMessage('bot', botReplyText); }
             else { addScenarioChatMessage('bot', 'Sorry, issue in scenario.'); }
         } catch (error) { console.error("Error processing /api/scenario-chat call:", error); addScenarioChatMessage('bot', 'Error in scenario.'); }
@@ -362,7 +501,7 @@ document.addEventListener('DOMContentLoaded', () => {
         startScenarioButton.addEventListener('click', async () => {
             const description = scenarioDescriptionInput?.value.trim() || '';
             if (!description) { alert('Please describe scenario.'); return; }
-            currentScenarioDescription = description; scenarioChatHistory = [];
+            currentScenarioDescription = description; scenarioChatHistory = []; scenarioSessionId = null;
             console.log("Starting scenario:", currentScenarioDescription);
             if (scenarioChatBox) scenarioChatBox.innerHTML = '';
             if (scenarioTitleDisplay) scenarioTitleDisplay.textContent = `Scenario: ${description.substring(0, 50)}${description.length > 50 ? '...' : ''}`;
@@ -371,8 +510,9 @@ document.addEventListener('DOMContentLoaded', () => {
             if (scenarioChatInput) scenarioChatInput.value = '';
 
             showLoading(true);
-            const response = await callApi('/api/scenario-chat', { scenario: currentScenarioDescription, start: true });
+            const response = await callApi('/api/scenario-chat', { scenario: currentScenarioDescription, start: true, session: true });
             showLoading(false);
+            scenarioSessionId = response?.session_id || null;
 
             if (response?.reply) {
                  addScenarioChatMessage('bot', response.reply);
@@ -392,7 +532,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     if (resetScenarioButton) {
         resetScenarioButton.addEventListener('click', () => {
-            console.log("Resetting scenario."); currentScenarioDescription = null; scenarioChatHistory = [];
+            console.log("Resetting scenario."); currentScenarioDescription = null; scenarioChatHistory = []; scenarioSessionId = null;
             if (scenarioChatBox) scenarioChatBox.innerHTML = ''; if (scenarioChatInput) scenarioChatInput.value = '';
             if (scenarioInteractionDiv) scenarioInteractionDiv.style.display = 'none'; if (scenarioSetupDiv) scenarioSetupDiv.style.display = 'block';
             if (scenarioDescriptionInput) scenarioDescriptionInput.value = '';
@@ -417,10 +557,13 @@ const summarizerInput = document.getElementById('summarizer-input');
             if (summarizerOutput) summarizerOutput.textContent = ''; // Clear previous output
             showOutputLoading('summarizer-output', true);
 
-            // Call the new backend endpoint
-            const response = await callApi('/api/summarize', {
+            // Call the new backend endpoint (streamed so the summary appears as it is written)
+            const response = await callApiStream('/api/summarize', {
                 text: textToSummarize
                 // Add other parameters like 'length' or 'style' if needed later
+            }, (chunk, textSoFar) => {
+                showOutputLoading('summarizer-output', false);
+                if (summarizerOutput) summarizerOutput.textContent = textSoFar;
             });
 
             showOutputLoading('summarizer-output', false);
@@ -507,7 +650,7 @@ const summarizerInput = document.getElementById('summarizer-input');
     const imagePreview = document.getElementById('image-preview');
     const objectIdentifierOutput = document.getElementById('object-identifier-output');
 
-    let uploadedImageData = { base64: null, mimeType: null }; // Store image data
+    let uploadedImageFile = null; // Sent as-is (multipart); the server downscales it
 
     // Listener for file input change
     if (objectImageUpload) {
@@ -518,7 +661,7 @@ const summarizerInput = document.getElementById('summarizer-input');
                 if(imagePreviewArea) imagePreviewArea.style.display = 'none';
                 if(imagePreview) imagePreview.src = '#';
                 if(identifyObjectsButton) identifyObjectsButton.disabled = true;
-                uploadedImageData = { base64: null, mimeType: null };
+                uploadedImageFile = null;
                 if(objectIdentifierOutput) objectIdentifierOutput.textContent = ''; // Clear output
                 return;
             }
@@ -530,45 +673,23 @@ const summarizerInput = document.getElementById('summarizer-input');
                 objectImageUpload.value = ''; // Reset file input
                 return;
             }
-            const maxSizeMB = 5; // Example: 5MB limit
+            const maxSizeMB = 15; // Matches the server's IMAGE_MAX_UPLOAD_BYTES default
             if (file.size > maxSizeMB * 1024 * 1024) {
                 alert(`File is too large. Maximum size is ${maxSizeMB}MB.`);
                 objectImageUpload.value = ''; // Reset file input
                 return;
             }
 
-            // Use FileReader to get Base64
-            const reader = new FileReader();
-
-            reader.onloadend = () => {
-                // Result includes prefix like "data:image/jpeg;base64,"
-                const fullDataUrl = reader.result;
-                if(imagePreview) imagePreview.src = fullDataUrl; // Show preview
-                if(imagePreviewArea) imagePreviewArea.style.display = 'block'; // Make preview area visible
-                if(identifyObjectsButton) identifyObjectsButton.disabled = false; // Enable button
-                if(objectIdentifierOutput) objectIdentifierOutput.textContent = ''; // Clear previous output
-
-                // Store the Base64 part and mime type
-                try {
-                    uploadedImageData.mimeType = fullDataUrl.substring(fullDataUrl.indexOf(':') + 1, fullDataUrl.indexOf(';'));
-                    uploadedImageData.base64 = fullDataUrl.substring(fullDataUrl.indexOf(',') + 1);
-                    console.log(`Image loaded. Type: ${uploadedImageData.mimeType}, Size: ~${(uploadedImageData.base64.length * 0.75 / 1024).toFixed(2)} KB`);
-                } catch (e) {
-                     console.error("Error processing image data URL:", e);
-                     alert("Could not process the selected image.");
-                     if(identifyObjectsButton) identifyObjectsButton.disabled = true;
-                     uploadedImageData = { base64: null, mimeType: null };
-                }
+            // Preview from an object URL instead of a base64 copy of the whole file
+            if (imagePreview) {
+                if (imagePreview.src.startsWith('blob:')) URL.revokeObjectURL(imagePreview.src);
+                imagePreview.src = URL.createObjectURL(file);
             }
-
-            reader.onerror = (error) => {
-                console.error('FileReader error:', error);
-                alert('Error reading the selected file.');
-                if(identifyObjectsButton) identifyObjectsButton.disabled = true;
-                uploadedImageData = { base64: null, mimeType: null };
-            };
-
-            reader.readAsDataURL(file); // Read the file as Base64 Data URL
+            if(imagePreviewArea) imagePreviewArea.style.display = 'block'; // Make preview area visible
+            if(identifyObjectsButton) identifyObjectsButton.disabled = false; // Enable button
+            if(objectIdentifierOutput) objectIdentifierOutput.textContent = ''; // Clear previous output
+            uploadedImageFile = file;
+            console.log(`Image selected. Type: ${file.type}, Size: ${(file.size / 1024).toFixed(2)} KB`);
         });
     } else {
         console.warn("Object Image Upload input not found.");
@@ -577,7 +698,7 @@ const summarizerInput = document.getElementById('summarizer-input');
     // Listener for Identify button click
     if (identifyObjectsButton) {
         identifyObjectsButton.addEventListener('click', async () => {
-            if (!uploadedImageData.base64 || !uploadedImageData.mimeType) {
+            if (!uploadedImageFile) {
                 alert('Please select a valid image first.');
                 return;
             }
@@ -588,10 +709,9 @@ const summarizerInput = document.getElementById('summarizer-input');
             showOutputLoading('object-identifier-output', true);
 
             // Call the backend endpoint for object identification/description
-            const response = await callApi('/api/identify-objects', {
-                image_data: uploadedImageData.base64,
-                mime_type: uploadedImageData.mimeType
-            });
+            const formData = new FormData();
+            formData.append('image', uploadedImageFile);
+            const response = await callApi('/api/identify-objects', formData);
 
             showOutputLoading('object-identifier-output', false);
 
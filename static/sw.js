@@ -1,21 +1,179 @@
 // static/sw.js
 
-const CACHE_NAME = 'adai-cache-v1'; // Change version number to update cache later
+// The /sw.js route prepends self.ASSET_MANIFEST (see asset_delivery.py): the fingerprinted URLs of every
+// static file and a cache name derived from their hashes, so a deploy that changes any asset changes this
+// script, installs a fresh cache and deletes the old one. Without it (file opened directly) nothing is precached.
+const precache = self.ASSET_MANIFEST || { cacheName: 'adai-cache-v1', urls: [] };
+const CACHE_NAME = precache.cacheName;
 const urlsToCache = [
   '/', // Cache the main HTML shell
   '/signin', // Cache the signin HTML shell
-  '/static/css/style.css', // Cache main CSS
-  '/static/js/script.js', // Cache main JS
-  '/static/js/firebase-config.js', // Cache Firebase config
-  // Add paths to your icons referenced in the manifest
-  '/static/icons/icon-192x192.png',
-  '/static/icons/icon-512x512.png',
-  // Add other essential static assets (maybe fonts, logo if separate file)
+  ...precache.urls, // CSS, JS, icons and the web manifest under their content-hashed /assets/ URLs
   // Note: Firebase SDKs loaded from gstatic.com won't be cached by this.
   'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css', // Example external asset (might fail if offline initially)
   // Be cautious caching external resources without CORS headers
 ];
 
+// --- API Result Cache ---
+// GET lookups (dictionary words, grammar topics) are kept in their own cache, which survives deploys:
+// answered from the cache at once, revalidated in the background with the server's ETag (a 304 just refreshes
+// the entry), and bounded by entry count and bytes, oldest first. A lookup made offline with nothing cached is
+// queued in IndexedDB and replayed when connectivity returns (Background Sync, or the page's 'online' event),
+// so the answer is waiting in the cache the next time it is asked for. Both belong to the signed-in user and are
+// cleared when the page reports a sign-out ('clear-user-data'), so the next user of a shared device starts empty.
+const API_CACHE_NAME = 'adai-api-v1';
+const API_CACHE_MAX_ENTRIES = 300;
+const API_CACHE_MAX_BYTES = 5 * 1024 * 1024;
+const CACHEABLE_API_PATHS = ['/api/dictionary', '/api/grammar_aid']; // Autocomplete has no ETag; the HTTP cache covers it
+const REPLAY_DB_NAME = 'adai-replay';
+const REPLAY_STORE = 'requests';
+const REPLAY_SYNC_TAG = 'adai-replay';
+const REPLAY_MAX_AGE_MS = 24 * 60 * 60 * 1000; // Older queued lookups are dropped rather than replayed
+
+function jsonResponse(body, status) {
+  return new Response(JSON.stringify(body), { status: status, headers: { 'Content-Type': 'application/json' } });
+}
+
+function maxAgeMs(response) {
+  const match = /max-age=(\d+)/.exec(response.headers.get('Cache-Control') || '');
+  return match ? Number(match[1]) * 1000 : 0;
+}
+
+// Copies a response with the time it was cached and its size, used for freshness and eviction
+async function stamped(response) {
+  const body = await response.blob();
+  const headers = new Headers(response.headers);
+  headers.set('sw-cached-at', String(Date.now()));
+  headers.set('sw-size', String(body.size));
+  return new Response(body, { status: response.status, statusText: response.statusText, headers: headers });
+}
+
+async function storeApiResult(cache, url, response) {
+  await cache.put(url, await stamped(response));
+  await evictApiResults(cache);
+}
+
+async function evictApiResults(cache) {
+  const keys = await cache.keys();
+  const entries = await Promise.all(keys.map(async key => {
+    const response = await cache.match(key, { ignoreVary: true });
+    return { key: key, cachedAt: Number(response && response.headers.get('sw-cached-at')) || 0, size: Number(response && response.headers.get('sw-size')) || 0 };
+  }));
+  entries.sort((a, b) => a.cachedAt - b.cachedAt);
+  let bytes = entries.reduce((total, entry) => total + entry.size, 0);
+  while (entries.length && (entries.length > API_CACHE_MAX_ENTRIES || bytes > API_CACHE_MAX_BYTES)) {
+    const oldest = entries.shift();
+    bytes -= oldest.size;
+    await cache.delete(oldest.key);
+  }
+}
+
+// Fetches a lookup from the server, revalidating the cached copy (if any) with its ETag
+async function revalidateApiResult(request, cache, cached) {
+  const headers = new Headers(request.headers);
+  const etag = cached && cached.headers.get('ETag');
+  if (etag) headers.set('If-None-Match', etag); // Our copy's validator, not whatever the page sent
+  let response;
+  try {
+    response = await fetch(request.url, { headers: headers, credentials: 'same-origin', cache: 'no-store' });
+  } catch (error) {
+    if (cached) throw error; // The page already has the stale copy
+    await queueReplay(request.url, request.headers.get('Authorization'));
+    return jsonResponse({ error: "You're offline. This lookup will be retried when you're back online.", queued: true }, 503);
+  }
+  if (response.status === 304 && cached) {
+    const current = await cache.match(request.url, { ignoreVary: true });
+    if (current) await cache.put(request.url, await stamped(current)); // Still valid: fresh again from now
+    return response;
+  }
+  if (response.ok) await storeApiResult(cache, request.url, response.clone());
+  return response;
+}
+
+async function staleWhileRevalidate(event) {
+  const request = event.request;
+  const cache = await caches.open(API_CACHE_NAME);
+  const cached = await cache.match(request.url, { ignoreVary: true }); // Vary: Accept-Encoding doesn't matter here
+  if (!cached) return revalidateApiResult(request, cache, null);
+  const age = Date.now() - (Number(cached.headers.get('sw-cached-at')) || 0);
+  if (age >= maxAgeMs(cached)) {
+    event.waitUntil(revalidateApiResult(request, cache, cached).catch(error => console.log('[ServiceWorker] Revalidation failed, keeping cached result:', request.url, error)));
+  }
+  const etag = cached.headers.get('ETag');
+  if (etag && request.headers.get('If-None-Match') === etag) {
+    return new Response(null, { status: 304, headers: { 'ETag': etag, 'Cache-Control': cached.headers.get('Cache-Control') || '' } });
+  }
+  return cached;
+}
+
+// --- Offline Lookup Queue (IndexedDB) ---
+function openReplayDb() {
+  return new Promise((resolve, reject) => {
+    const open = indexedDB.open(REPLAY_DB_NAME, 1);
+    open.onupgradeneeded = () => open.result.createObjectStore(REPLAY_STORE, { keyPath: 'url' }); // One entry per lookup
+    open.onsuccess = () => resolve(open.result);
+    open.onerror = () => reject(open.error);
+  });
+}
+
+async function withReplayStore(mode, fn) {
+  const db = await openReplayDb();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(REPLAY_STORE, mode);
+    const request = fn(tx.objectStore(REPLAY_STORE));
+    tx.oncomplete = () => { db.close(); resolve(request.result); };
+    tx.onerror = () => { db.close(); reject(tx.error); };
+  });
+}
+
+async function queueReplay(url, authorization) {
+  await withReplayStore('readwrite', store => store.put({ url: url, authorization: authorization, queuedAt: Date.now() }));
+  if (self.registration.sync) {
+    self.registration.sync.register(REPLAY_SYNC_TAG).catch(error => console.log('[ServiceWorker] Background Sync unavailable:', error));
+  }
+}
+
+// Replays queued lookups into the API cache; `token` (from the page) replaces the queued one, which may have expired
+async function replayQueued(token) {
+  const queued = await withReplayStore('readonly', store => store.getAll());
+  if (!queued.length) return;
+  const cache = await caches.open(API_CACHE_NAME);
+  for (const entry of queued) {
+    if (Date.now() - entry.queuedAt > REPLAY_MAX_AGE_MS) {
+      await withReplayStore('readwrite', store => store.delete(entry.url));
+      continue;
+    }
+    const authorization = token ? `Bearer ${token}` : entry.authorization;
+    const response = await fetch(entry.url, { headers: authorization ? { 'Authorization': authorization } : {}, credentials: 'same-origin', cache: 'no-store' });
+    if (response.status >= 500 || response.status === 429) continue; // Try again on the next replay
+    if (response.ok) await storeApiResult(cache, entry.url, response);
+    await withReplayStore('readwrite', store => store.delete(entry.url)); // Done, or rejected (e.g. expired token)
+  }
+  console.log('[ServiceWorker] Replayed queued lookups:', queued.length);
+}
+
+self.addEventListener('sync', event => {
+  if (event.tag === REPLAY_SYNC_TAG) event.waitUntil(replayQueued(null));
+});
+
+function clearUserData() {
+  const queueDeleted = new Promise((resolve, reject) => {
+    const request = indexedDB.deleteDatabase(REPLAY_DB_NAME);
+    request.onsuccess = () => resolve();
+    request.onerror = () => reject(request.error);
+  });
+  return Promise.all([caches.delete(API_CACHE_NAME), queueDeleted]);
+}
+
+self.addEventListener('message', event => {
+  if (event.data && event.data.type === 'replay') {
+    event.waitUntil(replayQueued(event.data.token).catch(error => console.log('[ServiceWorker] Replay failed:', error)));
+  }
+  if (event.data && event.data.type === 'clear-user-data') {
+    event.waitUntil(clearUserData().catch(error => console.error('[ServiceWorker] Failed to clear cached lookups:', error)));
+  }
+});
+
 // --- Install Service Worker & Cache Assets ---
 self.addEventListener('install', event => {
   console.log('[ServiceWorker] Install');
@@ -37,7 +195,7 @@ self.addEventListener('install', event => {
 // --- Activate Service Worker & Clean Up Old Caches ---
 self.addEventListener('activate', event => {
   console.log('[ServiceWorker] Activate');
-  const cacheWhitelist = [CACHE_NAME]; // Only keep the current cache
+  const cacheWhitelist = [CACHE_NAME, API_CACHE_NAME]; // Only keep the current cache (and cached API results)
   event.waitUntil(
     caches.keys().then(cacheNames => {
       return Promise.all(
@@ -56,7 +214,13 @@ self.addEventListener('activate', event => {
 self.addEventListener('fetch', event => {
   const requestUrl = new URL(event.request.url);
 
-  // --- Strategy: Network first for API calls ---
+  // --- Strategy: Stale-while-revalidate for GET lookups ---
+  if (event.request.method === 'GET' && CACHEABLE_API_PATHS.includes(requestUrl.pathname)) {
+    event.respondWith(staleWhileRevalidate(event));
+    return;
+  }
+
+  // --- Strategy: Network first for other API calls ---
   if (requestUrl.pathname.startsWith('/api/')) {
     // console.log('[ServiceWorker] Fetching API (Network first):', event.request.url);
     event.respondWith(
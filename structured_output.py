@@ -0,0 +1,59 @@
+"""JSON structured output for Gemini endpoints.
+
+Endpoints describe the reply they want with a small schema dict (the OpenAPI
+subset Gemini's response_schema accepts: object/array/string/boolean with
+properties, items and required). The same dict is used to request JSON output
+and to validate what comes back, so the reply is parsed exactly once instead
+of searching free text for section markers.
+"""
+import json
+
+
+def generation_config(schema):
+    """Gemini generation_config asking for JSON matching `schema`."""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def parse(text, schema):
+    """Returns the validated payload, or None if `text` isn't JSON matching `schema`."""
+    if not isinstance(text, str): return None
+    text = text.strip()
+    if text.startswith("```"): # Tolerate a fenced block if the model adds one anyway
+        text = text.strip("`").partition("\n")[2].strip()
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return None
+    return payload if validate(payload, schema) else None
+
+
+def validate(value, schema):
+    """True if `value` matches `schema` (required strings must also be non-empty)."""
+    kind = schema.get("type")
+    if kind == "object":
+        if not isinstance(value, dict): return False
+        properties = schema.get("properties", {})
+        for name in schema.get("required", ()):
+            if name not in value: return False
+            if properties.get(name, {}).get("type") == "string" and not str(value[name]).strip(): return False
+        return all(validate(value[name], subschema) for name, subschema in properties.items() if name in value)
+    if kind == "array":
+        return isinstance(value, list) and all(validate(item, schema.get("items", {})) for item in value)
+    if kind == "string": return isinstance(value, str)
+    if kind == "boolean": return isinstance(value, bool)
+    if kind in ("integer", "number"): return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return True
+
+
+def repair_prompt(raw_text, schema):
+    """Prompt for the one-shot repair call after a malformed reply."""
+    return f"""The text below was supposed to be a single JSON value matching this JSON schema, but it is malformed or incomplete.
+Return only the corrected JSON, keeping the original content wherever possible.
+
+Schema:
+{json.dumps(schema)}
+
+Text:
+---
+{raw_text[:20000]}
+---"""
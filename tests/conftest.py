@@ -0,0 +1,9 @@
+"""Points the app's on-disk stores at a scratch directory before any test imports app.py."""
+import os
+import tempfile
+
+_scratch = tempfile.mkdtemp(prefix="adai-tests-")
+for _variable, _name in (("JOBS_DB", "jobs.sqlite3"), ("LEXICON_DB", "lexicon.sqlite3"), ("SEMANTIC_CACHE_DB", "semantic.sqlite3"),
+                         ("SESSION_STORE_DB", "sessions.sqlite3"), ("TTS_CACHE_DIR", "tts"), ("ASSET_BUILD_DIR", "assets")):
+    os.environ[_variable] = os.path.join(_scratch, _name)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
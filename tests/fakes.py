@@ -0,0 +1,61 @@
+"""Local stand-ins for external services, shared by the tests and the benchmark harness.
+
+FakeFirebaseIssuer signs Firebase-shaped ID tokens with a local RSA key and
+serves the matching certificate, so token verification runs without Google.
+"""
+import time
+
+
+class FakeFirebaseIssuer:
+    """Mints Firebase-shaped ID tokens signed with a locally generated RSA key.
+
+    fetch_certs() stands in for Google's certificate endpoint (it is the
+    `fetch` callable firebase_auth.CertCache expects). The key can be saved to
+    a PEM file so gunicorn workers and the benchmark's load generator share it.
+    """
+
+    def __init__(self, project_id="bench-project", key_pem=None, key_id="bench-key", cert_max_age=3600):
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        self.project_id = project_id
+        self.key_id = key_id
+        self.cert_max_age = cert_max_age
+        if key_pem is None:
+            key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+        self.key_pem = key_pem
+        self.cert_pem = _self_signed_cert(key_pem)
+        self.cert_fetches = 0
+
+    @classmethod
+    def from_file(cls, path, project_id):
+        with open(path, "rb") as f: return cls(project_id, key_pem=f.read())
+
+    def save_key(self, path):
+        with open(path, "wb") as f: f.write(self.key_pem)
+
+    def fetch_certs(self):
+        self.cert_fetches += 1
+        return {self.key_id: self.cert_pem}, self.cert_max_age
+
+    def mint(self, uid, lifetime=3600, **claims):
+        """Signed ID token for `uid`; keyword arguments override claims (aud, iss, exp, ...)."""
+        from google.auth import crypt, jwt
+        now = int(time.time())
+        payload = {"iss": f"https://securetoken.google.com/{self.project_id}", "aud": self.project_id, "sub": uid,
+                   "user_id": uid, "auth_time": now, "iat": now, "exp": now + lifetime, **claims}
+        return jwt.encode(crypt.RSASigner.from_string(self.key_pem, key_id=self.key_id), payload).decode("ascii")
+
+
+def _self_signed_cert(key_pem):
+    import datetime
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.x509.oid import NameOID
+    key = serialization.load_pem_private_key(key_pem, password=None)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "fake-securetoken")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=30)).sign(key, hashes.SHA256()))
+    return cert.public_bytes(serialization.Encoding.PEM).decode("ascii")
@@ -0,0 +1,56 @@
+"""Admission control: per-user and global token buckets, batch reserve, shared SQLite buckets."""
+import pytest
+
+from admission import BATCH, INTERACTIVE, AdmissionController, MemoryBucketStore, Rejected, SqliteBucketStore
+
+
+def make_controller(store=None, **kwargs):
+    limits = {"user_rpm": 2, "user_tpm": 1000, "global_rpm": 100, "global_tpm": 100000, "batch_queue_timeout": 0, **kwargs}
+    return AdmissionController(store or MemoryBucketStore(), **limits)
+
+
+def test_user_over_budget_is_rejected_with_retry_after():
+    controller = make_controller()
+    controller.admit("alice", INTERACTIVE, 10)
+    controller.admit("alice", INTERACTIVE, 10)
+    with pytest.raises(Rejected) as rejected:
+        controller.admit("alice", INTERACTIVE, 10)
+    assert rejected.value.reason == "user_rpm"
+    assert rejected.value.retry_after >= 1
+    controller.admit("bob", INTERACTIVE, 10) # Budgets are per user
+
+
+def test_without_a_user_only_global_buckets_apply():
+    controller = make_controller(global_rpm=5)
+    for _ in range(5): controller.admit(None, INTERACTIVE, 10)
+    with pytest.raises(Rejected) as rejected:
+        controller.admit(None, INTERACTIVE, 10)
+    assert rejected.value.reason == "global_rpm"
+
+
+def test_batch_is_shed_at_the_reserve_while_interactive_continues():
+    controller = make_controller(user_rpm=100, global_rpm=10, batch_reserve=0.5)
+    for _ in range(5): controller.admit("alice", BATCH, 10)
+    with pytest.raises(Rejected):
+        controller.admit("alice", BATCH, 10)
+    controller.admit("alice", INTERACTIVE, 10)
+    assert controller.stats()["rejected"] == {"global_rpm": 1}
+
+
+def test_rejected_request_refunds_the_buckets_it_passed():
+    store = MemoryBucketStore()
+    controller = make_controller(store, user_rpm=100, global_rpm=1)
+    controller.admit("alice", INTERACTIVE, 10)
+    with pytest.raises(Rejected):
+        controller.admit("alice", INTERACTIVE, 10)
+    allowed, _ = store.take("user:alice:rpm", 98, 100 / 60.0, 100) # Only the admitted request was charged
+    assert allowed
+
+
+def test_sqlite_buckets_are_shared_between_stores(tmp_path):
+    path = str(tmp_path / "buckets.sqlite3")
+    first, second = make_controller(SqliteBucketStore(path)), make_controller(SqliteBucketStore(path))
+    first.admit("alice", INTERACTIVE, 10)
+    second.admit("alice", INTERACTIVE, 10)
+    with pytest.raises(Rejected):
+        first.admit("alice", INTERACTIVE, 10)
@@ -0,0 +1,46 @@
+"""Caller identity without Firebase uids: the socket address, or the proxied one with ProxyFix (TRUSTED_PROXY_HOPS)."""
+import pytest
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.test import Client
+
+import app as adai
+
+SPOOFED = {"X-Forwarded-For": "6.6.6.6, 203.0.113.7"} # Client-written entry, then the one our proxy appended
+
+
+def identities(hops, headers, remote_addr="10.0.0.1"):
+    """(_client_id, _admission_user) of an anonymous request passing through `hops` trusted proxies."""
+    seen = {}
+    def view(environ, start_response):
+        with adai.app.request_context(environ):
+            seen["ids"] = (adai._client_id({}), adai._admission_user({}))
+        start_response("204 No Content", [])
+        return []
+    wsgi = ProxyFix(view, x_for=hops) if hops else view
+    Client(wsgi).get("/", headers=headers, environ_base={"REMOTE_ADDR": remote_addr})
+    return seen["ids"]
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(monkeypatch):
+    monkeypatch.setattr(adai, "TRUSTED_PROXY_HOPS", 0)
+    assert identities(0, SPOOFED) == ("10.0.0.1", "10.0.0.1")
+
+
+def test_only_hops_appended_by_trusted_proxies_count(monkeypatch):
+    monkeypatch.setattr(adai, "TRUSTED_PROXY_HOPS", 1)
+    assert identities(1, SPOOFED) == ("203.0.113.7", "203.0.113.7")
+
+
+def test_unconfigured_proxy_hops_leave_anonymous_callers_on_global_budgets(monkeypatch):
+    monkeypatch.setattr(adai, "TRUSTED_PROXY_HOPS", None)
+    client_id, admission_user = identities(0, SPOOFED)
+    assert client_id == "10.0.0.1"
+    assert admission_user is None
+
+
+@pytest.mark.parametrize("hops", [None, 0, 1])
+def test_firebase_uid_is_used_whenever_present(monkeypatch, hops):
+    monkeypatch.setattr(adai, "TRUSTED_PROXY_HOPS", hops)
+    with adai.app.test_request_context(headers=SPOOFED):
+        assert adai._client_id({"uid": "user-1"}) == "user-1"
+        assert adai._admission_user({"uid": "user-1"}) == "user-1"
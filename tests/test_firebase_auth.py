@@ -0,0 +1,82 @@
+"""Offline verification of Firebase ID tokens against locally generated keys (tests.fakes.FakeFirebaseIssuer)."""
+import time
+
+import pytest
+
+from firebase_auth import AuthError, CertCache, TokenVerifier
+from tests.fakes import FakeFirebaseIssuer
+
+PROJECT = "test-project"
+
+
+@pytest.fixture(scope="module")
+def issuer():
+    return FakeFirebaseIssuer(PROJECT, key_id="key-1")
+
+
+@pytest.fixture
+def verifier(issuer):
+    issuer.cert_fetches = 0
+    return TokenVerifier(PROJECT, CertCache(issuer.fetch_certs))
+
+
+def test_valid_token_is_accepted(issuer, verifier):
+    claims = verifier.verify(issuer.mint("user-1"))
+    assert claims["uid"] == "user-1"
+    assert claims["aud"] == PROJECT
+
+
+@pytest.mark.parametrize("claims", [{"aud": "other-project"}, {"iss": "https://securetoken.google.com/other-project"},
+                                    {"iss": "https://accounts.google.com"}])
+def test_wrong_audience_or_issuer_is_rejected(issuer, verifier, claims):
+    with pytest.raises(AuthError):
+        verifier.verify(issuer.mint("user-1", **claims))
+    assert verifier.rejected == 1
+
+
+def test_expired_token_is_rejected(issuer, verifier):
+    now = int(time.time())
+    with pytest.raises(AuthError):
+        verifier.verify(issuer.mint("user-1", iat=now - 7200, auth_time=now - 7200, exp=now - 3600))
+
+
+def test_bad_signature_is_rejected(issuer, verifier):
+    impostor = FakeFirebaseIssuer(PROJECT, key_id="key-1") # Same key id, different private key
+    with pytest.raises(AuthError):
+        verifier.verify(impostor.mint("user-1"))
+    header, payload, signature = issuer.mint("user-1").split(".")
+    with pytest.raises(AuthError):
+        verifier.verify(f"{header}.{payload}.{signature[:-8]}AAAAAAAA")
+
+
+def test_unknown_key_id_is_rejected(issuer, verifier):
+    stranger = FakeFirebaseIssuer(PROJECT, key_id="key-unknown")
+    with pytest.raises(AuthError, match="unknown key"):
+        verifier.verify(stranger.mint("user-1"))
+
+
+@pytest.mark.parametrize("token", ["", "not-a-token", "a.b.c", "eyJhbGciOiJSUzI1NiJ9.e30"])
+def test_malformed_token_is_rejected(verifier, token):
+    with pytest.raises(AuthError):
+        verifier.verify(token)
+
+
+def test_repeat_token_is_served_from_the_lru(issuer, verifier):
+    token = issuer.mint("user-1")
+    first = verifier.verify(token)
+    assert verifier.verify(token) is first
+    assert (verifier.hits, verifier.misses) == (1, 1)
+    assert issuer.cert_fetches == 1
+
+
+def test_unknown_key_id_refreshes_the_certificates(issuer):
+    rotated = FakeFirebaseIssuer(PROJECT, key_id="key-2")
+    published = {"key-1": issuer.cert_pem}
+    certs = CertCache(lambda: (dict(published), 3600), unknown_kid_interval=0)
+    verifier = TokenVerifier(PROJECT, certs)
+    verifier.verify(issuer.mint("user-1"))
+    assert certs.fetches == 1
+    published["key-2"] = rotated.cert_pem # Google rotates its signing keys
+    certs._last_fetch -= 10 # Past the guard against back-to-back refreshes
+    assert verifier.verify(rotated.mint("user-2"))["uid"] == "user-2"
+    assert certs.fetches == 2
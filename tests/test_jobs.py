@@ -0,0 +1,102 @@
+"""SQLite job queue: running, retries, lease renewal, sweeping and off-thread webhooks."""
+import threading
+import time
+
+import pytest
+
+from jobs import DONE, FAILED, RUNNING, JobQueue
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    def make(**kwargs):
+        return JobQueue(str(tmp_path / "jobs.sqlite3"), **{"poll_interval": 0.05, **kwargs})
+    return make
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition(): return True
+        time.sleep(0.02)
+    return False
+
+
+def test_job_runs_and_keeps_its_result(make_queue):
+    queue = make_queue()
+    queue.register("echo", lambda payload: {"echo": payload["text"]})
+    job_id = queue.submit("echo", {"text": "hi"}, owner="alice")
+    assert wait_for(lambda: queue.get(job_id)["status"] == DONE)
+    job = queue.get(job_id)
+    assert job["result"] == {"echo": "hi"} and job["owner"] == "alice" and job["attempts"] == 1
+
+
+def test_failed_attempt_is_retried_then_gives_up(make_queue):
+    queue = make_queue(max_attempts=2)
+    calls = []
+    def flaky(payload):
+        calls.append(1)
+        raise RuntimeError("upstream down")
+    queue.register("flaky", flaky)
+    job_id = queue.submit("flaky", {})
+    assert wait_for(lambda: queue.get(job_id)["status"] == FAILED)
+    assert len(calls) == 2
+    assert queue.stats()["retried"] == 1
+
+
+def test_lease_is_renewed_while_a_long_handler_runs(make_queue):
+    queue = make_queue(workers=2, lease_seconds=0.3)
+    calls = []
+    def slow(payload):
+        calls.append(1)
+        time.sleep(1.2) # Four leases long
+        return {"ok": True}
+    queue.register("slow", slow)
+    job_id = queue.submit("slow", {})
+    assert wait_for(lambda: queue.get(job_id)["status"] == DONE)
+    assert len(calls) == 1
+
+
+def test_stale_attempt_cannot_overwrite_the_current_one(make_queue):
+    queue = make_queue(workers=0, lease_seconds=0.01)
+    queue.register("echo", lambda payload: payload)
+    job_id = queue.submit("echo", {})
+    first = queue._claim()
+    time.sleep(0.05) # The first attempt's process "died"; its lease expires
+    second = queue._claim()
+    assert (first[1], second[1]) == (1, 2)
+    queue._finish(job_id, first[1], DONE, {"from": "first"})
+    assert queue.get(job_id)["status"] == RUNNING
+    queue._finish(job_id, second[1], DONE, {"from": "second"})
+    assert queue.get(job_id)["result"] == {"from": "second"}
+
+
+def test_expired_results_are_swept_while_workers_are_busy(make_queue):
+    queue = make_queue(workers=1, result_ttl=0.1, sweep_interval=0.05)
+    release = threading.Event()
+    queue.register("quick", lambda payload: {})
+    queue.register("block", lambda payload: release.wait(5) and {})
+    job_id = queue.submit("quick", {})
+    assert wait_for(lambda: queue.get(job_id)["status"] == DONE)
+    queue.submit("block", {}) # Keeps the only worker from ever going idle
+    try:
+        assert wait_for(lambda: queue.get(job_id) is None, timeout=2)
+    finally:
+        release.set()
+
+
+def test_slow_on_finish_does_not_hold_up_the_worker(make_queue):
+    release = threading.Event()
+    notified = []
+    def on_finish(job):
+        release.wait(5) # A webhook endpoint that hangs
+        notified.append(job["job_id"])
+    queue = make_queue(workers=1, on_finish=on_finish)
+    queue.register("echo", lambda payload: payload)
+    first, second = queue.submit("echo", {}), queue.submit("echo", {})
+    try:
+        assert wait_for(lambda: queue.get(second)["status"] == DONE, timeout=2)
+        assert notified == []
+    finally:
+        release.set()
+    assert wait_for(lambda: sorted(notified) == sorted([first, second]))
@@ -0,0 +1,52 @@
+"""ModelRouter fallback and cancellation, with sleeping stand-ins for Gemini calls."""
+import threading
+import time
+
+import google.api_core.exceptions
+import pytest
+
+from model_router import Cancelled, ModelRouter
+
+
+def make_router(**kwargs):
+    return ModelRouter(resolve=lambda name: name, default_chain=["primary", "fallback"], **kwargs)
+
+
+def test_concurrent_cancellable_calls_are_not_serialized():
+    router = make_router(hedge_pool_size=2)
+    results = []
+    def call():
+        results.append(router.call("chat", lambda model, timeout: time.sleep(0.3) or model, cancelled=lambda: False))
+    threads = [threading.Thread(target=call) for _ in range(32)]
+    started = time.monotonic()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert time.monotonic() - started < 1.5 # 32 calls through a 2-slot pool would take ~4.8 s
+    assert results == [("primary", "primary")] * 32
+
+
+def test_cancelled_call_returns_without_waiting_for_upstream():
+    router = make_router()
+    gone = threading.Event()
+    threading.Timer(0.1, gone.set).start()
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        router.call("chat", lambda model, timeout: time.sleep(2), cancelled=gone.is_set)
+    assert time.monotonic() - started < 1.0
+
+
+def test_already_disconnected_client_makes_no_call():
+    router = make_router()
+    calls = []
+    with pytest.raises(Cancelled):
+        router.call("chat", lambda model, timeout: calls.append(model), cancelled=lambda: True)
+    assert calls == []
+
+
+def test_retryable_error_falls_back_to_the_next_model():
+    router = make_router()
+    def fn(model, timeout):
+        if model == "primary": raise google.api_core.exceptions.ResourceExhausted("quota")
+        return "ok"
+    assert router.call("chat", fn, cancelled=lambda: False) == ("fallback", "ok")
+    assert router.fallbacks == 1
@@ -0,0 +1,64 @@
+"""Response-cache keys follow the routed model; fallback answers are cached only briefly."""
+from types import SimpleNamespace
+
+import google.api_core.exceptions
+import pytest
+
+import app as adai
+from model_router import ModelRouter
+from response_cache import MemoryTier, ResponseCache
+
+
+class FakeModel:
+    def __init__(self, name, calls, failing=()):
+        self.name, self.calls, self.failing = name, calls, failing
+
+    def generate_content(self, prompt, request_options=None, **kwargs):
+        self.calls.append(self.name)
+        if self.name in self.failing: raise google.api_core.exceptions.ResourceExhausted("quota")
+        part = SimpleNamespace(text=f"{self.name} answer")
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))], text=part.text)
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls, failing = [], set()
+    monkeypatch.setattr(adai, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(adai, "get_text_model", lambda: object())
+    monkeypatch.setattr(adai, "response_cache", ResponseCache([MemoryTier()]))
+    def route(routes):
+        monkeypatch.setattr(adai, "model_router", ModelRouter(lambda name: FakeModel(name, calls, failing), routes, ["default"]))
+    return SimpleNamespace(calls=calls, failing=failing, route=route)
+
+
+def ask(prompt="Explain the present perfect"):
+    with adai.app.test_request_context():
+        return adai.generate_gemini_response(prompt, endpoint="grammar_aid")
+
+
+def test_rerouting_a_task_does_not_serve_the_old_models_answers(upstream):
+    upstream.route({"grammar_aid": ["flash"]})
+    assert ask() == ask() == "flash answer"
+    upstream.route({"grammar_aid": ["pro"]})
+    assert ask() == "pro answer"
+    assert upstream.calls == ["flash", "pro"]
+
+
+def test_fallback_answers_are_not_kept_past_the_fallback_ttl(upstream, monkeypatch):
+    monkeypatch.setattr(adai, "FALLBACK_CACHE_TTL", 0)
+    upstream.route({"grammar_aid": ["flash", "backup"]})
+    upstream.failing.add("flash")
+    assert ask() == "backup answer"
+    upstream.failing.clear()
+    assert ask() == "flash answer" # The fallback's answer wasn't cached
+    assert ask() == "flash answer"
+    assert upstream.calls == ["flash", "backup", "flash"]
+
+
+def test_fallback_answers_get_the_short_ttl(upstream, monkeypatch):
+    stored = []
+    monkeypatch.setattr(adai.response_cache, "set", lambda key, value, ttl: stored.append((value, ttl)))
+    upstream.route({"grammar_aid": ["flash", "backup"]})
+    upstream.failing.add("flash")
+    ask()
+    assert stored == [("backup answer", adai.FALLBACK_CACHE_TTL)]
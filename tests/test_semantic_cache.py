@@ -0,0 +1,93 @@
+"""Semantic cache normalization, near hits, persistence and audits."""
+import time
+
+import pytest
+
+from app import GRAMMAR_TOPIC_FILLERS
+from semantic_cache import SemanticCache, lemma, normalize, singular
+
+GRAMMAR = dict(fillers=frozenset(GRAMMAR_TOPIC_FILLERS), lemmatize=singular)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("a vs an", "the vs a"), ("do vs does", "does vs did"), ("was vs were", "is vs are"), ("had vs have", "have vs has"),
+    ("bored vs boring", "interested vs interesting"), ("present simple", "past simple"), ("much vs many", "few vs little"),
+])
+def test_distinct_grammar_topics_keep_distinct_keys(first, second):
+    assert normalize(first, **GRAMMAR) != normalize(second, **GRAMMAR)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Present Perfect tense", "present perfect"), ("Explain relative clauses, please!", "relative clause"),
+    ("a vs an", "a vs an"), ("was vs were", "was vs were"),
+])
+def test_grammar_topics_fold_case_punctuation_meta_words_and_plurals(query, expected):
+    assert normalize(query, **GRAMMAR) == expected
+
+
+@pytest.mark.parametrize("word", ["news", "goods", "united", "means", "glasses", "morning", "during", "species"])
+def test_dictionary_words_are_not_lemmatized(word):
+    assert normalize(word) == word
+    assert normalize(word.capitalize() + "!") == word
+
+
+def test_lemma_handles_regular_and_irregular_forms():
+    assert [lemma(word) for word in ("running", "ran", "making", "opened", "children")] == ["run", "run", "make", "open", "child"]
+
+
+def make_cache(path=":memory:", **kwargs):
+    cache = SemanticCache(path, audit_rate=0, **kwargs)
+    cache.configure("grammar_aid", 0.85, GRAMMAR_TOPIC_FILLERS, singular)
+    cache.configure("dictionary", 1.0)
+    return cache
+
+
+def test_near_duplicate_grammar_topic_hits():
+    cache = make_cache()
+    cache.set("grammar_aid", "relative clauses", "explanation", 60)
+    assert cache.get("grammar_aid", "The relative clause") == "explanation"
+    assert cache.get("grammar_aid", "conditionals") is None
+
+
+def test_neighbouring_grammar_topics_do_not_hit_each_other():
+    cache = make_cache()
+    cache.set("grammar_aid", "do vs does", "do", 60)
+    cache.set("grammar_aid", "was vs were", "was", 60)
+    assert cache.get("grammar_aid", "does vs did") is None
+    assert cache.get("grammar_aid", "is vs are") is None
+
+
+def test_dictionary_matches_exact_words_only():
+    cache = make_cache()
+    cache.set("dictionary", "news", "news entry", 60)
+    assert cache.get("dictionary", "new") is None
+    assert cache.get("dictionary", "News") == "news entry"
+
+
+def test_expired_entries_miss():
+    cache = make_cache()
+    cache.set("dictionary", "word", "entry", 0.01)
+    time.sleep(0.05)
+    assert cache.get("dictionary", "word") is None
+
+
+def test_entries_persist_and_ones_normalized_differently_are_skipped(tmp_path):
+    path = str(tmp_path / "semantic.sqlite3")
+    old = SemanticCache(path, audit_rate=0)
+    old.configure("dictionary", 1.0, lemmatize=lemma) # Earlier settings: "news" stored under "new"
+    old.set("dictionary", "news", "news entry", 60)
+    old.set("dictionary", "apple", "apple entry", 60)
+    cache = make_cache(path)
+    assert cache.load() == 1
+    assert cache.get("dictionary", "new") is None
+    assert cache.get("dictionary", "apple") == "apple entry"
+
+
+def test_audited_near_hit_with_a_different_answer_counts_as_false_hit():
+    cache = SemanticCache(audit_rate=1.0, audit_min_similarity=0.3)
+    cache.configure("grammar_aid", 0.85, GRAMMAR_TOPIC_FILLERS, singular)
+    cache.set("grammar_aid", "relative clauses", "who which that defining clauses", 60)
+    assert cache.get("grammar_aid", "the relative clause") is None # Withheld for the audit
+    cache.set("grammar_aid", "the relative clause", "completely unrelated reply about football", 60)
+    audits = cache.recent_audits()
+    assert len(audits) == 1 and audits[0]["false_hit"]
@@ -0,0 +1,82 @@
+"""SingleFlight: in-process coalescing, waiter accounting and per-key lock files shared between "processes".
+
+Two SingleFlight groups on one lock directory stand in for two gunicorn
+workers: flock locks belong to the open file, so they exclude each other
+within one process too.
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_in_threads(count, target):
+    results = [None] * count
+    def run(index): results[index] = target()
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return results
+
+
+def test_concurrent_callers_share_one_call():
+    group = SingleFlight("test")
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "answer"
+    assert run_in_threads(5, lambda: group.do("key", slow)) == ["answer"] * 5
+    assert len(calls) == 1
+    assert group.stats()["leaders"] == 1 and group.stats()["coalesced"] == 4 and group.stats()["in_flight"] == 0
+
+
+def test_leader_error_reaches_followers():
+    group = SingleFlight("test")
+    leader = group.begin("key")
+    follower = group.begin("key")
+    leader.finish(error=ValueError("upstream failed"))
+    with pytest.raises(ValueError):
+        follower.wait(1)
+
+
+def test_follower_that_stops_waiting_is_no_longer_counted():
+    group = SingleFlight("test")
+    leader = group.begin("key")
+    follower = group.begin("key")
+    assert group.waiters("key") == 1
+    with pytest.raises(TimeoutError):
+        follower.wait(0.05)
+    assert group.waiters("key") == 0 # The leader may now cancel its upstream call
+    leader.finish("late")
+
+
+def test_leader_in_another_process_is_waited_for_then_rechecked(tmp_path):
+    first, second = SingleFlight("test", lock_dir=str(tmp_path)), SingleFlight("test", lock_dir=str(tmp_path))
+    leader = first.begin("key")
+    threading.Timer(0.2, leader.finish, args=("answer",)).start()
+    calls = []
+    assert second.do("key", lambda: calls.append(1) or "fresh", recheck=lambda: "cached") == "cached"
+    assert calls == [] and second.stats()["cross_process_waits"] == 1
+
+
+def test_other_keys_are_not_held_up_by_a_leader_in_another_process(tmp_path):
+    first, second = SingleFlight("test", lock_dir=str(tmp_path)), SingleFlight("test", lock_dir=str(tmp_path), lock_timeout=5)
+    leader = first.begin("key")
+    started = time.monotonic()
+    try:
+        assert second.do("other key", lambda: "fresh", recheck=lambda: "cached") == "fresh"
+        assert second.do("key", lambda: "fresh") == "fresh" # Nothing to recheck: coalesced in-process only
+    finally:
+        leader.finish("answer")
+    assert time.monotonic() - started < 1.0
+    assert second.stats()["cross_process_waits"] == 0
+
+
+def test_lock_files_are_removed_when_leaders_finish(tmp_path):
+    group = SingleFlight("test", lock_dir=str(tmp_path))
+    for index in range(3): group.do(f"key {index}", lambda: "answer", recheck=lambda: None)
+    assert os.listdir(tmp_path / "test") == []